@@ -1,11 +1,27 @@
 import os
+import io
+import re
+import sys
+import csv
+import json
+import math
+import time
+import shutil
+import bisect
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+import weakref
+from collections import deque
+from contextlib import contextmanager, redirect_stdout
+from functools import lru_cache
+from datetime import datetime, timedelta
 import psycopg2
+import psycopg2.errors
+import psycopg2.extras
 from dotenv import load_dotenv
 from typing import Optional
-from google import genai
-from google.genai import types
-import matplotlib.pyplot as plt
-import numpy as np
 
 load_dotenv()
 
@@ -15,6 +31,56 @@ DB_HOST = os.getenv("DB_HOST")
 DB_NAME = os.getenv("DB_NAME")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+HISTORICO_TEXT2SQL = int(os.getenv("HISTORICO_TEXT2SQL", "10"))
+TEXT2SQL_CACHE = os.getenv("TEXT2SQL_CACHE", ".text2sql_cache.sqlite3")
+TEXT2SQL_CACHE_MAX = int(os.getenv("TEXT2SQL_CACHE_MAX", "500"))
+TEXT2SQL_CACHE_TTL = float(os.getenv("TEXT2SQL_CACHE_TTL", str(7 * 24 * 3600)))
+TEXT2SQL_EXEMPLOS = os.getenv("TEXT2SQL_EXEMPLOS", ".text2sql_exemplos.sqlite3")
+TEXT2SQL_EXEMPLOS_K = int(os.getenv("TEXT2SQL_EXEMPLOS_K", "3"))
+TEXT2SQL_EXEMPLOS_MAX = int(os.getenv("TEXT2SQL_EXEMPLOS_MAX", "2000"))
+TEXT2SQL_EXEMPLOS_SIMILARIDADE = float(os.getenv("TEXT2SQL_EXEMPLOS_SIMILARIDADE", "0.2"))
+TEXT2SQL_PODAR_ESQUEMA = os.getenv("TEXT2SQL_PODAR_ESQUEMA", "1") == "1"
+TEXT2SQL_MAX_LINHAS_RESUMO = int(os.getenv("TEXT2SQL_MAX_LINHAS_RESUMO", "10"))
+TEXT2SQL_CONCORRENCIA = int(os.getenv("TEXT2SQL_CONCORRENCIA", "4"))
+TEXT2SQL_RESPOSTA_JSON = os.getenv("TEXT2SQL_RESPOSTA_JSON", "1") == "1"
+TEXT2SQL_STREAMING = os.getenv("TEXT2SQL_STREAMING", "1") == "1"
+TEXT2SQL_CUSTO_MAX = float(os.getenv("TEXT2SQL_CUSTO_MAX", "2000000"))
+TEXT2SQL_MAX_LINHAS = int(os.getenv("TEXT2SQL_MAX_LINHAS", "10000"))
+TEXT2SQL_TIMEOUT_MS = int(os.getenv("TEXT2SQL_TIMEOUT_MS", "30000"))
+
+ESCALA_DADOS = float(os.getenv("ESCALA_DADOS", "1"))
+SEMENTE_DADOS = int(os.getenv("SEMENTE_DADOS", "42"))
+LOTE_COPY = int(os.getenv("LOTE_COPY", "50000"))
+LOTE_CRUD = int(os.getenv("LOTE_CRUD", "1000"))
+ITERSIZE_CONSULTA = int(os.getenv("ITERSIZE_CONSULTA", "2000"))
+USAR_VIEWS_MATERIALIZADAS = os.getenv("USAR_VIEWS_MATERIALIZADAS", "0") == "1"
+INTERVALO_REFRESH_MV = float(os.getenv("INTERVALO_REFRESH_MV", "60"))
+GRAFICOS_DIR = os.getenv("GRAFICOS_DIR", "graficos")
+GRAFICOS_FORMATOS = os.getenv("GRAFICOS_FORMATOS", "png,svg")
+GRAFICOS_PROCESSOS = int(os.getenv("GRAFICOS_PROCESSOS", "0"))
+PARTICIONAR_RESERVAS = os.getenv("PARTICIONAR_RESERVAS", "0") == "1"
+PARTICAO_INTERVALO = os.getenv("PARTICAO_INTERVALO", "mes")
+PARTICOES_DESDE = os.getenv("PARTICOES_DESDE", "2023-01-01")
+PARTICOES_FUTURAS = int(os.getenv("PARTICOES_FUTURAS", "3"))
+PARQUET_DIR = os.getenv("PARQUET_DIR", "parquet")
+PARQUET_BLOCO_BYTES = int(os.getenv("PARQUET_BLOCO_BYTES", str(8 * 1024 * 1024)))
+CONSULTAS_EM_PARQUET = os.getenv("CONSULTAS_EM_PARQUET", "0") == "1"
+
+SHARDS = os.getenv("SHARDS", "")
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_VERIFICACAO = float(os.getenv("DB_POOL_VERIFICACAO", "30"))
+DB_REPLICAS = os.getenv("DB_REPLICAS", "")
+REPLICA_ATRASO_MAX = float(os.getenv("REPLICA_ATRASO_MAX", "30"))
+REPLICA_VERIFICACAO = float(os.getenv("REPLICA_VERIFICACAO", "5"))
+
+INSTRUMENTAR_CONSULTAS = os.getenv("INSTRUMENTAR_CONSULTAS", "1") == "1"
+CONSULTA_LENTA_MS = float(os.getenv("CONSULTA_LENTA_MS", "500"))
+LOG_CONSULTAS_LENTAS = os.getenv("LOG_CONSULTAS_LENTAS", "consultas_lentas.jsonl")
+METRICAS_PROMETHEUS = os.getenv("METRICAS_PROMETHEUS", "")
 
 
 # Variáveis
@@ -42,14 +108,14 @@ tables = {
         cpf varchar(14),
         tipo varchar(20),
         CHECK (tipo in ('Cozinheiro', 'Faxineiro', 'Manobrista', 'Recepcionista')),
-        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel))"""
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE)"""
     ),
     'VAGA': (
         """CREATE TABLE IF NOT EXISTS vaga (
         id_vaga integer PRIMARY KEY NOT NULL,
         id_hotel integer,
         no_vaga integer,
-        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel))"""
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE)"""
     ),
     'QUARTO': (
         """CREATE TABLE IF NOT EXISTS quarto (
@@ -57,8 +123,8 @@ tables = {
         no_quarto integer,
         id_hotel integer,
         id_funcionario integer,
-        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel),
-        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario))"""
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE,
+        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario) DEFERRABLE)"""
     ),
     'ITEM': (
         """CREATE TABLE IF NOT EXISTS item (
@@ -76,10 +142,10 @@ tables = {
         id_funcionario integer,
         id_plano integer,
         id_hotel integer,
-        FOREIGN KEY(id_quarto) REFERENCES quarto(id_quarto),
-        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario),
-        FOREIGN KEY(id_plano) REFERENCES plano(id_plano),
-        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel))"""
+        FOREIGN KEY(id_quarto) REFERENCES quarto(id_quarto) DEFERRABLE,
+        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario) DEFERRABLE,
+        FOREIGN KEY(id_plano) REFERENCES plano(id_plano) DEFERRABLE,
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE)"""
     ),
     'HOSPEDE': (
         """CREATE TABLE IF NOT EXISTS hospede (
@@ -90,8 +156,8 @@ tables = {
         contato text,
         id_reserva integer,
         id_hotel integer,
-        FOREIGN KEY(id_reserva) REFERENCES reserva(id_reserva),
-        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel))"""
+        FOREIGN KEY(id_reserva) REFERENCES reserva(id_reserva) DEFERRABLE,
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE)"""
     ),
     'VEICULO': (
         """CREATE TABLE IF NOT EXISTS veiculo (
@@ -103,10 +169,10 @@ tables = {
         id_funcionario integer,
         id_reserva integer,
         id_hotel integer,
-        FOREIGN KEY(id_vaga) REFERENCES vaga(id_vaga),
-        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario),
-        FOREIGN KEY(id_reserva) REFERENCES reserva(id_reserva),
-        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel))"""
+        FOREIGN KEY(id_vaga) REFERENCES vaga(id_vaga) DEFERRABLE,
+        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario) DEFERRABLE,
+        FOREIGN KEY(id_reserva) REFERENCES reserva(id_reserva) DEFERRABLE,
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE)"""
     ),
     'ANIMAL_ESTIMACAO': (
         """CREATE TABLE IF NOT EXISTS animal_estimacao (
@@ -116,8 +182,8 @@ tables = {
         peso float,
         id_reserva integer,
         id_hotel integer,
-        FOREIGN KEY(id_reserva) REFERENCES reserva(id_reserva),
-        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel))"""
+        FOREIGN KEY(id_reserva) REFERENCES reserva(id_reserva) DEFERRABLE,
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE)"""
     ),
     'PEDIDO': (
         """CREATE TABLE IF NOT EXISTS pedido (
@@ -127,12 +193,273 @@ tables = {
         id_item integer,
         id_funcionario integer,
         id_hotel integer,
-        FOREIGN KEY(id_reserva) REFERENCES reserva(id_reserva),
-        FOREIGN KEY(id_item) REFERENCES item(id_item),
-        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario),
-        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel))"""
+        FOREIGN KEY(id_reserva) REFERENCES reserva(id_reserva) DEFERRABLE,
+        FOREIGN KEY(id_item) REFERENCES item(id_item) DEFERRABLE,
+        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario) DEFERRABLE,
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE)"""
+    ),
+}
+
+# Esquema particionado (PARTICIONAR_RESERVAS=1): reserva e pedido particionadas
+# por intervalo de data_entrada. A chave primária precisa conter a coluna de
+# partição, então pedido ganha data_entrada e referencia reserva pelo par
+# (id_reserva, data_entrada). Hóspede, veículo e animal guardam só o id_reserva
+# e por isso perdem a FOREIGN KEY para reserva (o índice em id_reserva fica).
+
+tables_particionadas = {
+    'RESERVA': (
+        """CREATE TABLE IF NOT EXISTS reserva (
+        id_reserva integer NOT NULL,
+        data_entrada timestamp NOT NULL,
+        data_saida timestamp,
+        conta float,
+        id_quarto integer,
+        id_funcionario integer,
+        id_plano integer,
+        id_hotel integer,
+        PRIMARY KEY (id_reserva, data_entrada),
+        FOREIGN KEY(id_quarto) REFERENCES quarto(id_quarto) DEFERRABLE,
+        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario) DEFERRABLE,
+        FOREIGN KEY(id_plano) REFERENCES plano(id_plano) DEFERRABLE,
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE) PARTITION BY RANGE (data_entrada)"""
+    ),
+    'PEDIDO': (
+        """CREATE TABLE IF NOT EXISTS pedido (
+        id_pedido integer NOT NULL,
+        valor float,
+        id_reserva integer,
+        id_item integer,
+        id_funcionario integer,
+        id_hotel integer,
+        data_entrada timestamp NOT NULL,
+        PRIMARY KEY (id_pedido, data_entrada),
+        FOREIGN KEY(id_reserva, data_entrada) REFERENCES reserva(id_reserva, data_entrada) DEFERRABLE,
+        FOREIGN KEY(id_item) REFERENCES item(id_item) DEFERRABLE,
+        FOREIGN KEY(id_funcionario) REFERENCES funcionario(id_funcionario) DEFERRABLE,
+        FOREIGN KEY(id_hotel) REFERENCES hotel(id_hotel) DEFERRABLE) PARTITION BY RANGE (data_entrada)"""
+    ),
+    **{table_name: re.sub(r"FOREIGN KEY\(id_reserva\) REFERENCES reserva\(id_reserva\) DEFERRABLE,\s*", "",
+                          tables[table_name])
+       for table_name in ('HOSPEDE', 'VEICULO', 'ANIMAL_ESTIMACAO')},
+}
+
+# Índices das chaves estrangeiras, usadas nos JOINs das consultas analíticas
+
+indexes = {
+    'FUNCIONARIO_ID_HOTEL': "CREATE INDEX IF NOT EXISTS idx_funcionario_id_hotel ON funcionario (id_hotel)",
+    'VAGA_ID_HOTEL': "CREATE INDEX IF NOT EXISTS idx_vaga_id_hotel ON vaga (id_hotel)",
+    'QUARTO_ID_HOTEL': "CREATE INDEX IF NOT EXISTS idx_quarto_id_hotel ON quarto (id_hotel)",
+    'QUARTO_ID_FUNCIONARIO': "CREATE INDEX IF NOT EXISTS idx_quarto_id_funcionario ON quarto (id_funcionario)",
+    'RESERVA_ID_QUARTO': "CREATE INDEX IF NOT EXISTS idx_reserva_id_quarto ON reserva (id_quarto)",
+    'RESERVA_ID_FUNCIONARIO': "CREATE INDEX IF NOT EXISTS idx_reserva_id_funcionario ON reserva (id_funcionario)",
+    'RESERVA_ID_PLANO': "CREATE INDEX IF NOT EXISTS idx_reserva_id_plano ON reserva (id_plano)",
+    'RESERVA_ID_HOTEL': "CREATE INDEX IF NOT EXISTS idx_reserva_id_hotel ON reserva (id_hotel)",
+    'HOSPEDE_ID_RESERVA': "CREATE INDEX IF NOT EXISTS idx_hospede_id_reserva ON hospede (id_reserva)",
+    'HOSPEDE_ID_HOTEL': "CREATE INDEX IF NOT EXISTS idx_hospede_id_hotel ON hospede (id_hotel)",
+    'VEICULO_ID_VAGA': "CREATE INDEX IF NOT EXISTS idx_veiculo_id_vaga ON veiculo (id_vaga)",
+    'VEICULO_ID_FUNCIONARIO': "CREATE INDEX IF NOT EXISTS idx_veiculo_id_funcionario ON veiculo (id_funcionario)",
+    'VEICULO_ID_RESERVA': "CREATE INDEX IF NOT EXISTS idx_veiculo_id_reserva ON veiculo (id_reserva)",
+    'VEICULO_ID_HOTEL': "CREATE INDEX IF NOT EXISTS idx_veiculo_id_hotel ON veiculo (id_hotel)",
+    'ANIMAL_ESTIMACAO_ID_RESERVA': "CREATE INDEX IF NOT EXISTS idx_animal_estimacao_id_reserva ON animal_estimacao (id_reserva)",
+    'ANIMAL_ESTIMACAO_ID_HOTEL': "CREATE INDEX IF NOT EXISTS idx_animal_estimacao_id_hotel ON animal_estimacao (id_hotel)",
+    'PEDIDO_ID_RESERVA': "CREATE INDEX IF NOT EXISTS idx_pedido_id_reserva ON pedido (id_reserva)",
+    'PEDIDO_ID_ITEM': "CREATE INDEX IF NOT EXISTS idx_pedido_id_item ON pedido (id_item)",
+    'PEDIDO_ID_FUNCIONARIO': "CREATE INDEX IF NOT EXISTS idx_pedido_id_funcionario ON pedido (id_funcionario)",
+    'PEDIDO_ID_HOTEL': "CREATE INDEX IF NOT EXISTS idx_pedido_id_hotel ON pedido (id_hotel)",
+}
+
+# Disponibilidade dos quartos: o intervalo da estadia é uma coluna gerada,
+# indexada com GiST, e uma restrição de exclusão impede duas reservas do mesmo
+# quarto com intervalos sobrepostos. Sem data de saída o quarto fica ocupado
+# por tempo indeterminado. A comparação do quarto usa int4range para não
+# depender da extensão btree_gist.
+disponibilidade_ddl = {
+    'RESERVA_PERIODO': (
+        "ALTER TABLE reserva ADD COLUMN IF NOT EXISTS periodo tsrange GENERATED ALWAYS AS "
+        "(CASE WHEN data_entrada IS NOT NULL THEN tsrange(data_entrada, data_saida, '[)') END) STORED"
+    ),
+    'RESERVA_PERIODO_IDX': "CREATE INDEX IF NOT EXISTS idx_reserva_periodo ON reserva USING gist (periodo)",
+    'RESERVA_SEM_SOBREPOSICAO': (
+        """DO $$ BEGIN
+        ALTER TABLE reserva ADD CONSTRAINT reserva_sem_sobreposicao
+            EXCLUDE USING gist (int4range(id_quarto, id_quarto, '[]') WITH =, periodo WITH &&) DEFERRABLE;
+        EXCEPTION WHEN duplicate_table OR duplicate_object THEN NULL;
+        END $$"""
+    ),
+}
+
+# Faturamento incremental: totais dos pedidos por reserva, por hotel e por dia
+# de entrada da reserva, mantidos por triggers de comando (FOR EACH STATEMENT)
+# com tabelas de transição. Cada INSERT, UPDATE, DELETE ou COPY em pedido
+# agrega só as linhas que mudou e soma a diferença nos totais, então uma linha
+# custa O(1) e uma carga em massa vira poucos upserts agrupados. Os valores
+# ficam em numeric: a soma é exata e a conciliação compara por igualdade.
+
+# Dia da receita: a data de entrada da reserva (no esquema particionado o
+# próprio pedido tem a coluna; no outro, uma busca pela chave da reserva)
+_DIA_DO_PEDIDO = ("p.data_entrada::date" if PARTICIONAR_RESERVAS else
+                  "(SELECT r.data_entrada::date FROM reserva r WHERE r.id_reserva = p.id_reserva)")
+
+
+def _movimento_pedidos(*origens) -> str:
+    """SELECT das linhas de pedido alteradas, com sinal +1 (entrou) ou -1 (saiu)."""
+    return "\n        UNION ALL\n        ".join(
+        f"SELECT p.id_reserva, p.id_hotel, COALESCE(p.valor, 0)::numeric AS valor, {sinal} AS sinal, "
+        f"{_DIA_DO_PEDIDO} AS dia FROM {origem} p"
+        for origem, sinal in origens)
+
+
+def _funcao_faturamento(nome: str, movimento: str) -> str:
+    # ORDER BY nas chaves: comandos concorrentes travam as linhas dos totais na mesma ordem
+    return f"""CREATE OR REPLACE FUNCTION {nome}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO conta_reserva AS c (id_reserva, id_hotel, total_pedidos, qtd_pedidos)
+    SELECT id_reserva, MAX(id_hotel), SUM(sinal * valor), SUM(sinal)
+    FROM (
+        {movimento}
+    ) m
+    WHERE id_reserva IS NOT NULL
+    GROUP BY id_reserva
+    ORDER BY id_reserva
+    ON CONFLICT (id_reserva) DO UPDATE
+        SET total_pedidos = c.total_pedidos + EXCLUDED.total_pedidos,
+            qtd_pedidos = c.qtd_pedidos + EXCLUDED.qtd_pedidos,
+            id_hotel = COALESCE(EXCLUDED.id_hotel, c.id_hotel);
+
+    INSERT INTO receita_hotel AS h (id_hotel, total_pedidos, qtd_pedidos)
+    SELECT id_hotel, SUM(sinal * valor), SUM(sinal)
+    FROM (
+        {movimento}
+    ) m
+    WHERE id_hotel IS NOT NULL
+    GROUP BY id_hotel
+    ORDER BY id_hotel
+    ON CONFLICT (id_hotel) DO UPDATE
+        SET total_pedidos = h.total_pedidos + EXCLUDED.total_pedidos,
+            qtd_pedidos = h.qtd_pedidos + EXCLUDED.qtd_pedidos;
+
+    {_somar_em_receita_dia(movimento)}
+    RETURN NULL;
+END $$"""
+
+
+def _somar_em_receita_dia(movimento: str) -> str:
+    return f"""INSERT INTO receita_dia AS d (id_hotel, dia, total_pedidos, qtd_pedidos)
+    SELECT id_hotel, dia, SUM(sinal * valor), SUM(sinal)
+    FROM (
+        {movimento}
+    ) m
+    WHERE id_hotel IS NOT NULL AND dia IS NOT NULL
+    GROUP BY id_hotel, dia
+    ORDER BY id_hotel, dia
+    ON CONFLICT (id_hotel, dia) DO UPDATE
+        SET total_pedidos = d.total_pedidos + EXCLUDED.total_pedidos,
+            qtd_pedidos = d.qtd_pedidos + EXCLUDED.qtd_pedidos;"""
+
+
+# Sem particionamento o dia da receita é lido da reserva: mudar a data de
+# entrada de uma reserva tira os seus pedidos do dia antigo e soma no novo.
+# (No esquema particionado a FK (id_reserva, data_entrada) de pedido impede a mudança.)
+_MOVIMENTO_RESERVAS = """SELECT p.id_hotel, COALESCE(p.valor, 0)::numeric AS valor, s.sinal, s.dia
+        FROM antigas a
+        JOIN novas n ON n.id_reserva = a.id_reserva
+        CROSS JOIN LATERAL (VALUES (-1, a.data_entrada::date), (1, n.data_entrada::date)) AS s(sinal, dia)
+        JOIN pedido p ON p.id_reserva = n.id_reserva
+        WHERE a.data_entrada::date IS DISTINCT FROM n.data_entrada::date"""
+
+FUNCAO_RESERVA_UPDATE = f"""CREATE OR REPLACE FUNCTION faturamento_reserva_update() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    {_somar_em_receita_dia(_MOVIMENTO_RESERVAS)}
+    RETURN NULL;
+END $$"""
+
+# Transições não combinam com "UPDATE OF data_entrada": a função filtra as linhas
+TRIGGER_RESERVA_UPDATE = ("DROP TRIGGER IF EXISTS faturamento_reserva_update ON reserva;\n"
+                          "CREATE TRIGGER faturamento_reserva_update AFTER UPDATE ON reserva "
+                          "REFERENCING OLD TABLE AS antigas NEW TABLE AS novas "
+                          "FOR EACH STATEMENT EXECUTE FUNCTION faturamento_reserva_update()")
+
+
+def _trigger_faturamento(evento: str, transicoes: str) -> str:
+    nome = f"faturamento_pedido_{evento.lower()}"
+    return (f"DROP TRIGGER IF EXISTS {nome} ON pedido;\n"
+            f"CREATE TRIGGER {nome} AFTER {evento} ON pedido REFERENCING {transicoes} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION {nome}()")
+
+
+# Recálculo completo a partir de pedido: (chave, colunas, SELECT) de cada tabela
+# de totais. Usado na carga inicial, na conciliação e na reconstrução.
+RECALCULO_FATURAMENTO = {
+    'conta_reserva': (
+        "id_reserva", "id_reserva, id_hotel, total_pedidos, qtd_pedidos",
+        """SELECT p.id_reserva, MAX(p.id_hotel), SUM(COALESCE(p.valor, 0)::numeric), COUNT(*)
+        FROM pedido p WHERE p.id_reserva IS NOT NULL GROUP BY p.id_reserva"""
+    ),
+    'receita_hotel': (
+        "id_hotel", "id_hotel, total_pedidos, qtd_pedidos",
+        """SELECT p.id_hotel, SUM(COALESCE(p.valor, 0)::numeric), COUNT(*)
+        FROM pedido p WHERE p.id_hotel IS NOT NULL GROUP BY p.id_hotel"""
+    ),
+    'receita_dia': (
+        "id_hotel, dia", "id_hotel, dia, total_pedidos, qtd_pedidos",
+        # No recálculo a data vem de um JOIN (hash) em vez de uma busca por linha
+        f"""SELECT p.id_hotel, {'p' if PARTICIONAR_RESERVAS else 'r'}.data_entrada::date AS dia,
+               SUM(COALESCE(p.valor, 0)::numeric), COUNT(*)
+        FROM pedido p{'' if PARTICIONAR_RESERVAS else ' JOIN reserva r ON r.id_reserva = p.id_reserva'}
+        WHERE p.id_hotel IS NOT NULL AND {'p' if PARTICIONAR_RESERVAS else 'r'}.data_entrada IS NOT NULL
+        GROUP BY 1, 2"""
+    ),
+}
+
+
+def _recalcular_faturamento() -> list:
+    return [f"INSERT INTO {tabela} ({colunas}) {select}" for tabela, (_, colunas, select) in
+            RECALCULO_FATURAMENTO.items()]
+
+
+faturamento_ddl = {
+    'CONTA_RESERVA': (
+        """CREATE TABLE IF NOT EXISTS conta_reserva (
+        id_reserva integer PRIMARY KEY NOT NULL,
+        id_hotel integer,
+        total_pedidos numeric NOT NULL DEFAULT 0,
+        qtd_pedidos bigint NOT NULL DEFAULT 0)"""
+    ),
+    'RECEITA_HOTEL': (
+        """CREATE TABLE IF NOT EXISTS receita_hotel (
+        id_hotel integer PRIMARY KEY NOT NULL,
+        total_pedidos numeric NOT NULL DEFAULT 0,
+        qtd_pedidos bigint NOT NULL DEFAULT 0)"""
+    ),
+    'RECEITA_DIA': (
+        """CREATE TABLE IF NOT EXISTS receita_dia (
+        id_hotel integer NOT NULL,
+        dia date NOT NULL,
+        total_pedidos numeric NOT NULL DEFAULT 0,
+        qtd_pedidos bigint NOT NULL DEFAULT 0,
+        PRIMARY KEY (id_hotel, dia))"""
     ),
+    'FUNCAO_INSERT': _funcao_faturamento("faturamento_pedido_insert", _movimento_pedidos(("novos", 1))),
+    'FUNCAO_DELETE': _funcao_faturamento("faturamento_pedido_delete", _movimento_pedidos(("antigos", -1))),
+    'FUNCAO_UPDATE': _funcao_faturamento("faturamento_pedido_update",
+                                         _movimento_pedidos(("antigos", -1), ("novos", 1))),
+    # Carga inicial em bancos que já têm pedidos; o LOCK impede que um pedido
+    # entre entre o recálculo e a criação das triggers
+    'CARGA_INICIAL': (
+        """DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM conta_reserva) AND NOT EXISTS (SELECT 1 FROM receita_hotel) THEN
+            LOCK TABLE pedido IN SHARE ROW EXCLUSIVE MODE;
+            """ + ";\n            ".join(_recalcular_faturamento()) + """;
+        END IF;
+        END $$"""
+    ),
+    'TRIGGER_INSERT': _trigger_faturamento("INSERT", "NEW TABLE AS novos"),
+    'TRIGGER_DELETE': _trigger_faturamento("DELETE", "OLD TABLE AS antigos"),
+    'TRIGGER_UPDATE': _trigger_faturamento("UPDATE", "OLD TABLE AS antigos NEW TABLE AS novos"),
 }
+if not PARTICIONAR_RESERVAS:
+    faturamento_ddl['FUNCAO_RESERVA_UPDATE'] = FUNCAO_RESERVA_UPDATE
+    faturamento_ddl['TRIGGER_RESERVA_UPDATE'] = TRIGGER_RESERVA_UPDATE
 
 inserts = {
     'HOTEL': (
@@ -237,6 +564,24 @@ inserts = {
     )
 }
 
+inserts_particionados = {
+    'PEDIDO': (
+        """INSERT INTO pedido (id_pedido, valor, id_reserva, id_item, id_funcionario, id_hotel, data_entrada) values
+        (1, 8.00, 1, 1, 4, 1, '2023-10-01 14:00'),
+        (2, 25.00, 1, 2, 4, 1, '2023-10-01 14:00'),
+        (3, 120.00, 2, 3, 4, 1, '2023-10-02 14:00'),
+        (4, 120.00, 5, 3, 12, 3, '2023-12-20 12:00'),
+        (5, 8.00, 8, 1, 8, 2, '2024-01-06 14:00')"""
+    )
+}
+
+if PARTICIONAR_RESERVAS:
+    tables.update(tables_particionadas)
+    inserts.update(inserts_particionados)
+    # Restrição de exclusão em tabela particionada exige a chave de partição;
+    # nesse modo fica só o índice GiST usado nas consultas de disponibilidade
+    del disponibilidade_ddl['RESERVA_SEM_SOBREPOSICAO']
+
 drop = {
     'HOSPEDE': "DROP TABLE IF EXISTS hospede CASCADE",
     'VEICULO': "DROP TABLE IF EXISTS veiculo CASCADE",
@@ -252,437 +597,3752 @@ drop = {
 }
 
 
-# Funções de banco
+# Instrumentação das consultas
 
-def conectar_banco():
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST
-    )
-    cur = conn.cursor()
-    print("Conexão com o banco bem sucedida!")
-    print("PostgreSQL versão:")
-    cur.execute("SELECT version()")
-    db_version = cur.fetchone()
-    print(db_version)
-    cur.close()
-    return conn
+def _normalizar_sql(sql: str) -> str:
+    """
+    Reduz o comando à sua forma (impressão digital): sem comentários, com
+    literais e parâmetros trocados por ?, listas de VALUES repetidas
+    colapsadas e espaços e maiúsculas uniformizados.
+    """
+    texto = re.sub(r"--[^\n]*|/\*.*?\*/", " ", sql, flags=re.S)
+    texto = re.sub(r"'(?:[^']|'')*'", "?", texto)
+    texto = re.sub(r"%\(\w+\)s|%s|\$\d+", "?", texto)
+    texto = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", "?", texto, flags=re.I)
+    texto = re.sub(r"\s+", " ", texto).strip().lower()
+    return re.sub(r"(\([^()]*\))(?:\s*,\s*\1)+", r"\1, ...", texto)
 
 
-def criar_todas_as_tabelas(conn):
-    cur = conn.cursor()
-    for table_name, table_description in tables.items():
-        try:
-            cur.execute(table_description)
-            conn.commit()
-            print(f"Tabela {table_name} criada com sucesso!")
-        except psycopg2.Error as e:
-            conn.rollback()
-            print(f"Erro ao criar a tabela {table_name}")
-            print(e.pgcode)
-            print(e.pgerror)
-    cur.close()
+@lru_cache(maxsize=1024)
+def _impressao_curta(sql: str) -> tuple:
+    normalizado = _normalizar_sql(sql)
+    return hashlib.md5(normalizado.encode('utf-8')).hexdigest()[:12], normalizado
 
 
-def inserir_valores(conn):
-    cur = conn.cursor()
-    for insert_name, insert_description in inserts.items():
-        try:
-            cur.execute(insert_description)
-            conn.commit()
-            print(f"Valores inseridos na tabela {insert_name} com sucesso!")
-        except psycopg2.Error as e:
-            conn.rollback()
-            print(f"Erro ao inserir valores na tabela {insert_name}")
-            print(e.pgcode)
-            print(e.pgerror)
-    cur.close()
+def impressao_digital(sql) -> tuple:
+    """Devolve (id, texto normalizado) do comando; comandos iguais a menos dos valores têm o mesmo id."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    if len(sql) <= 4096:
+        return _impressao_curta(sql)
+    # Lotes do execute_values: textos grandes e únicos, que não valem a pena no cache
+    normalizado = _normalizar_sql(sql)
+    return hashlib.md5(normalizado.encode('utf-8')).hexdigest()[:12], normalizado
 
 
-def remover_todas_as_tabelas(conn):
-    cur = conn.cursor()
-    for drop_name, drop_description in drop.items():
-        try:
-            cur.execute(drop_description)
-            conn.commit()
-            print(f"Tabela {drop_name} removida, se existia.")
-        except psycopg2.Error as e:
-            conn.rollback()
-            print(f"Erro ao remover tabela {drop_name}")
-            print(e.pgcode)
-            print(e.pgerror)
-    cur.close()
+def _tamanho_linha(row) -> int:
+    """Estimativa barata dos bytes de uma linha: tamanho de textos e binários, 8 para os demais valores."""
+    total = 0
+    for valor in row:
+        if valor is None:
+            continue
+        if isinstance(valor, (str, bytes, bytearray, memoryview)):
+            total += len(valor)
+        else:
+            total += 8
+    return total
 
 
-def consulta_individual(conn):
-    cur = conn.cursor()
-    print("Tabelas disponíveis:")
-    for table_name in tables:
-        print(f"Nome: {table_name}")
-    name = input("Digite o nome da tabela que deseja consultar: ").upper().strip()
+def _tamanho_linhas(linhas) -> int:
+    """Bytes de um bloco de linhas, estimados por uma amostra de até 32 delas."""
+    if len(linhas) <= 32:
+        return sum(map(_tamanho_linha, linhas))
+    amostra = linhas[::len(linhas) // 32]
+    return sum(map(_tamanho_linha, amostra)) * len(linhas) // len(amostra)
 
-    if name not in tables:
-        print("Tabela não encontrada. Digite exatamente um dos nomes listados.")
-        cur.close()
-        return
 
-    try:
-        print(f"A tabela foi gerada usando o seguinte código: \n{tables[name]}")
-        select_sql = f"SELECT * FROM {name.lower()}"
-        cur.execute(select_sql)
-    except psycopg2.Error as e:
-        print("Erro ao consultar tabela")
-        print(e.pgcode)
-        print(e.pgerror)
-    else:
-        print(f"TABELA {name}")
-        result = cur.fetchall()
-        for x in result:
-            print(x)
-    finally:
-        cur.close()
+def _somente_leitura(normalizado: str) -> bool:
+    # EXPLAIN ANALYZE executa o comando de novo: só vale para leituras
+    if not normalizado.startswith(('select', 'with', 'table', 'values')):
+        return False
+    return re.search(r"\b(insert|update|delete|merge|into)\b", normalizado) is None
 
 
-def insert(conn):
-    cur = conn.cursor()
-    print("Tabelas disponíveis:")
-    for table_name in tables:
-        print(f"Nome: {table_name}")
-    try:
-        name = input("Digite o nome da tabela onde deseja inserir: ").upper().strip()
-        if name not in tables:
-            print("Tabela não encontrada.")
-            return
+class MetricasConsultas:
+    """
+    Acumula, por impressão digital do comando, chamadas, tempo total e máximo,
+    linhas, bytes lidos e erros de todos os comandos da sessão. Comandos acima
+    de CONSULTA_LENTA_MS vão para o log de consultas lentas, com o plano do
+    EXPLAIN (ANALYZE, BUFFERS) capturado uma vez por impressão digital.
+    """
 
-        table_description = tables[name]
-        print(f"A tabela foi criada usando o seguinte código: \n{table_description}")
-        new_value = input("Insira os valores em uma tupla. Ex: (101, 'ABC', 123):\n").strip()
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._estatisticas = {}
+        self._planos_capturados = set()
+        self.inicio = time.time()
 
-        if not (new_value.startswith("(") and new_value.endswith(")")):
-            print("Formato inválido. A tupla deve começar com '(' e terminar com ')'.")
+    def registrar(self, sql, segundos: float, linhas: int = 0, erro: bool = False) -> str:
+        impressao, normalizado = impressao_digital(sql)
+        with self._lock:
+            estatistica = self._estatisticas.get(impressao)
+            if estatistica is None:
+                estatistica = self._estatisticas[impressao] = {
+                    'sql': normalizado[:500], 'comando': normalizado.split(' ', 1)[0],
+                    'chamadas': 0, 'segundos': 0.0, 'maximo': 0.0, 'linhas': 0, 'bytes': 0,
+                    'erros': 0, 'lentas': 0,
+                }
+            estatistica['chamadas'] += 1
+            estatistica['segundos'] += segundos
+            estatistica['maximo'] = max(estatistica['maximo'], segundos)
+            estatistica['linhas'] += linhas
+            if erro:
+                estatistica['erros'] += 1
+            if CONSULTA_LENTA_MS > 0 and segundos * 1000 >= CONSULTA_LENTA_MS:
+                estatistica['lentas'] += 1
+        return impressao
+
+    def adicionar_leitura(self, impressao: str, linhas: int, tamanho: int, segundos: float = 0.0):
+        with self._lock:
+            estatistica = self._estatisticas.get(impressao)
+            if estatistica is not None:
+                estatistica['linhas'] += linhas
+                estatistica['bytes'] += tamanho
+                estatistica['segundos'] += segundos
+
+    def precisa_de_plano(self, impressao: str, sql, segundos: float) -> bool:
+        """Indica se o comando é lento, é uma leitura e ainda não teve o plano capturado."""
+        if CONSULTA_LENTA_MS <= 0 or segundos * 1000 < CONSULTA_LENTA_MS:
+            return False
+        with self._lock:
+            if impressao in self._planos_capturados:
+                return False
+            self._planos_capturados.add(impressao)
+        return _somente_leitura(impressao_digital(sql)[1])
+
+    def registrar_lenta(self, impressao: str, sql, segundos: float, linhas: int, plano: Optional[str] = None):
+        if not LOG_CONSULTAS_LENTAS:
             return
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', 'replace')
+        registro = {'momento': datetime.now().isoformat(timespec='seconds'), 'impressao': impressao,
+                    'ms': round(segundos * 1000, 1), 'linhas': linhas, 'sql': str(sql)[:10000], 'plano': plano}
+        try:
+            with self._lock, open(LOG_CONSULTAS_LENTAS, 'a', encoding='utf-8') as log:
+                log.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Não foi possível gravar o log de consultas lentas: {e}", file=sys.stderr)
 
-        sql = f"INSERT INTO {name.lower()} VALUES {new_value}"
-        cur.execute(sql)
-        conn.commit()
-        print("Valores inseridos com sucesso!")
-    except psycopg2.Error as e:
-        conn.rollback()
-        print("Erro ao inserir valores")
-        print(e.pgcode)
-        print(e.pgerror)
-    finally:
-        cur.close()
+    def instantaneo(self) -> dict:
+        with self._lock:
+            return {impressao: dict(estatistica) for impressao, estatistica in self._estatisticas.items()}
 
+    def resumo(self, limite: int = 10) -> str:
+        estatisticas = self.instantaneo()
+        if not estatisticas:
+            return "Nenhum comando executado nesta sessão."
+        chamadas = sum(e['chamadas'] for e in estatisticas.values())
+        segundos = sum(e['segundos'] for e in estatisticas.values())
+        linhas = [f"Resumo da sessão: {chamadas} comandos, {segundos:.3f}s no banco, "
+                  f"{len(estatisticas)} formas distintas",
+                  f"{'impressão':<12} {'chamadas':>8} {'total ms':>10} {'média ms':>9} {'máx ms':>9} "
+                  f"{'linhas':>9} {'bytes':>11} {'lentas':>6} {'erros':>5}  comando"]
+        ordenadas = sorted(estatisticas.items(), key=lambda item: item[1]['segundos'], reverse=True)
+        for impressao, e in ordenadas[:limite]:
+            linhas.append(f"{impressao:<12} {e['chamadas']:>8} {e['segundos'] * 1000:>10.1f} "
+                          f"{e['segundos'] * 1000 / e['chamadas']:>9.2f} {e['maximo'] * 1000:>9.1f} "
+                          f"{e['linhas']:>9} {e['bytes']:>11} {e['lentas']:>6} {e['erros']:>5}  {e['sql'][:60]}")
+        return "\n".join(linhas)
 
-def update(conn):
-    cur = conn.cursor()
-    print("Tabelas disponíveis:")
-    for table_name in tables:
-        print(f"Nome: {table_name}")
-    try:
-        name = input("Digite o nome da tabela que deseja atualizar: ").upper().strip()
-        if name not in tables:
-            print("Tabela não encontrada.")
+    def exportar_prometheus(self, caminho: str = METRICAS_PROMETHEUS):
+        """
+        Grava as métricas no formato texto do Prometheus (para o coletor de
+        arquivos do node_exporter). O arquivo é escrito em um temporário e
+        renomeado, para que o coletor nunca leia um arquivo pela metade.
+        """
+        if not caminho:
             return
+        series = (
+            ('consultas_total', 'counter', "Comandos executados", 'chamadas'),
+            ('consulta_segundos_total', 'counter', "Tempo total no banco, em segundos", 'segundos'),
+            ('consulta_segundos_max', 'gauge', "Maior tempo de uma execução, em segundos", 'maximo'),
+            ('consulta_linhas_total', 'counter', "Linhas devolvidas ou afetadas", 'linhas'),
+            ('consulta_bytes_total', 'counter', "Bytes lidos (estimativa)", 'bytes'),
+            ('consulta_erros_total', 'counter', "Execuções com erro", 'erros'),
+            ('consultas_lentas_total', 'counter', f"Execuções acima de {CONSULTA_LENTA_MS:g} ms", 'lentas'),
+        )
+        estatisticas = self.instantaneo()
+        linhas = []
+        for nome, tipo, ajuda, chave in series:
+            linhas.append(f"# HELP trabalhofinal_{nome} {ajuda}")
+            linhas.append(f"# TYPE trabalhofinal_{nome} {tipo}")
+            for impressao, e in sorted(estatisticas.items()):
+                linhas.append(f'trabalhofinal_{nome}{{impressao="{impressao}",comando="{e["comando"]}"}} '
+                              f'{e[chave]}')
+        linhas.append("# HELP trabalhofinal_sessao_inicio_segundos Início da sessão (epoch)")
+        linhas.append("# TYPE trabalhofinal_sessao_inicio_segundos gauge")
+        linhas.append(f"trabalhofinal_sessao_inicio_segundos {self.inicio:.0f}")
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        try:
+            with open(temporario, 'w', encoding='utf-8') as arquivo:
+                arquivo.write("\n".join(linhas) + "\n")
+            os.replace(temporario, caminho)
+        except OSError as e:
+            print(f"Não foi possível gravar as métricas em {caminho}: {e}", file=sys.stderr)
 
-        table_description = tables[name]
-        print(f"A tabela foi criada usando o seguinte código: \n{table_description}")
-        atributo = input("Digite o atributo a ser alterado: ").strip()
-        valor = input("Digite o valor a ser atribuído (como você escreveria no SQL): ").strip()
-        codigo_f = input("Digite o nome da coluna da chave primária: ").strip()
-        codigo = input("Digite o valor numérico da chave primária: ").strip()
+    def limpar(self):
+        with self._lock:
+            self._estatisticas.clear()
+            self._planos_capturados.clear()
 
-        sql = f"UPDATE {name.lower()} SET {atributo} = {valor} WHERE {codigo_f} = {codigo}"
-        cur.execute(sql)
-        conn.commit()
-        print("Valor atualizado com sucesso!")
+
+metricas = MetricasConsultas()
+
+
+def _capturar_plano(conn, sql: str) -> str:
+    """
+    Roda EXPLAIN (ANALYZE, BUFFERS) do comando com um cursor comum (não
+    instrumentado), dentro de um savepoint para que uma falha não derrube a
+    transação de quem chamou.
+    """
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    usar_savepoint = not conn.autocommit
+    try:
+        if usar_savepoint:
+            cur.execute("SAVEPOINT captura_plano")
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql)
+        plano = "\n".join(linha[0] for linha in cur.fetchall())
+        if usar_savepoint:
+            cur.execute("RELEASE SAVEPOINT captura_plano")
+        return plano
     except psycopg2.Error as e:
-        conn.rollback()
-        print("Erro ao atualizar valor")
-        print(e.pgcode)
-        print(e.pgerror)
+        if usar_savepoint:
+            try:
+                cur.execute("ROLLBACK TO SAVEPOINT captura_plano")
+            except psycopg2.Error:
+                pass
+        return f"EXPLAIN falhou: {e.pgerror or e}"
     finally:
         cur.close()
 
 
-def delete(conn):
-    cur = conn.cursor()
-    print("Tabelas disponíveis:")
-    for table_name in tables:
-        print(f"Nome: {table_name}")
-    try:
-        name = input("Digite o nome da tabela que deseja deletar um registro: ").upper().strip()
-        if name not in tables:
-            print("Tabela não encontrada.")
+class CursorInstrumentado(psycopg2.extensions.cursor):
+    """
+    Cursor usado por todas as conexões do programa (cursor_factory). Cada
+    execute e copy_expert é cronometrado e registrado em `metricas`; as linhas
+    e bytes lidos são somados conforme o fetch. Em cursores nomeados as linhas
+    só chegam no fetch, então o tempo de cada fetch também entra no total (o
+    limiar de consulta lenta vale para o execute).
+    """
+
+    _impressao = None
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            resultado = super().execute(query, vars)
+        except Exception:
+            metricas.registrar(query, time.perf_counter() - inicio, erro=True)
+            raise
+        decorrido = time.perf_counter() - inicio
+        linhas = self.rowcount if self.name is None and self.rowcount > 0 else 0
+        self._impressao = metricas.registrar(query, decorrido, linhas)
+        if CONSULTA_LENTA_MS > 0 and decorrido * 1000 >= CONSULTA_LENTA_MS:
+            self._registrar_lenta(query, vars, decorrido, linhas)
+        return resultado
+
+    def copy_expert(self, sql, file, size=8192):
+        inicio = time.perf_counter()
+        try:
+            resultado = super().copy_expert(sql, file, size)
+        except Exception:
+            metricas.registrar(sql, time.perf_counter() - inicio, erro=True)
+            raise
+        metricas.registrar(sql, time.perf_counter() - inicio, max(self.rowcount, 0))
+        return resultado
+
+    def _registrar_lenta(self, query, vars, decorrido: float, linhas: int):
+        texto = self.mogrify(query, vars) if vars is not None else query
+        texto = texto.decode('utf-8', 'replace') if isinstance(texto, bytes) else str(texto)
+        plano = None
+        if metricas.precisa_de_plano(self._impressao, query, decorrido):
+            plano = _capturar_plano(self.connection, texto)
+        metricas.registrar_lenta(self._impressao, texto, decorrido, linhas, plano)
+
+    def _lidas(self, linhas: list, inicio: float):
+        if self._impressao is None or not linhas:
             return
+        if self.name is None:
+            # Cursor comum: o resultado já chegou no execute, que contou as linhas
+            metricas.adicionar_leitura(self._impressao, 0, _tamanho_linhas(linhas))
+        else:
+            metricas.adicionar_leitura(self._impressao, len(linhas), _tamanho_linhas(linhas),
+                                       time.perf_counter() - inicio)
 
-        table_description = tables[name]
-        print(f"A tabela foi criada usando o seguinte código: \n{table_description}")
-        codigo_f = input("Digite o nome da coluna da chave primária: ").strip()
-        codigo = input("Digite o valor numérico da chave primária: ").strip()
+    def fetchone(self):
+        inicio = time.perf_counter()
+        row = super().fetchone()
+        if row is not None:
+            self._lidas([row], inicio)
+        return row
 
-        sql = f"DELETE FROM {name.lower()} WHERE {codigo_f} = {codigo}"
-        cur.execute(sql)
-        conn.commit()
-        print("DELETE realizado com sucesso!")
-    except psycopg2.Error as e:
-        conn.rollback()
-        print("Erro ao realizar o DELETE")
-        print(e.pgcode)
-        print(e.pgerror)
-    finally:
-        cur.close()
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._lidas(rows, inicio)
+        return rows
 
+    def fetchall(self):
+        inicio = time.perf_counter()
+        rows = super().fetchall()
+        self._lidas(rows, inicio)
+        return rows
 
-# Consultas com gráficos
+    def __iter__(self):
+        # Em blocos de itersize, como o iterador nativo dos cursores nomeados
+        tamanho = self.itersize if self.name is not None else max(self.arraysize, 1000)
+        while True:
+            rows = self.fetchmany(tamanho)
+            if not rows:
+                return
+            yield from rows
 
-def consulta01(conn):
-    cur = conn.cursor()
 
-    select_query = """
-SELECT 
-    h.nome AS nome_hospede,
-    COUNT(p.id_pedido) AS total_pedidos_realizados,
-    SUM(i.valor) AS valor_total_gasto
-FROM 
-    hospede h
-JOIN 
-    reserva r ON h.id_reserva = r.id_reserva
-JOIN 
-    pedido p ON r.id_reserva = p.id_reserva
-JOIN 
-    item i ON p.id_item = i.id_item
-GROUP BY 
-    h.nome
-ORDER BY 
-    valor_total_gasto DESC"""
+# Funções de banco
 
-    print("Primeira Consulta: calcula o valor total gasto com pedidos extras por cada hóspede.")
-    cur.execute(select_query)
-    result = cur.fetchall()
-    for x in result:
-        print(x)
+def _parametros_conexao() -> dict:
+    parametros = {
+        'dbname': DB_NAME,
+        'user': DB_USER,
+        'password': DB_PASSWORD,
+        'host': DB_HOST,
+    }
+    if INSTRUMENTAR_CONSULTAS:
+        parametros['cursor_factory'] = CursorInstrumentado
+    return parametros
 
-    nomes = [row[0] for row in result]
-    valores = [float(row[2]) if row[2] is not None else 0.0 for row in result]
 
-    if nomes:
-        fig, ax = plt.subplots()
-        bar_container = ax.bar(nomes, valores)
-        ax.set(ylabel='Valor total gasto', title='Valor gasto com pedidos extras por hóspede')
-        ax.bar_label(bar_container, fmt='{:,.2f}')
-        plt.tight_layout()
-        plt.show()
-    else:
-        print("Nenhum dado retornado para gerar o gráfico.")
+def _versao_servidor(conn) -> str:
+    # server_version vem do handshake da conexão, sem ida extra ao banco
+    versao = conn.server_version
+    return f"{versao // 10000}.{versao % 10000}"
 
-    cur.close()
 
+def conectar_banco():
+    conn = psycopg2.connect(**_parametros_conexao())
+    print("Conexão com o banco bem sucedida!")
+    print(f"PostgreSQL versão: {_versao_servidor(conn)}")
+    return conn
 
-def consulta02(conn):
-    cur = conn.cursor()
 
-    select_query = """
-SELECT
-    h.nome AS Nome_Hotel,
-    p.nome AS Tipo_Plano,
-    SUM(r.conta) AS Receita_Total
-FROM
-    RESERVA r
+class PoolConexoes:
+    """
+    Pool de conexões compartilhado pelas operações do menu e por workers.
+    Cada operação pega uma conexão emprestada com `conexao()` e a devolve ao
+    final; até `maxconn` conexões ficam abertas e prontas para reuso. Conexões
+    quebradas são descartadas e substituídas, e conexões que ficaram ociosas
+    por mais de `verificacao` segundos passam por um SELECT 1 antes de serem
+    entregues.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = DB_POOL_TIMEOUT,
+                 verificacao: float = DB_POOL_VERIFICACAO, **parametros):
+        self.timeout = timeout
+        self.verificacao = verificacao
+        self._parametros = parametros
+        self._livres = []
+        self._lock = threading.Lock()
+        self._vagas = threading.BoundedSemaphore(maxconn)
+        self._fechado = False
+        for _ in range(minconn):
+            self._livres.append((self._conectar(), time.monotonic()))
+
+    def _conectar(self):
+        return psycopg2.connect(**self._parametros)
+
+    def _saudavel(self, conn, ultimo_uso: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - ultimo_uso < self.verificacao:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obter(self):
+        if not self._vagas.acquire(timeout=self.timeout):
+            raise psycopg2.OperationalError(f"Nenhuma conexão livre no pool após {self.timeout:.0f}s")
+        try:
+            while True:
+                with self._lock:
+                    if self._fechado:
+                        raise psycopg2.InterfaceError("O pool de conexões já foi fechado")
+                    livre = self._livres.pop() if self._livres else None
+                if livre is None:
+                    return self._conectar()
+                conn, ultimo_uso = livre
+                if self._saudavel(conn, ultimo_uso):
+                    return conn
+                conn.close()
+        except Exception:
+            self._vagas.release()
+            raise
+
+    def devolver(self, conn, descartar: bool = False):
+        try:
+            if not descartar and not conn.closed:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+        except psycopg2.Error:
+            descartar = True
+        with self._lock:
+            if descartar or conn.closed or self._fechado:
+                conn.close()
+            else:
+                self._livres.append((conn, time.monotonic()))
+        self._vagas.release()
+
+    @contextmanager
+    def conexao(self):
+        conn = self.obter()
+        descartar = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            descartar = True
+            raise
+        finally:
+            self.devolver(conn, descartar)
+
+    def fechar(self):
+        with self._lock:
+            self._fechado = True
+            for conn, _ in self._livres:
+                conn.close()
+            self._livres.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool() -> PoolConexoes:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PoolConexoes(DB_POOL_MIN, DB_POOL_MAX, **_parametros_conexao())
+    return _pool
+
+
+# Réplicas de leitura
+#
+# DB_REPLICAS lista réplicas do banco dos DB_* separadas por ';', cada uma em
+# conninfo do libpq completado pelos DB_* (ex.: "host=replica1;host=replica2
+# port=5433"). Consultas analíticas, text2sql e exportações leem de uma
+# réplica em dia; escritas e o resto ficam no primário. Uma réplica com
+# atraso acima de REPLICA_ATRASO_MAX segundos, ou fora do ar, é pulada e a
+# leitura volta para o primário.
+
+# Atraso em segundos, medido contra a posição do WAL no primário (%s): a
+# réplica que já aplicou até ali está em dia mesmo que o primário esteja sem
+# escritas (o horário da última transação aplicada ficaria velho). Atrás dela,
+# vale o tempo desde a última transação aplicada; isso cobre também a réplica
+# desconectada, que para de receber enquanto o primário segue escrevendo. Sem
+# a posição do primário (NULL) vale sempre o tempo.
+ATRASO_REPLICA_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_wal_lsn_diff(%s::pg_lsn, pg_last_wal_replay_lsn()) <= 0 THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END"""
+
+
+def _posicao_wal_primario(conn_primario=None) -> Optional[str]:
+    """
+    pg_current_wal_lsn() do primário, lido em `conn_primario` ou numa conexão
+    do pool. A transação aberta só para a leitura é desfeita; None se falhar.
+    """
+    try:
+        if conn_primario is None:
+            with obter_pool().conexao() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_current_wal_lsn()")
+                    posicao = cur.fetchone()[0]
+                conn.rollback()
+            return posicao
+        livre = conn_primario.status == psycopg2.extensions.STATUS_READY
+        try:
+            with conn_primario.cursor() as cur:
+                cur.execute("SELECT pg_current_wal_lsn()")
+                return cur.fetchone()[0]
+        finally:
+            if livre:
+                conn_primario.rollback()
+    except psycopg2.Error:
+        return None
+
+
+class Replica:
+    def __init__(self, parametros: dict):
+        self.parametros = parametros
+        self.nome = f"{parametros.get('host') or 'local'}:{parametros.get('port') or 5432}/{parametros.get('dbname')}"
+        self.pool = PoolConexoes(0, DB_POOL_MAX, **parametros)
+        self.atraso = None
+        self.verificada_em = None
+
+
+class ReplicasLeitura:
+    """
+    Escolhe, em rodízio, uma réplica com atraso de até `atraso_max` segundos.
+    O atraso de cada réplica é medido no máximo uma vez a cada `verificacao`
+    segundos; réplica inacessível conta como atrasada até a próxima medição.
+    """
+
+    def __init__(self, configuracao: str, atraso_max: float = REPLICA_ATRASO_MAX,
+                 verificacao: float = REPLICA_VERIFICACAO):
+        self.atraso_max = atraso_max
+        self.verificacao = verificacao
+        self.replicas = []
+        for dsn in configuracao.split(';'):
+            if not dsn.strip():
+                continue
+            try:
+                parametros = {**_parametros_conexao(), **psycopg2.extensions.parse_dsn(dsn.strip())}
+            except psycopg2.ProgrammingError:
+                raise ValueError(f"Réplica inválida em DB_REPLICAS: {dsn.strip()!r}") from None
+            self.replicas.append(Replica(parametros))
+        self._proxima = 0
+        self._lock = threading.Lock()
+
+    def _medir(self, replica: Replica, posicao_primario) -> float:
+        agora = time.monotonic()
+        if replica.verificada_em is not None and agora - replica.verificada_em < self.verificacao:
+            return replica.atraso
+        try:
+            with replica.pool.conexao() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(ATRASO_REPLICA_SQL, (posicao_primario(),))
+                    atraso = cur.fetchone()[0]
+                conn.rollback()
+            # Nada aplicado ainda desde que a réplica subiu: não dá para saber o atraso
+            replica.atraso = float('inf') if atraso is None else float(atraso)
+        except psycopg2.Error:
+            replica.atraso = float('inf')
+        replica.verificada_em = agora
+        return replica.atraso
+
+    def marcar_indisponivel(self, replica: Replica):
+        replica.atraso, replica.verificada_em = float('inf'), time.monotonic()
+
+    def escolher(self, conn_primario=None) -> Optional[Replica]:
+        """
+        Próxima réplica em dia, ou None se todas estão atrasadas ou fora do ar.
+        A posição do WAL no primário é lida em `conn_primario` (ou no pool),
+        só quando alguma réplica precisa ser medida.
+        """
+        with self._lock:
+            inicio = self._proxima
+            self._proxima = (self._proxima + 1) % len(self.replicas)
+        lida = []
+
+        def posicao_primario():
+            if not lida:
+                lida.append(_posicao_wal_primario(conn_primario))
+            return lida[0]
+
+        for deslocamento in range(len(self.replicas)):
+            replica = self.replicas[(inicio + deslocamento) % len(self.replicas)]
+            if self._medir(replica, posicao_primario) <= self.atraso_max:
+                return replica
+        atrasos = ", ".join(f"{replica.nome} {replica.atraso:.0f}s" if replica.atraso != float('inf')
+                            else f"{replica.nome} fora do ar" for replica in self.replicas)
+        print(f"(réplicas atrasadas ou fora do ar, lendo do primário: {atrasos})")
+        return None
+
+    def fechar(self):
+        for replica in self.replicas:
+            replica.pool.fechar()
+
+
+_replicas = None
+
+
+def obter_replicas() -> Optional[ReplicasLeitura]:
+    """Réplicas configuradas em DB_REPLICAS, ou None se só há o primário."""
+    global _replicas
+    if not DB_REPLICAS:
+        return None
+    with _pool_lock:
+        if _replicas is None:
+            _replicas = ReplicasLeitura(DB_REPLICAS)
+    return _replicas
+
+
+def fechar_replicas():
+    if _replicas is not None:
+        _replicas.fechar()
+
+
+def parametros_de_leitura() -> dict:
+    """Parâmetros de conexão de uma réplica em dia, ou os do primário."""
+    replicas = obter_replicas()
+    replica = replicas.escolher() if replicas else None
+    return replica.parametros if replica is not None else _parametros_conexao()
+
+
+def _parametros_asyncpg(parametros: dict) -> dict:
+    """
+    Argumentos de asyncpg.create_pool equivalentes a um conninfo do libpq.
+    O asyncpg lê um DSN em URI e trata chaves desconhecidas como configurações
+    do servidor, então connect_timeout e options são convertidos à parte.
+    """
+    from urllib.parse import urlencode
+    import shlex
+    consulta = {chave: valor for chave, valor in parametros.items()
+                if chave != 'cursor_factory' and valor is not None}
+    argumentos = {}
+    if 'connect_timeout' in consulta:
+        argumentos['timeout'] = float(consulta.pop('connect_timeout'))
+    configuracoes = {}
+    opcoes = shlex.split(consulta.pop('options', ''))
+    for i, opcao in enumerate(opcoes):
+        # "-c chave=valor", "-cchave=valor" ou "--chave=valor"
+        if opcao == '-c' and i + 1 < len(opcoes):
+            opcao = opcoes[i + 1]
+        elif opcao.startswith('-c'):
+            opcao = opcao[2:]
+        elif opcao.startswith('--'):
+            opcao = opcao[2:]
+        else:
+            continue
+        chave, igual, valor = opcao.partition('=')
+        if igual:
+            configuracoes[chave.replace('-', '_')] = valor
+    if 'application_name' in consulta:
+        configuracoes['application_name'] = consulta.pop('application_name')
+    if configuracoes:
+        argumentos['server_settings'] = configuracoes
+    # Tudo na query string: host pode ser um diretório de socket
+    argumentos['dsn'] = "postgresql://?" + urlencode(consulta)
+    return argumentos
+
+
+@contextmanager
+def conexao_de_leitura(conn_primario):
+    """
+    Conexão para uma operação só de leitura: de uma réplica em dia, se houver,
+    ou a própria `conn_primario`.
+    """
+    replicas = obter_replicas()
+    replica = replicas.escolher(conn_primario) if replicas else None
+    if replica is None:
+        yield conn_primario
+        return
+    try:
+        conn = replica.pool.obter()
+    except psycopg2.OperationalError:
+        replicas.marcar_indisponivel(replica)
+        print(f"(réplica {replica.nome} fora do ar, lendo do primário)")
+        yield conn_primario
+        return
+    descartar = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        descartar = True
+        raise
+    finally:
+        replica.pool.devolver(conn, descartar)
+
+
+def ordem_topologica(tables_dict: dict = tables) -> list:
+    """
+    Ordena as tabelas de forma que cada uma venha depois das tabelas que ela
+    referencia nas cláusulas FOREIGN KEY do seu CREATE TABLE. Em caso de empate
+    a ordem do dicionário é mantida.
+    """
+    nomes = {}
+    for table_name, table_description in tables_dict.items():
+        criada = re.search(r"CREATE TABLE(?: IF NOT EXISTS)?\s+(\w+)", table_description, re.IGNORECASE)
+        nomes[criada.group(1).lower()] = table_name
+
+    dependencias = {}
+    for table_name, table_description in tables_dict.items():
+        referenciadas = re.findall(r"REFERENCES\s+(\w+)", table_description, re.IGNORECASE)
+        dependencias[table_name] = {nomes[r.lower()] for r in referenciadas
+                                    if r.lower() in nomes and nomes[r.lower()] != table_name}
+
+    ordem = []
+    pendentes = list(tables_dict)
+    while pendentes:
+        prontas = [t for t in pendentes if dependencias[t].issubset(ordem)]
+        if not prontas:
+            raise ValueError(f"Dependência circular entre as tabelas: {', '.join(pendentes)}")
+        ordem.extend(prontas)
+        pendentes = [t for t in pendentes if t not in prontas]
+    return ordem
+
+
+def _executar_em_uma_ida(conn, comandos: list):
+    """
+    Envia todos os comandos em um único script BEGIN ... COMMIT, ou seja, uma
+    única ida ao servidor. Se algum comando falhar nada é aplicado.
+    """
+    script = "BEGIN;\n" + ";\n".join(comandos) + ";\nCOMMIT;"
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute(script)
+    except psycopg2.Error:
+        if not conn.closed:
+            cur.execute("ROLLBACK")
+        raise
+    finally:
+        cur.close()
+        conn.autocommit = autocommit
+
+
+# Partições de reserva e pedido (PARTICIONAR_RESERVAS=1)
+
+TABELAS_PARTICIONADAS = ('reserva', 'pedido')
+
+
+def _inicio_do_periodo(data: datetime) -> datetime:
+    if PARTICAO_INTERVALO == 'ano':
+        return datetime(data.year, 1, 1)
+    return datetime(data.year, data.month, 1)
+
+
+def _proximo_periodo(inicio: datetime) -> datetime:
+    if PARTICAO_INTERVALO == 'ano':
+        return datetime(inicio.year + 1, 1, 1)
+    return datetime(inicio.year + inicio.month // 12, inicio.month % 12 + 1, 1)
+
+
+def _nome_particao(tabela: str, inicio: datetime) -> str:
+    return f"{tabela}_p{inicio:%Y}" if PARTICAO_INTERVALO == 'ano' else f"{tabela}_p{inicio:%Y_%m}"
+
+
+def criar_particoes(conn, inicio: datetime, fim: datetime) -> int:
+    """
+    Cria, se ainda não existirem, as partições mensais (ou anuais, com
+    PARTICAO_INTERVALO=ano) de reserva e pedido que cobrem de `inicio` a `fim`.
+    Devolve quantos períodos foram verificados.
+    """
+    comandos = []
+    periodo = _inicio_do_periodo(inicio)
+    while periodo <= fim:
+        seguinte = _proximo_periodo(periodo)
+        for tabela in TABELAS_PARTICIONADAS:
+            comandos.append(f"CREATE TABLE IF NOT EXISTS {_nome_particao(tabela, periodo)} PARTITION OF {tabela} "
+                            f"FOR VALUES FROM ('{periodo:%Y-%m-%d}') TO ('{seguinte:%Y-%m-%d}')")
+        periodo = seguinte
+    if comandos:
+        _executar_em_uma_ida(conn, comandos)
+    return len(comandos) // len(TABELAS_PARTICIONADAS)
+
+
+def garantir_particoes_futuras(conn, periodos: int = PARTICOES_FUTURAS) -> bool:
+    """
+    Garante as partições desde PARTICOES_DESDE até `periodos` meses (ou anos)
+    à frente do atual, para que novas reservas não caiam na partição padrão.
+    Sem efeito se o esquema não estiver particionado ou ainda não existir.
+    """
+    if not PARTICIONAR_RESERVAS:
+        return False
+    fim = _inicio_do_periodo(datetime.now())
+    for _ in range(periodos):
+        fim = _proximo_periodo(fim)
+    try:
+        criar_particoes(conn, datetime.fromisoformat(PARTICOES_DESDE), fim)
+        return True
+    except psycopg2.errors.UndefinedTable:
+        return False
+    except psycopg2.Error as e:
+        print("Erro ao criar as partições futuras")
+        print(e.pgcode)
+        print(e.pgerror)
+        return False
+
+
+def criar_todas_as_tabelas(conn):
+    ordem = ordem_topologica()
+    # Partição padrão para datas fora dos intervalos criados
+    padrao = [f"CREATE TABLE IF NOT EXISTS {tabela}_padrao PARTITION OF {tabela} DEFAULT"
+              for tabela in TABELAS_PARTICIONADAS] if PARTICIONAR_RESERVAS else []
+    try:
+        _executar_em_uma_ida(conn, [tables[table_name] for table_name in ordem] + padrao + list(indexes.values())
+                             + list(disponibilidade_ddl.values()) + list(faturamento_ddl.values()))
+        for table_name in ordem:
+            print(f"Tabela {table_name} criada com sucesso!")
+        print(f"{len(indexes)} índices de chaves estrangeiras criados com sucesso!")
+        print("Intervalo das reservas (periodo) e índice de disponibilidade criados com sucesso!")
+        print("Totais de faturamento (conta_reserva, receita_hotel, receita_dia) e triggers de pedido criados!")
+        if garantir_particoes_futuras(conn):
+            print(f"Partições de {' e '.join(TABELAS_PARTICIONADAS)} criadas de {PARTICOES_DESDE} "
+                  f"até {PARTICOES_FUTURAS} períodos à frente")
+        return True
+    except psycopg2.Error as e:
+        print("Erro ao criar as tabelas, nenhuma alteração foi aplicada")
+        print(e.pgcode)
+        print(e.pgerror)
+        return False
+
+
+def inserir_valores(conn):
+    ordem = [insert_name for insert_name in ordem_topologica() if insert_name in inserts]
+    try:
+        # As chaves estrangeiras são DEFERRABLE: a verificação fica para o COMMIT
+        _executar_em_uma_ida(conn, ["SET CONSTRAINTS ALL DEFERRED"] + [inserts[insert_name] for insert_name in ordem])
+        for insert_name in ordem:
+            print(f"Valores inseridos na tabela {insert_name} com sucesso!")
+        return True
+    except psycopg2.Error as e:
+        print("Erro ao inserir valores, nenhuma linha foi inserida")
+        print(e.pgcode)
+        print(e.pgerror)
+        return False
+
+
+def remover_todas_as_tabelas(conn):
+    ordem = [drop_name for drop_name in reversed(ordem_topologica()) if drop_name in drop]
+    try:
+        _executar_em_uma_ida(conn, [drop[drop_name] for drop_name in ordem] + ["DROP TABLE IF EXISTS mv_controle"]
+                             + [f"DROP TABLE IF EXISTS {tabela}" for tabela in RECALCULO_FATURAMENTO]
+                             + [f"DROP FUNCTION IF EXISTS faturamento_pedido_{evento}()"
+                                for evento in ('insert', 'delete', 'update')]
+                             + ["DROP FUNCTION IF EXISTS faturamento_reserva_update()"])
+        for drop_name in ordem:
+            print(f"Tabela {drop_name} removida, se existia.")
+        return True
+    except psycopg2.Error as e:
+        print("Erro ao remover as tabelas, nenhuma alteração foi aplicada")
+        print(e.pgcode)
+        print(e.pgerror)
+        return False
+
+
+# Geração de dados sintéticos (fator de escala, no estilo do dbgen do TPC-H)
+
+TIPOS_FUNCIONARIO = ('Cozinheiro', 'Faxineiro', 'Manobrista', 'Recepcionista')
+PLANOS_SINTETICOS = ((1, 'Standard', 'Apenas café da manhã', 250.00),
+                     (2, 'Premium', 'Café e Jantar inclusos', 400.00),
+                     (3, 'Deluxe', 'Todas as refeições e bebidas', 800.00))
+ITENS_SINTETICOS = (('Refrigerante Lata', 8.00), ('Sanduíche Natural', 25.00), ('Jantar Especial', 120.00),
+                    ('Água Mineral', 5.00), ('Suco Natural', 12.00), ('Cerveja Long Neck', 15.00),
+                    ('Vinho Tinto', 90.00), ('Café Expresso', 7.00), ('Bolo do Dia', 14.00),
+                    ('Porção de Fritas', 32.00), ('Pizza Individual', 48.00), ('Salada Caesar', 38.00),
+                    ('Lavanderia', 60.00), ('Massagem', 180.00), ('Passeio de Barco', 250.00),
+                    ('Aluguel de Bicicleta', 40.00), ('Frigobar Completo', 95.00), ('Translado', 150.00),
+                    ('Late Checkout', 100.00), ('Café no Quarto', 45.00))
+NOMES = ('Ana', 'Bruno', 'Carla', 'Diego', 'Elisa', 'Fábio', 'Gabriela', 'Heitor', 'Isabela', 'João',
+         'Karina', 'Lucas', 'Mariana', 'Nicolas', 'Olívia', 'Pedro', 'Rafaela', 'Sérgio', 'Tatiane', 'Vinícius')
+SOBRENOMES = ('Silva', 'Santos', 'Oliveira', 'Souza', 'Pereira', 'Costa', 'Rodrigues', 'Almeida',
+              'Nascimento', 'Lima', 'Araújo', 'Fernandes', 'Carvalho', 'Gomes', 'Martins', 'Rocha')
+CIDADES = ('São Paulo, SP', 'Rio de Janeiro, RJ', 'Belo Horizonte, MG', 'Curitiba, PR', 'Porto Alegre, RS',
+           'Florianópolis, SC', 'Salvador, BA', 'Recife, PE', 'Fortaleza, CE', 'Brasília, DF')
+MODELOS = ('Honda Civic', 'Fiat Toro', 'BMW X5', 'Jeep Compass', 'VW Gol', 'Toyota Corolla',
+           'Hyundai HB20', 'Chevrolet Onix', 'Renault Kwid', 'Ford Ranger')
+CORES = ('Prata', 'Vermelho', 'Preto', 'Branco', 'Cinza', 'Azul')
+ESPECIES = ('Cachorro', 'Gato', 'Coelho', 'Calopsita')
+NOMES_ANIMAIS = ('Rex', 'Mimi', 'Thor', 'Luna', 'Bob', 'Mel', 'Pipoca', 'Fred')
+
+FUNCIONARIOS_POR_HOTEL = 40
+QUARTOS_POR_HOTEL = 100
+VAGAS_POR_HOTEL = 50
+INICIO_RESERVAS = datetime(2023, 1, 1, 14, 0)
+
+
+def _mistura(*valores: int) -> int:
+    """
+    Hash inteiro determinístico (splitmix64) usado no lugar de um gerador
+    aleatório com estado: qualquer linha pode ser recalculada a partir do id.
+    """
+    x = SEMENTE_DADOS
+    for v in valores:
+        x = (x + 0x9E3779B97F4A7C15 + v) & 0xFFFFFFFFFFFFFFFF
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        x ^= x >> 31
+    return x
+
+
+class GeradorDados:
+    """
+    Gera linhas referencialmente consistentes para as onze tabelas a partir de
+    um fator de escala. Com escala 1 são 10 hotéis, 100 mil reservas e 1 milhão
+    de pedidos. Nenhuma tabela é mantida em memória: as chaves estrangeiras de
+    cada linha são derivadas do seu próprio id.
+    """
+
+    def __init__(self, escala: float = 1.0):
+        self.escala = escala
+        self.n_hoteis = max(1, round(10 * escala))
+        self.n_funcionarios = self.n_hoteis * FUNCIONARIOS_POR_HOTEL
+        self.n_quartos = self.n_hoteis * QUARTOS_POR_HOTEL
+        self.n_vagas = self.n_hoteis * VAGAS_POR_HOTEL
+        self.n_reservas = max(1, round(100_000 * escala))
+        self.n_hospedes = round(1.5 * self.n_reservas)
+        self.n_veiculos = round(0.3 * self.n_reservas)
+        self.n_animais = round(0.1 * self.n_reservas)
+        self.n_pedidos = round(10 * self.n_reservas)
+
+    def periodo_reservas(self) -> tuple:
+        # A última semana ocupada, mais a variação de até dois dias na entrada
+        semanas = (self.n_reservas - 1) // self.n_hoteis // QUARTOS_POR_HOTEL
+        return INICIO_RESERVAS, INICIO_RESERVAS + timedelta(days=semanas * 7 + 2)
+
+    def total_linhas(self) -> int:
+        return (self.n_hoteis + len(PLANOS_SINTETICOS) + len(ITENS_SINTETICOS) + self.n_funcionarios
+                + self.n_quartos + self.n_vagas + self.n_reservas + self.n_hospedes
+                + self.n_veiculos + self.n_animais + self.n_pedidos)
+
+    # Derivações usadas para manter as chaves estrangeiras consistentes
+
+    def funcionario(self, id_hotel: int, tipo: str, semente: int) -> int:
+        por_tipo = FUNCIONARIOS_POR_HOTEL // len(TIPOS_FUNCIONARIO)
+        k = semente % por_tipo
+        return (id_hotel - 1) * FUNCIONARIOS_POR_HOTEL + k * len(TIPOS_FUNCIONARIO) + TIPOS_FUNCIONARIO.index(tipo) + 1
+
+    def hotel_da_reserva(self, id_reserva: int) -> int:
+        return (id_reserva - 1) % self.n_hoteis + 1
+
+    def reserva(self, id_reserva: int) -> tuple:
+        # Cada quarto recebe uma estadia por semana, o que garante que duas
+        # reservas nunca se sobrepõem no mesmo quarto.
+        id_hotel = self.hotel_da_reserva(id_reserva)
+        k = (id_reserva - 1) // self.n_hoteis
+        id_quarto = (id_hotel - 1) * QUARTOS_POR_HOTEL + k % QUARTOS_POR_HOTEL + 1
+        semana = k // QUARTOS_POR_HOTEL
+        h = _mistura(id_reserva, 1)
+        data_entrada = INICIO_RESERVAS + timedelta(days=semana * 7 + h % 3)
+        dias = 1 + (h >> 8) % 4
+        data_saida = data_entrada.replace(hour=12) + timedelta(days=dias)
+        id_plano, _, _, valor_plano = PLANOS_SINTETICOS[(h >> 16) % len(PLANOS_SINTETICOS)]
+        id_funcionario = self.funcionario(id_hotel, 'Recepcionista', h >> 24)
+        return (id_reserva, data_entrada, data_saida, dias * valor_plano,
+                id_quarto, id_funcionario, id_plano, id_hotel)
+
+    # Linhas de cada tabela
+
+    def linhas_hotel(self):
+        for i in range(1, self.n_hoteis + 1):
+            cidade = CIDADES[(i - 1) % len(CIDADES)]
+            yield (i, f'Hotel {SOBRENOMES[(i - 1) % len(SOBRENOMES)]} {i}',
+                   f'Rua {NOMES[_mistura(i, 2) % len(NOMES)]}, {i * 10} - {cidade}',
+                   f'{11 + i % 89}-5555-{i:04d}')
+
+    def linhas_plano(self):
+        yield from PLANOS_SINTETICOS
+
+    def linhas_item(self):
+        for i, (nome, valor) in enumerate(ITENS_SINTETICOS, start=1):
+            yield (i, nome, valor)
+
+    def linhas_funcionario(self):
+        for i in range(1, self.n_funcionarios + 1):
+            h = _mistura(i, 3)
+            nome = f'{NOMES[h % len(NOMES)]} {SOBRENOMES[(h >> 8) % len(SOBRENOMES)]}'
+            yield (i, (i - 1) // FUNCIONARIOS_POR_HOTEL + 1, nome, _cpf(i, 1),
+                   TIPOS_FUNCIONARIO[(i - 1) % len(TIPOS_FUNCIONARIO)])
+
+    def linhas_vaga(self):
+        for i in range(1, self.n_vagas + 1):
+            yield (i, (i - 1) // VAGAS_POR_HOTEL + 1, (i - 1) % VAGAS_POR_HOTEL + 1)
+
+    def linhas_quarto(self):
+        for i in range(1, self.n_quartos + 1):
+            id_hotel = (i - 1) // QUARTOS_POR_HOTEL + 1
+            k = (i - 1) % QUARTOS_POR_HOTEL
+            yield (i, (k // 20 + 1) * 100 + k % 20 + 1, id_hotel, self.funcionario(id_hotel, 'Faxineiro', k))
+
+    def linhas_reserva(self):
+        for i in range(1, self.n_reservas + 1):
+            yield self.reserva(i)
+
+    def linhas_hospede(self):
+        for i in range(1, self.n_hospedes + 1):
+            id_reserva = (i - 1) % self.n_reservas + 1
+            h = _mistura(i, 4)
+            nome = f'{NOMES[h % len(NOMES)]} {SOBRENOMES[(h >> 8) % len(SOBRENOMES)]}'
+            yield (i, nome, _cpf(i, 2), CIDADES[(h >> 16) % len(CIDADES)], f'hospede{i}@email.com',
+                   id_reserva, self.hotel_da_reserva(id_reserva))
+
+    def linhas_veiculo(self):
+        for i in range(1, self.n_veiculos + 1):
+            h = _mistura(i, 5)
+            id_reserva = h % self.n_reservas + 1
+            id_hotel = self.hotel_da_reserva(id_reserva)
+            letras = ''.join(chr(65 + (h >> s) % 26) for s in (8, 13, 18))
+            yield (i, f'{letras}-{i % 10000:04d}', MODELOS[(h >> 23) % len(MODELOS)], CORES[(h >> 28) % len(CORES)],
+                   (id_hotel - 1) * VAGAS_POR_HOTEL + (h >> 33) % VAGAS_POR_HOTEL + 1,
+                   self.funcionario(id_hotel, 'Manobrista', h >> 40), id_reserva, id_hotel)
+
+    def linhas_animal_estimacao(self):
+        for i in range(1, self.n_animais + 1):
+            h = _mistura(i, 6)
+            id_reserva = h % self.n_reservas + 1
+            yield (i, NOMES_ANIMAIS[(h >> 8) % len(NOMES_ANIMAIS)], ESPECIES[(h >> 12) % len(ESPECIES)],
+                   round(1 + (h >> 16) % 400 / 10, 1), id_reserva, self.hotel_da_reserva(id_reserva))
+
+    def linhas_pedido(self):
+        # No esquema particionado o pedido leva a data_entrada da sua reserva
+        com_data = 'data_entrada' in _colunas_da_tabela('PEDIDO')
+        for i in range(1, self.n_pedidos + 1):
+            h = _mistura(i, 7)
+            id_reserva = h % self.n_reservas + 1
+            id_hotel = self.hotel_da_reserva(id_reserva)
+            id_item = (h >> 32) % len(ITENS_SINTETICOS) + 1
+            linha = (i, ITENS_SINTETICOS[id_item - 1][1], id_reserva, id_item,
+                     self.funcionario(id_hotel, 'Cozinheiro', h >> 40), id_hotel)
+            yield linha + (self.reserva(id_reserva)[1],) if com_data else linha
+
+    def linhas(self, table_name: str):
+        return getattr(self, f'linhas_{table_name.lower()}')()
+
+
+def _cpf(i: int, serie: int) -> str:
+    n = f'{serie}{i:010d}'[-11:]
+    return f'{n[:3]}.{n[3:6]}.{n[6:9]}-{n[9:]}'
+
+
+def _estrutura_ddl(table_description: str) -> list:
+    """
+    Lê um CREATE TABLE de `tables` e devolve, na ordem das colunas, tuplas
+    (coluna, tipo, é chave primária, tabela referenciada ou None, valores do CHECK ou None).
+    """
+    corpo = table_description.split('(', 1)[1]
+    referencias = {coluna.strip(): tabela for colunas, tabela in
+                   re.findall(r"FOREIGN KEY\s*\(([\w\s,]+)\)\s*REFERENCES\s+(\w+)", corpo, re.IGNORECASE)
+                   for coluna in colunas.split(',')}
+    chave_composta = re.search(r"^\s*PRIMARY KEY\s*\(([\w\s,]+)\)", corpo, re.IGNORECASE | re.MULTILINE)
+    chave_composta = {c.strip() for c in chave_composta.group(1).split(',')} if chave_composta else set()
+    checks = {coluna: re.findall(r"'([^']*)'", valores) for coluna, valores in
+              re.findall(r"CHECK\s*\((\w+)\s+in\s*\(([^)]*)\)", corpo, re.IGNORECASE)}
+    estrutura = []
+    for linha in corpo.splitlines():
+        linha = linha.strip()
+        if not linha or linha.upper().startswith(('FOREIGN KEY', 'CHECK', 'PRIMARY KEY')):
+            continue
+        coluna, tipo = linha.split()[:2]
+        estrutura.append((coluna, tipo.split('(')[0].rstrip(',)'),
+                          'PRIMARY KEY' in linha.upper() or coluna in chave_composta,
+                          referencias.get(coluna), checks.get(coluna)))
+    return estrutura
+
+
+def _colunas_da_tabela(table_name: str) -> list:
+    """
+    Extrai a lista de colunas (na ordem do CREATE TABLE) a partir do DDL em `tables`.
+    """
+    return [coluna for coluna, *_ in _estrutura_ddl(tables[table_name])]
+
+
+def _copiar_em_lotes(cur, table_name: str, linhas, lote: int = LOTE_COPY) -> int:
+    """
+    Envia as linhas com COPY ... FROM STDIN em blocos de `lote` linhas, de modo
+    que a memória usada não depende do tamanho da tabela.
+    """
+    colunas = _colunas_da_tabela(table_name)
+    copy_sql = f"COPY {table_name.lower()} ({', '.join(colunas)}) FROM STDIN WITH (FORMAT csv)"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    total = 0
+    pendentes = 0
+    for linha in linhas:
+        writer.writerow(linha)
+        pendentes += 1
+        if pendentes == lote:
+            buffer.seek(0)
+            cur.copy_expert(copy_sql, buffer)
+            buffer.seek(0)
+            buffer.truncate()
+            total += pendentes
+            pendentes = 0
+    if pendentes:
+        buffer.seek(0)
+        cur.copy_expert(copy_sql, buffer)
+        total += pendentes
+    return total
+
+
+def gerar_dados_sinteticos(conn, escala: float = ESCALA_DADOS):
+    gerador = GeradorDados(escala)
+    print(f"Gerando aproximadamente {gerador.total_linhas():,} linhas com fator de escala {escala}.")
+    cur = conn.cursor()
+    inicio_total = time.perf_counter()
+    sucesso = True
+    if PARTICIONAR_RESERVAS:
+        try:
+            periodos = criar_particoes(conn, *gerador.periodo_reservas())
+            print(f"{periodos} partições por tabela verificadas para o período das reservas")
+        except psycopg2.Error as e:
+            print("Erro ao criar as partições do período das reservas")
+            print(e.pgcode)
+            print(e.pgerror)
+    for table_name in ordem_topologica():
+        inicio = time.perf_counter()
+        try:
+            total = _copiar_em_lotes(cur, table_name, gerador.linhas(table_name))
+            conn.commit()
+            decorrido = time.perf_counter() - inicio
+            print(f"Tabela {table_name}: {total:,} linhas em {decorrido:.1f}s "
+                  f"({total / max(decorrido, 1e-9):,.0f} linhas/s)")
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Erro ao carregar dados sintéticos na tabela {table_name}")
+            print(e.pgcode)
+            print(e.pgerror)
+            sucesso = False
+            break
+    print(f"Carga sintética finalizada em {time.perf_counter() - inicio_total:.1f}s")
+    cur.close()
+    return sucesso
+
+
+def _chave_primaria(table_name: str) -> str:
+    # Na chave composta das tabelas particionadas vale a primeira coluna (o id)
+    definicao = re.search(r"(\w+)\s+\w+\s+PRIMARY KEY|PRIMARY KEY\s*\((\w+)", tables[table_name], re.IGNORECASE)
+    return definicao.group(1) or definicao.group(2)
+
+
+def transmitir_tabela(conn, table_name: str, saida=None, itersize: int = ITERSIZE_CONSULTA,
+                      limite: Optional[int] = None, deslocamento: int = 0, desfazer: bool = True) -> int:
+    """
+    Lê a tabela com um cursor nomeado (do lado do servidor), que traz `itersize`
+    linhas por vez. Cada linha é impressa, ou escrita em `saida` (um csv.writer),
+    assim que chega, então a memória usada não depende do tamanho da tabela.
+    """
+    colunas = ', '.join(_colunas_da_tabela(table_name))
+    select_sql = f"SELECT {colunas} FROM {table_name.lower()} ORDER BY {_chave_primaria(table_name)}"
+    params = []
+    if limite is not None:
+        select_sql += " LIMIT %s"
+        params.append(limite)
+    if deslocamento:
+        select_sql += " OFFSET %s"
+        params.append(deslocamento)
+    return transmitir_sql(conn, select_sql, params, saida, itersize, nome=f"consulta_{table_name.lower()}",
+                          desfazer=desfazer)
+
+
+def transmitir_sql(conn, select_sql: str, params=None, saida=None, itersize: int = ITERSIZE_CONSULTA,
+                   nome: str = "consulta_cli", cabecalho=None, desfazer: bool = True) -> int:
+    """
+    Executa um SELECT qualquer com cursor nomeado e entrega as linhas uma a uma,
+    como em transmitir_tabela. `cabecalho`, se informado, recebe a lista de
+    colunas antes da primeira linha. Com desfazer=False a transação fica aberta,
+    para que o SELECT enxergue e não descarte escritas ainda não confirmadas.
+    """
+    cur = conn.cursor(name=nome)
+    cur.itersize = itersize
+    total = 0
+    try:
+        cur.execute(select_sql, params)
+        for row in cur:
+            if total == 0 and cabecalho is not None:
+                cabecalho([desc[0] for desc in cur.description])
+            if saida is None:
+                print(row)
+            else:
+                saida.writerow(row)
+            total += 1
+        if total == 0 and cabecalho is not None and cur.description is not None:
+            cabecalho([desc[0] for desc in cur.description])
+    finally:
+        cur.close()
+        if desfazer:
+            conn.rollback()
+    return total
+
+
+def paginar_tabela(conn, table_name: str, tamanho_pagina: int, apos=None):
+    """
+    Paginação por chave (keyset): busca as próximas `tamanho_pagina` linhas com
+    chave primária maior que `apos`. Devolve as linhas e a chave da última
+    delas, que deve ser passada na próxima chamada.
+    """
+    chave = _chave_primaria(table_name)
+    colunas = _colunas_da_tabela(table_name)
+    lista = ', '.join(colunas)
+    cur = conn.cursor()
+    try:
+        if apos is None:
+            cur.execute(f"SELECT {lista} FROM {table_name.lower()} ORDER BY {chave} LIMIT %s", (tamanho_pagina,))
+        else:
+            cur.execute(f"SELECT {lista} FROM {table_name.lower()} WHERE {chave} > %s ORDER BY {chave} LIMIT %s",
+                        (apos, tamanho_pagina))
+        linhas = cur.fetchall()
+    finally:
+        cur.close()
+        conn.rollback()
+    indice = colunas.index(chave)
+    return linhas, (linhas[-1][indice] if linhas else apos)
+
+
+def consulta_individual(conn):
+    print("Tabelas disponíveis:")
+    for table_name in tables:
+        print(f"Nome: {table_name}")
+    name = input("Digite o nome da tabela que deseja consultar: ").upper().strip()
+
+    if name not in tables:
+        print("Tabela não encontrada. Digite exatamente um dos nomes listados.")
+        return
+
+    print(f"A tabela foi gerada usando o seguinte código: \n{tables[name]}")
+    modo = input("Modo: 1 streaming (padrão), 2 paginação por chave primária, 3 exportar CSV: ").strip() or '1'
+
+    try:
+        if modo == '2':
+            tamanho = int(input("Linhas por página (padrão 50): ").strip() or 50)
+            print(f"TABELA {name}")
+            apos = None
+            while True:
+                linhas, apos = paginar_tabela(conn, name, tamanho, apos)
+                for x in linhas:
+                    print(x)
+                if len(linhas) < tamanho:
+                    print("Fim da tabela.")
+                    break
+                if input("Enter para a próxima página, 'q' para sair: ").strip().lower() == 'q':
+                    break
+        elif modo == '3':
+            caminho = input(f"Arquivo de saída (padrão {name.lower()}.csv): ").strip() or f"{name.lower()}.csv"
+            with open(caminho, 'w', newline='', encoding='utf-8') as arquivo:
+                writer = csv.writer(arquivo)
+                writer.writerow(_colunas_da_tabela(name))
+                total = transmitir_tabela(conn, name, saida=writer)
+            print(f"{total:,} linhas exportadas para {caminho}")
+        else:
+            limite = input("LIMIT (vazio para todas as linhas): ").strip()
+            deslocamento = input("OFFSET (vazio para 0): ").strip()
+            print(f"TABELA {name}")
+            total = transmitir_tabela(conn, name, limite=int(limite) if limite else None,
+                                      deslocamento=int(deslocamento) if deslocamento else 0)
+            print(f"{total:,} linhas")
+    except ValueError:
+        print("Valor numérico inválido.")
+    except psycopg2.Error as e:
+        print("Erro ao consultar tabela")
+        print(e.pgcode)
+        print(e.pgerror)
+
+
+# CRUD tipado: parâmetros vinculados e comandos preparados no servidor
+
+def _inteiro(valor) -> int:
+    if isinstance(valor, str) and not valor.lstrip('+-').isdigit():
+        valor = float(valor)  # "8.0" e "1e3" valem como inteiros, como no SQL
+    if isinstance(valor, float) and not valor.is_integer():
+        raise ValueError(valor)
+    return int(valor)
+
+
+def _timestamp(valor) -> datetime:
+    return valor if isinstance(valor, datetime) else datetime.fromisoformat(str(valor))
+
+
+CONVERSORES_TIPO = {'integer': _inteiro, 'float': float, 'varchar': str, 'text': str, 'timestamp': _timestamp}
+
+# Comandos já preparados em cada conexão; a entrada some junto com a conexão
+_preparados = weakref.WeakKeyDictionary()
+
+
+def _converter(name: str, coluna: str, tipo: str, valor):
+    """
+    Converte um valor para o tipo da coluna no CREATE TABLE. Textos digitados
+    como no SQL também são aceitos: NULL vira None e aspas externas são
+    removidas com as regras do SQL ('D''Ávila' -> D'Ávila; a barra invertida
+    fica como está).
+    """
+    if isinstance(valor, str):
+        texto = valor.strip()
+        if texto.upper() == 'NULL':
+            return None
+        if len(texto) >= 2 and texto[0] == texto[-1] and texto[0] in "'\"":
+            texto = texto[1:-1].replace(texto[0] * 2, texto[0])
+        valor = texto
+    if valor is None:
+        return None
+    try:
+        return CONVERSORES_TIPO.get(tipo, str)(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"Valor inválido para {name.lower()}.{coluna} ({tipo}): {valor!r}") from None
+
+
+# Um valor da tupla: string entre aspas (aspas dobradas dentro) ou texto sem vírgula
+_VALOR_TUPLA = re.compile(r"""\s*('(?:[^']|'')*'|"(?:[^"]|"")*"|[^,'"]*?)\s*(?:,|$)""")
+
+
+def ler_tupla(texto: str) -> tuple:
+    """
+    Separa uma tupla escrita como no SQL, ex.: (101, 'D''Ávila', NULL, 8.5),
+    no literal de cada valor. A conversão de cada um fica com _converter.
+    """
+    interno = texto.strip()
+    if interno.startswith('(') and interno.endswith(')'):
+        interno = interno[1:-1]
+    if not interno.strip():
+        return ()
+    valores, posicao = [], 0
+    while posicao < len(interno):
+        m = _VALOR_TUPLA.match(interno, posicao)
+        if m is None or not m.group(1):
+            raise ValueError(f"Tupla inválida: {texto}")
+        valores.append(m.group(1))
+        posicao = m.end()
+        if interno[posicao - 1] == ',' and posicao == len(interno):
+            raise ValueError(f"Tupla inválida: {texto}")
+    return tuple(valores)
+
+
+def _linha_tipada(name: str, estrutura: list, linha) -> tuple:
+    if len(linha) != len(estrutura):
+        raise ValueError(f"A tabela {name} tem {len(estrutura)} colunas, foram informados {len(linha)} valores")
+    return tuple(_converter(name, coluna, tipo, valor) for (coluna, tipo, *_), valor in zip(estrutura, linha))
+
+
+def _tipo_da_coluna(name: str, estrutura: list, coluna: str) -> str:
+    for nome_coluna, tipo, *_ in estrutura:
+        if nome_coluna == coluna:
+            return tipo
+    raise ValueError(f"Coluna desconhecida em {name}: {coluna}")
+
+
+def _executar_preparado(cur, nome: str, tipos: list, comando: str, valores):
+    """
+    Executa `comando` (com $1, $2, ...) como comando preparado da sessão. O
+    PREPARE só é enviado na primeira vez em cada conexão; depois o servidor
+    reaproveita o plano e só os valores vão pela rede.
+    """
+    preparados = _preparados.setdefault(cur.connection, set())
+    if nome not in preparados:
+        cur.execute(f"PREPARE {nome} ({', '.join(tipos)}) AS {comando}")
+        preparados.add(nome)
+    cur.execute(f"EXECUTE {nome} ({', '.join(['%s'] * len(tipos))})", valores)
+    return cur.rowcount
+
+
+@contextmanager
+def _cursor_de_escrita(conn, confirmar: bool):
+    """
+    Cursor para INSERT/UPDATE/DELETE. Com confirmar=False nem o COMMIT nem o
+    ROLLBACK são feitos aqui: quem chama agrupa várias escritas na mesma
+    transação (modo em lote da linha de comando).
+    """
+    cur = conn.cursor()
+    try:
+        yield cur
+        if confirmar:
+            conn.commit()
+    except psycopg2.Error:
+        if confirmar:
+            conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _em_paginas(cur, comando: str, linhas: list, template: Optional[str], pagina: int) -> int:
+    total = 0
+    for inicio in range(0, len(linhas), pagina):
+        psycopg2.extras.execute_values(cur, comando, linhas[inicio:inicio + pagina], template=template,
+                                       page_size=pagina)
+        total += cur.rowcount
+    return total
+
+
+def inserir_linhas(conn, name: str, linhas: list, confirmar: bool = True, pagina: int = LOTE_CRUD) -> int:
+    """
+    Insere linhas (sequências na ordem das colunas do CREATE TABLE), com os
+    valores convertidos para o tipo de cada coluna. Uma linha usa o INSERT
+    preparado da tabela; várias vão com execute_values, `pagina` por comando.
+    """
+    estrutura = _estrutura_ddl(tables[name])
+    linhas = [_linha_tipada(name, estrutura, linha) for linha in linhas]
+    colunas = ", ".join(coluna for coluna, *_ in estrutura)
+    with _cursor_de_escrita(conn, confirmar) as cur:
+        if len(linhas) == 1:
+            parametros = ", ".join(f"${i}" for i in range(1, len(estrutura) + 1))
+            return _executar_preparado(cur, f"crud_insert_{name.lower()}", [tipo for _, tipo, *_ in estrutura],
+                                       f"INSERT INTO {name.lower()} ({colunas}) VALUES ({parametros})", linhas[0])
+        return _em_paginas(cur, f"INSERT INTO {name.lower()} ({colunas}) VALUES %s", linhas, None, pagina)
+
+
+def atualizar_linhas(conn, name: str, atributo: str, pares: list, chave: Optional[str] = None,
+                     confirmar: bool = True, pagina: int = LOTE_CRUD) -> int:
+    """
+    Atualiza `atributo` nas linhas cuja coluna `chave` (padrão: a chave
+    primária) vale o código de cada par (valor, código). Um par usa o UPDATE
+    preparado; vários vão em UPDATE ... FROM (VALUES ...) paginado.
+    """
+    chave = chave or _chave_primaria(name)
+    estrutura = _estrutura_ddl(tables[name])
+    tipo_valor = _tipo_da_coluna(name, estrutura, atributo)
+    tipo_chave = _tipo_da_coluna(name, estrutura, chave)
+    pares = [(_converter(name, atributo, tipo_valor, valor), _converter(name, chave, tipo_chave, codigo))
+             for valor, codigo in pares]
+    with _cursor_de_escrita(conn, confirmar) as cur:
+        if len(pares) == 1:
+            return _executar_preparado(cur, f"crud_update_{name.lower()}_{atributo}_{chave}",
+                                       [tipo_valor, tipo_chave],
+                                       f"UPDATE {name.lower()} SET {atributo} = $1 WHERE {chave} = $2", pares[0])
+        return _em_paginas(cur, f"UPDATE {name.lower()} AS t SET {atributo} = v.valor FROM (VALUES %s) "
+                                f"AS v(valor, codigo) WHERE t.{chave} = v.codigo",
+                           pares, f"(%s::{tipo_valor}, %s::{tipo_chave})", pagina)
+
+
+def remover_linhas(conn, name: str, codigos: list, chave: Optional[str] = None,
+                   confirmar: bool = True, pagina: int = LOTE_CRUD) -> int:
+    """
+    Remove as linhas cuja coluna `chave` (padrão: a chave primária) vale um
+    dos `codigos`. Um código usa o DELETE preparado; vários vão em
+    DELETE ... USING (VALUES ...) paginado.
+    """
+    chave = chave or _chave_primaria(name)
+    tipo_chave = _tipo_da_coluna(name, _estrutura_ddl(tables[name]), chave)
+    codigos = [(_converter(name, chave, tipo_chave, codigo),) for codigo in codigos]
+    with _cursor_de_escrita(conn, confirmar) as cur:
+        if len(codigos) == 1:
+            return _executar_preparado(cur, f"crud_delete_{name.lower()}_{chave}", [tipo_chave],
+                                       f"DELETE FROM {name.lower()} WHERE {chave} = $1", codigos[0])
+        return _em_paginas(cur, f"DELETE FROM {name.lower()} AS t USING (VALUES %s) AS v(codigo) "
+                                f"WHERE t.{chave} = v.codigo", codigos, f"(%s::{tipo_chave})", pagina)
+
+
+def _roteador_da_escrita(confirmar: bool) -> Optional['RoteadorShards']:
+    # Com SHARDS a escrita vai para o banco do hotel, não para `conn`
+    roteador = obter_roteador()
+    if roteador is not None and not confirmar:
+        raise ValueError("Com SHARDS cada escrita é confirmada no seu shard; não há transação entre shards")
+    return roteador
+
+
+def inserir_registro(conn, name: str, new_value, confirmar: bool = True) -> int:
+    valores = ler_tupla(new_value) if isinstance(new_value, str) else tuple(new_value)
+    roteador = _roteador_da_escrita(confirmar)
+    if roteador is not None:
+        return inserir_roteado(roteador, name, [valores])
+    return inserir_linhas(conn, name, [valores], confirmar)
+
+
+def atualizar_registro(conn, name: str, atributo: str, valor, codigo_f: str, codigo,
+                       confirmar: bool = True, id_hotel=None) -> int:
+    roteador = _roteador_da_escrita(confirmar)
+    if roteador is not None:
+        return atualizar_roteado(roteador, name, atributo, [(valor, codigo)], codigo_f, id_hotel)
+    return atualizar_linhas(conn, name, atributo, [(valor, codigo)], codigo_f, confirmar)
+
+
+def remover_registro(conn, name: str, codigo_f: str, codigo, confirmar: bool = True, id_hotel=None) -> int:
+    roteador = _roteador_da_escrita(confirmar)
+    if roteador is not None:
+        return remover_roteado(roteador, name, [codigo], codigo_f, id_hotel)
+    return remover_linhas(conn, name, [codigo], codigo_f, confirmar)
+
+
+def insert(conn):
+    print("Tabelas disponíveis:")
+    for table_name in tables:
+        print(f"Nome: {table_name}")
+    try:
+        name = input("Digite o nome da tabela onde deseja inserir: ").upper().strip()
+        if name not in tables:
+            print("Tabela não encontrada.")
+            return
+
+        table_description = tables[name]
+        print(f"A tabela foi criada usando o seguinte código: \n{table_description}")
+        new_value = input("Insira os valores em uma tupla. Ex: (101, 'ABC', 123):\n").strip()
+
+        if not (new_value.startswith("(") and new_value.endswith(")")):
+            print("Formato inválido. A tupla deve começar com '(' e terminar com ')'.")
+            return
+
+        inserir_registro(conn, name, new_value)
+        print("Valores inseridos com sucesso!")
+    except psycopg2.Error as e:
+        print("Erro ao inserir valores")
+        print(e.pgcode)
+        print(e.pgerror)
+    except ValueError as e:
+        print("Erro ao inserir valores")
+        print(e)
+
+
+def update(conn):
+    print("Tabelas disponíveis:")
+    for table_name in tables:
+        print(f"Nome: {table_name}")
+    try:
+        name = input("Digite o nome da tabela que deseja atualizar: ").upper().strip()
+        if name not in tables:
+            print("Tabela não encontrada.")
+            return
+
+        table_description = tables[name]
+        print(f"A tabela foi criada usando o seguinte código: \n{table_description}")
+        atributo = input("Digite o atributo a ser alterado: ").strip()
+        valor = input("Digite o valor a ser atribuído (como você escreveria no SQL): ").strip()
+        codigo_f = input("Digite o nome da coluna da chave primária: ").strip()
+        codigo = input("Digite o valor numérico da chave primária: ").strip()
+
+        atualizar_registro(conn, name, atributo, valor, codigo_f, codigo)
+        print("Valor atualizado com sucesso!")
+    except psycopg2.Error as e:
+        print("Erro ao atualizar valor")
+        print(e.pgcode)
+        print(e.pgerror)
+    except ValueError as e:
+        print("Erro ao atualizar valor")
+        print(e)
+
+
+def delete(conn):
+    print("Tabelas disponíveis:")
+    for table_name in tables:
+        print(f"Nome: {table_name}")
+    try:
+        name = input("Digite o nome da tabela que deseja deletar um registro: ").upper().strip()
+        if name not in tables:
+            print("Tabela não encontrada.")
+            return
+
+        table_description = tables[name]
+        print(f"A tabela foi criada usando o seguinte código: \n{table_description}")
+        codigo_f = input("Digite o nome da coluna da chave primária: ").strip()
+        codigo = input("Digite o valor numérico da chave primária: ").strip()
+
+        remover_registro(conn, name, codigo_f, codigo)
+        print("DELETE realizado com sucesso!")
+    except psycopg2.Error as e:
+        print("Erro ao realizar o DELETE")
+        print(e.pgcode)
+        print(e.pgerror)
+    except ValueError as e:
+        print("Erro ao realizar o DELETE")
+        print(e)
+
+
+# Consultas com gráficos
+
+CONSULTA01_SQL = """SELECT
+    h.nome AS nome_hospede,
+    COUNT(p.id_pedido) AS total_pedidos_realizados,
+    SUM(i.valor) AS valor_total_gasto
+FROM
+    hospede h
+JOIN
+    reserva r ON h.id_reserva = r.id_reserva
+JOIN
+    pedido p ON r.id_reserva = p.id_reserva
+JOIN
+    item i ON p.id_item = i.id_item
+GROUP BY
+    h.nome
+ORDER BY
+    valor_total_gasto DESC"""
+
+CONSULTA02_SQL = """SELECT
+    h.nome AS Nome_Hotel,
+    p.nome AS Tipo_Plano,
+    SUM(r.conta) AS Receita_Total
+FROM
+    RESERVA r
+JOIN
+    HOTEL h ON r.id_hotel = h.id_hotel
+JOIN
+    PLANO p ON r.id_plano = p.id_plano
+GROUP BY
+    h.nome,
+    p.nome
+ORDER BY
+    h.nome,
+    Receita_Total DESC"""
+
+CONSULTA03_SQL = """SELECT
+    h.nome AS nome_hotel,
+    COUNT(r.id_reserva) AS total_reservas,
+    AVG(EXTRACT(DAY FROM (r.data_saida - r.data_entrada))) AS media_dias_estadia
+FROM
+    hotel h
+JOIN
+    quarto q ON h.id_hotel = q.id_hotel
+JOIN
+    reserva r ON q.id_quarto = r.id_quarto
+GROUP BY
+    h.nome
+ORDER BY
+    media_dias_estadia DESC"""
+
+# Consulta 03 restrita a um período de entrada: com reserva particionada, o
+# filtro direto em data_entrada faz o planejador ler só as partições do período
+CONSULTA03_PERIODO_SQL = """SELECT
+    h.nome AS nome_hotel,
+    COUNT(r.id_reserva) AS total_reservas,
+    AVG(EXTRACT(DAY FROM (r.data_saida - r.data_entrada))) AS media_dias_estadia
+FROM
+    hotel h
+JOIN
+    quarto q ON h.id_hotel = q.id_hotel
+JOIN
+    reserva r ON q.id_quarto = r.id_quarto
+WHERE
+    r.data_entrada >= %(inicio)s AND r.data_entrada < %(fim)s
+GROUP BY
+    h.nome
+ORDER BY
+    media_dias_estadia DESC"""
+
+# Views materializadas das consultas analíticas
+
+materialized_views = {
+    'CONSULTA01': {
+        'create': f"CREATE MATERIALIZED VIEW IF NOT EXISTS mv_consulta01 AS {CONSULTA01_SQL}",
+        'index': "CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_consulta01 ON mv_consulta01 (nome_hospede)",
+        'select': "SELECT * FROM mv_consulta01 ORDER BY valor_total_gasto DESC",
+        'tabelas': ['hospede', 'reserva', 'pedido', 'item'],
+    },
+    'CONSULTA02': {
+        'create': f"CREATE MATERIALIZED VIEW IF NOT EXISTS mv_consulta02 AS {CONSULTA02_SQL}",
+        'index': "CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_consulta02 ON mv_consulta02 (nome_hotel, tipo_plano)",
+        'select': "SELECT * FROM mv_consulta02 ORDER BY nome_hotel, receita_total DESC",
+        'tabelas': ['reserva', 'hotel', 'plano'],
+    },
+    'CONSULTA03': {
+        'create': f"CREATE MATERIALIZED VIEW IF NOT EXISTS mv_consulta03 AS {CONSULTA03_SQL}",
+        'index': "CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_consulta03 ON mv_consulta03 (nome_hotel)",
+        'select': "SELECT * FROM mv_consulta03 ORDER BY media_dias_estadia DESC",
+        'tabelas': ['hotel', 'quarto', 'reserva'],
+    },
+}
+
+# Guarda quando cada view foi atualizada e quantas alterações as tabelas de
+# origem tinham naquele momento (contadores de pg_stat_user_tables). A
+# defasagem é a diferença para os contadores atuais, sem triggers nas
+# tabelas de escrita. Nas tabelas particionadas os contadores ficam nas
+# partições, por isso a soma percorre pg_partition_tree.
+MV_CONTROLE_DDL = """CREATE TABLE IF NOT EXISTS mv_controle (
+        nome varchar(50) PRIMARY KEY NOT NULL,
+        atualizada_em timestamptz,
+        alteracoes bigint)"""
+
+MV_ALTERACOES_SQL = """
+SELECT COALESCE(SUM(s.n_tup_ins + s.n_tup_upd + s.n_tup_del), 0)
+FROM pg_stat_user_tables s
+WHERE s.relid IN (SELECT COALESCE(arvore.relid, to_regclass(t.nome))
+                  FROM unnest(%s::text[]) AS t(nome)
+                  LEFT JOIN LATERAL pg_partition_tree(to_regclass(t.nome)) AS arvore ON true)"""
+
+
+def _atualizar_view(cur, nome: str, concorrente: bool = True):
+    view = materialized_views[nome]
+    cur.execute(MV_ALTERACOES_SQL, (view['tabelas'],))
+    alteracoes = cur.fetchone()[0]
+    modo = " CONCURRENTLY" if concorrente else ""
+    cur.execute(f"REFRESH MATERIALIZED VIEW{modo} mv_{nome.lower()}")
+    cur.execute("""
+INSERT INTO mv_controle (nome, atualizada_em, alteracoes) VALUES (%s, now(), %s)
+ON CONFLICT (nome) DO UPDATE SET atualizada_em = EXCLUDED.atualizada_em, alteracoes = EXCLUDED.alteracoes""",
+                (nome, alteracoes))
+
+
+def defasagem_view(cur, nome: str):
+    """
+    Devolve (segundos desde a última atualização, alterações nas tabelas de
+    origem desde então) ou None se a view ainda não foi criada.
+    """
+    cur.execute("SELECT to_regclass('mv_controle') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute(f"""
+SELECT EXTRACT(EPOCH FROM now() - c.atualizada_em), ({MV_ALTERACOES_SQL}) - c.alteracoes
+FROM mv_controle c
+WHERE c.nome = %s""", (materialized_views[nome]['tabelas'], nome))
+    return cur.fetchone()
+
+
+def criar_views_materializadas(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute(MV_CONTROLE_DDL)
+        for nome, view in materialized_views.items():
+            cur.execute(view['create'])
+            cur.execute(view['index'])
+            _atualizar_view(cur, nome, concorrente=False)
+        conn.commit()
+        print("Views materializadas criadas e atualizadas com sucesso!")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print("Erro ao criar as views materializadas")
+        print(e.pgcode)
+        print(e.pgerror)
+        cur.close()
+        return
+
+    for nome in materialized_views:
+        segundos, alteracoes = defasagem_view(cur, nome)
+        print(f"{nome}: atualizada há {segundos:.0f}s, {alteracoes} alterações pendentes nas tabelas de origem")
+    conn.rollback()
+    cur.close()
+
+
+def atualizar_views_desatualizadas(conn) -> list:
+    """
+    Executa REFRESH ... CONCURRENTLY nas views cujas tabelas de origem foram
+    alteradas desde a última atualização. As leituras não ficam bloqueadas
+    durante o refresh.
+    """
+    atualizadas = []
+    cur = conn.cursor()
+    try:
+        for nome in materialized_views:
+            estado = defasagem_view(cur, nome)
+            if estado is None or estado[1] == 0:
+                continue
+            _atualizar_view(cur, nome)
+            conn.commit()
+            atualizadas.append(nome)
+    finally:
+        conn.rollback()
+        cur.close()
+    return atualizadas
+
+
+class AgendadorRefresh(threading.Thread):
+    """
+    Thread que, a cada `intervalo` segundos, pega uma conexão do pool e
+    atualiza as views materializadas que estiverem defasadas.
+    """
+
+    def __init__(self, pool, intervalo: float = INTERVALO_REFRESH_MV):
+        super().__init__(daemon=True, name="refresh-views-materializadas")
+        self.pool = pool
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                with self.pool.conexao() as conn:
+                    atualizar_views_desatualizadas(conn)
+            except psycopg2.Error as e:
+                print(f"\nErro no refresh agendado das views materializadas: {e}")
+
+    def parar(self):
+        self._parar.set()
+
+
+def _resultado_consulta(conn, cur, nome: str, select_query: str) -> list:
+    roteador = obter_roteador()
+    if roteador is not None:
+        return consulta_em_shards(roteador, nome)[1]
+    if CONSULTAS_EM_PARQUET:
+        em_parquet = consulta_em_parquet(nome)
+        if em_parquet is not None:
+            return em_parquet[1]
+    if USAR_VIEWS_MATERIALIZADAS:
+        try:
+            estado = defasagem_view(cur, nome)
+        except psycopg2.Error:
+            conn.rollback()
+            estado = None
+        if estado is not None:
+            segundos, alteracoes = estado
+            print(f"(view materializada atualizada há {segundos:.0f}s; "
+                  f"{alteracoes} alterações nas tabelas de origem desde então)")
+            cur.execute(materialized_views[nome]['select'])
+            return cur.fetchall()
+        print("(view materializada não encontrada, calculando a partir das tabelas)")
+    cur.execute(select_query)
+    return cur.fetchall()
+
+
+def _desenhar_consulta01(ax, result):
+    nomes = [row[0] for row in result]
+    valores = [float(row[2]) if row[2] is not None else 0.0 for row in result]
+    bar_container = ax.bar(nomes, valores)
+    ax.set(ylabel='Valor total gasto', title='Valor gasto com pedidos extras por hóspede')
+    ax.bar_label(bar_container, fmt='{:,.2f}')
+
+
+def _desenhar_consulta02(ax, result):
+    import numpy as np
+
+    hoteis, planos, receitas = (np.array(coluna) for coluna in zip(*result))
+    hoteis_unicos, linha_hotel = np.unique(hoteis, return_inverse=True)
+    planos_unicos, linha_plano = np.unique(planos, return_inverse=True)
+
+    # Matriz plano x hotel preenchida de uma vez; as bases das barras empilhadas
+    # são a soma acumulada das linhas anteriores
+    receita = np.zeros((len(planos_unicos), len(hoteis_unicos)))
+    np.add.at(receita, (linha_plano, linha_hotel), np.nan_to_num(receitas.astype(float)))
+    bases = np.vstack([np.zeros(len(hoteis_unicos)), np.cumsum(receita, axis=0)[:-1]])
+
+    width = 0.5
+    for plano, valores, bottom in zip(planos_unicos, receita, bases):
+        ax.bar(hoteis_unicos, valores, width, label=plano, bottom=bottom)
+
+    ax.set_title("Receita gerada por reservas por hotel e plano")
+    ax.set_ylabel("Receita total")
+    ax.legend(loc="upper left")
+
+
+def _desenhar_consulta03(ax, result):
+    hoteis = [row[0] for row in result]
+    medias = [float(row[2]) if row[2] is not None else 0.0 for row in result]
+    bar_container = ax.bar(hoteis, medias)
+    ax.set(ylabel='Dias hospedados', title='Média de dias de hospedagem por hotel')
+    ax.bar_label(bar_container, fmt='{:,.1f}')
+
+
+GRAFICOS = {
+    'CONSULTA01': (CONSULTA01_SQL, _desenhar_consulta01),
+    'CONSULTA02': (CONSULTA02_SQL, _desenhar_consulta02),
+    'CONSULTA03': (CONSULTA03_SQL, _desenhar_consulta03),
+}
+
+
+def _mostrar_grafico(nome: str, result):
+    if not result:
+        print("Nenhum dado retornado para gerar o gráfico.")
+        return
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    GRAFICOS[nome][1](ax, result)
+    plt.tight_layout()
+    plt.show()
+    plt.close(fig)
+
+
+def consulta01(conn):
+    cur = conn.cursor()
+    print("Primeira Consulta: calcula o valor total gasto com pedidos extras por cada hóspede.")
+    result = _resultado_consulta(conn, cur, 'CONSULTA01', CONSULTA01_SQL)
+    for x in result:
+        print(x)
+
+    _mostrar_grafico('CONSULTA01', result)
+    cur.close()
+
+
+def consulta02(conn):
+    cur = conn.cursor()
+    print("Segunda Consulta: analisa a receita gerada pelas reservas, agrupada por hotel e tipo de plano.")
+    result = _resultado_consulta(conn, cur, 'CONSULTA02', CONSULTA02_SQL)
+    for x in result:
+        print(x)
+
+    _mostrar_grafico('CONSULTA02', result)
+    cur.close()
+
+
+def _periodo_consulta03(cur, inicio, fim) -> list:
+    cur.execute(CONSULTA03_PERIODO_SQL, {'inicio': inicio or '-infinity', 'fim': fim or 'infinity'})
+    return cur.fetchall()
+
+
+def consulta03(conn, inicio: Optional[str] = None, fim: Optional[str] = None):
+    cur = conn.cursor()
+    print("Terceira Consulta: calcula quantos dias, em média, os hóspedes ficam em cada hotel.")
+    if inicio or fim:
+        # A view materializada não guarda as datas: o período vai direto às tabelas
+        print(f"Reservas com entrada a partir de {inicio or 'o início do histórico'}"
+              + (f" e antes de {fim}" if fim else ""))
+        try:
+            em_parquet = consulta_em_parquet('CONSULTA03', (inicio, fim)) if CONSULTAS_EM_PARQUET else None
+            result = em_parquet[1] if em_parquet is not None else _periodo_consulta03(cur, inicio, fim)
+        except psycopg2.Error as e:
+            conn.rollback()
+            print("Erro ao executar a consulta 03 no período")
+            print(e.pgcode)
+            print(e.pgerror)
+            cur.close()
+            return
+    else:
+        result = _resultado_consulta(conn, cur, 'CONSULTA03', CONSULTA03_SQL)
+    for x in result:
+        print(x)
+
+    _mostrar_grafico('CONSULTA03', result)
+    cur.close()
+
+
+# Exportação colunar (Parquet) e consultas vetorizadas
+#
+# As tabelas saem do banco por COPY ... TO STDOUT (FORMAT csv) e o leitor de
+# CSV do pyarrow (em C++) converte os bytes em record batches do Arrow à
+# medida que chegam. reserva, pedido e hospede são gravadas particionadas por
+# id_hotel (diretórios id_hotel=N); as demais tabelas são pequenas e viram um
+# arquivo cada. As consultas 01 a 03 rodam sobre esses arquivos com joins e
+# agregações do Arrow, fora do banco de produção.
+
+TABELAS_PARTICIONADAS_PARQUET = ('RESERVA', 'PEDIDO', 'HOSPEDE')
+MANIFESTO_PARQUET = "manifesto.json"
+
+
+def _esquema_arrow(table_name: str):
+    import pyarrow as pa
+
+    tipos = {'integer': pa.int32(), 'float': pa.float64(), 'varchar': pa.string(), 'text': pa.string(),
+             'timestamp': pa.timestamp('us'), 'date': pa.date32()}
+    return pa.schema([(coluna, tipos.get(tipo.lower(), pa.string()))
+                      for coluna, tipo, *_ in _estrutura_ddl(tables[table_name])])
+
+
+def lotes_arrow(conn, table_name: str, bloco: int = PARQUET_BLOCO_BYTES):
+    """
+    Gera record batches do Arrow com o conteúdo da tabela. O COPY roda em uma
+    thread e escreve em um pipe que o leitor do pyarrow consome do outro lado,
+    então a memória usada fica em poucos blocos de `bloco` bytes, qualquer que
+    seja o tamanho da tabela.
+    """
+    import pyarrow.csv as pacsv
+
+    esquema = _esquema_arrow(table_name)
+    copy_sql = f"COPY (SELECT {', '.join(esquema.names)} FROM {table_name.lower()}) TO STDOUT WITH (FORMAT csv)"
+    leitura, escrita = os.pipe()
+    erros = []
+
+    def copiar():
+        cur = conn.cursor()
+        try:
+            with os.fdopen(escrita, 'wb') as destino:
+                cur.copy_expert(copy_sql, destino)
+        except (psycopg2.Error, OSError) as e:
+            # OSError: o leitor parou antes do fim e fechou o pipe
+            erros.append(e)
+        finally:
+            cur.close()
+
+    copia = threading.Thread(target=copiar, name=f"copy-{table_name.lower()}", daemon=True)
+    copia.start()
+    try:
+        with os.fdopen(leitura, 'rb') as origem:
+            # No CSV do COPY, NULL é o campo vazio sem aspas e "" é a string vazia
+            leitor = pacsv.open_csv(
+                origem,
+                read_options=pacsv.ReadOptions(column_names=esquema.names, block_size=bloco),
+                parse_options=pacsv.ParseOptions(newlines_in_values=True),
+                convert_options=pacsv.ConvertOptions(column_types=esquema, null_values=[''],
+                                                     strings_can_be_null=True, quoted_strings_can_be_null=False))
+            yield from leitor
+    finally:
+        copia.join()
+    if erros:
+        raise erros[0]
+
+
+def _manifesto_parquet(diretorio: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(diretorio, MANIFESTO_PARQUET), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return None
+
+
+def exportar_parquet(conn, diretorio: str = PARQUET_DIR) -> dict:
+    """
+    Exporta todas as tabelas para Parquet em `diretorio`. Tudo é lido em uma
+    única transação REPEATABLE READ, então os arquivos formam um retrato
+    consistente do banco; a exportação anterior só é substituída no final.
+    Devolve {tabela: linhas exportadas}.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    diretorio = diretorio.rstrip(os.sep) or '.'
+    novo = f"{diretorio}.novo"
+    shutil.rmtree(novo, ignore_errors=True)
+    os.makedirs(novo)
+    linhas = {}
+    conn.rollback()
+    cur = conn.cursor()
+    try:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        for name in tables:
+            esquema = _esquema_arrow(name)
+            inicio = time.perf_counter()
+            contados = []
+
+            def contar(lotes):
+                for lote in lotes:
+                    contados.append(lote.num_rows)
+                    yield lote
+
+            lotes = contar(lotes_arrow(conn, name))
+            if name in TABELAS_PARTICIONADAS_PARQUET:
+                destino = os.path.join(novo, name.lower())
+                os.makedirs(destino)
+                ds.write_dataset(lotes, destino, schema=esquema, format='parquet',
+                                 partitioning=ds.partitioning(pa.schema([esquema.field('id_hotel')]), flavor='hive'),
+                                 basename_template='parte-{i}.parquet', existing_data_behavior='overwrite_or_ignore')
+            else:
+                with pq.ParquetWriter(os.path.join(novo, f"{name.lower()}.parquet"), esquema) as escritor:
+                    for lote in lotes:
+                        escritor.write_batch(lote)
+            contagem = sum(contados)
+            linhas[name] = contagem
+            print(f"{name}: {contagem:,} linhas em {time.perf_counter() - inicio:.2f}s")
+    finally:
+        cur.close()
+        conn.rollback()
+
+    with open(os.path.join(novo, MANIFESTO_PARQUET), 'w', encoding='utf-8') as arquivo:
+        json.dump({'exportado_em': datetime.now().isoformat(timespec='seconds'), 'linhas': linhas}, arquivo)
+    antigo = f"{diretorio}.antigo"
+    shutil.rmtree(antigo, ignore_errors=True)
+    if os.path.isdir(diretorio):
+        os.replace(diretorio, antigo)
+    os.replace(novo, diretorio)
+    shutil.rmtree(antigo, ignore_errors=True)
+    return linhas
+
+
+def _tabela_parquet(diretorio: str, table_name: str, colunas: list, filtro=None):
+    """Lê só as colunas pedidas; nas tabelas particionadas o id_hotel vem do nome do diretório."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    esquema = _esquema_arrow(table_name)
+    if table_name in TABELAS_PARTICIONADAS_PARQUET:
+        dataset = ds.dataset(os.path.join(diretorio, table_name.lower()), schema=esquema, format='parquet',
+                             partitioning=ds.partitioning(pa.schema([esquema.field('id_hotel')]), flavor='hive'))
+    else:
+        dataset = ds.dataset(os.path.join(diretorio, f"{table_name.lower()}.parquet"), format='parquet')
+    return dataset.to_table(columns=colunas, filter=filtro)
+
+
+def _ordenar(tabela, chaves: list):
+    # ORDER BY ... DESC do PostgreSQL põe os nulos primeiro
+    import pyarrow.compute as pc
+
+    chaves = [(coluna, ordem, 'at_start' if ordem == 'descending' else 'at_end') for coluna, ordem in chaves]
+    return tabela.take(pc.sort_indices(tabela, sort_keys=chaves))
+
+
+def _consulta01_vetorizada(diretorio: str, periodo=None):
+    import pyarrow as pa
+
+    pedido = _tabela_parquet(diretorio, 'PEDIDO', ['id_reserva', 'id_item'])
+    item = _tabela_parquet(diretorio, 'ITEM', ['id_item', 'valor'])
+    # Agrega primeiro por reserva: o join com hospede fica do tamanho das reservas, não dos pedidos
+    gastos = (pedido.join(item, 'id_item', join_type='inner')
+              .group_by('id_reserva').aggregate([([], 'count_all'), ('valor', 'sum')]))
+    hospede = _tabela_parquet(diretorio, 'HOSPEDE', ['id_reserva', 'nome'])
+    por_nome = (hospede.join(gastos, 'id_reserva', join_type='inner')
+                .group_by('nome').aggregate([('count_all', 'sum'), ('valor_sum', 'sum')]))
+    resultado = pa.table({'nome_hospede': por_nome['nome'], 'total_pedidos_realizados': por_nome['count_all_sum'],
+                          'valor_total_gasto': por_nome['valor_sum_sum']})
+    return _ordenar(resultado, [('valor_total_gasto', 'descending')])
+
+
+def _consulta02_vetorizada(diretorio: str, periodo=None):
+    import pyarrow as pa
+
+    reserva = _tabela_parquet(diretorio, 'RESERVA', ['id_hotel', 'id_plano', 'conta'])
+    receitas = reserva.group_by(['id_hotel', 'id_plano']).aggregate([('conta', 'sum')])
+    hotel = _tabela_parquet(diretorio, 'HOTEL', ['id_hotel', 'nome']).rename_columns(['id_hotel', 'nome_hotel'])
+    plano = _tabela_parquet(diretorio, 'PLANO', ['id_plano', 'nome']).rename_columns(['id_plano', 'tipo_plano'])
+    por_nome = (receitas.join(hotel, 'id_hotel', join_type='inner').join(plano, 'id_plano', join_type='inner')
+                .group_by(['nome_hotel', 'tipo_plano']).aggregate([('conta_sum', 'sum')]))
+    resultado = pa.table({'nome_hotel': por_nome['nome_hotel'], 'tipo_plano': por_nome['tipo_plano'],
+                          'receita_total': por_nome['conta_sum_sum']})
+    return _ordenar(resultado, [('nome_hotel', 'ascending'), ('receita_total', 'descending')])
+
+
+def _consulta03_vetorizada(diretorio: str, periodo=None):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    filtro = None
+    inicio, fim = periodo or (None, None)
+    for limite, comparar in ((inicio, pc.greater_equal), (fim, pc.less)):
+        if limite:
+            condicao = comparar(ds.field('data_entrada'), pa.scalar(datetime.fromisoformat(limite), pa.timestamp('us')))
+            filtro = condicao if filtro is None else filtro & condicao
+    reserva = _tabela_parquet(diretorio, 'RESERVA', ['id_reserva', 'id_quarto', 'data_entrada', 'data_saida'], filtro)
+    # EXTRACT(DAY FROM saida - entrada): dias inteiros do intervalo, truncados em direção ao zero
+    microssegundos = pc.subtract(reserva['data_saida'], reserva['data_entrada']).cast(pa.int64())
+    dias = pc.divide(microssegundos, 86_400_000_000).cast(pa.float64())
+    reserva = reserva.select(['id_reserva', 'id_quarto']).append_column('dias', dias)
+    quarto = _tabela_parquet(diretorio, 'QUARTO', ['id_quarto', 'id_hotel'])
+    por_hotel = (reserva.join(quarto, 'id_quarto', join_type='inner')
+                 .group_by('id_hotel').aggregate([('id_reserva', 'count'), ('dias', 'sum'), ('dias', 'count')]))
+    hotel = _tabela_parquet(diretorio, 'HOTEL', ['id_hotel', 'nome']).rename_columns(['id_hotel', 'nome_hotel'])
+    por_nome = (por_hotel.join(hotel, 'id_hotel', join_type='inner').group_by('nome_hotel')
+                .aggregate([('id_reserva_count', 'sum'), ('dias_sum', 'sum'), ('dias_count', 'sum')]))
+    media = pc.divide(por_nome['dias_sum_sum'], pc.cast(por_nome['dias_count_sum'], pa.float64()))
+    resultado = pa.table({'nome_hotel': por_nome['nome_hotel'], 'total_reservas': por_nome['id_reserva_count_sum'],
+                          'media_dias_estadia': media})
+    return _ordenar(resultado, [('media_dias_estadia', 'descending')])
+
+
+CONSULTAS_VETORIZADAS = {
+    'CONSULTA01': _consulta01_vetorizada,
+    'CONSULTA02': _consulta02_vetorizada,
+    'CONSULTA03': _consulta03_vetorizada,
+}
+
+
+def consulta_em_parquet(nome: str, periodo: Optional[tuple] = None, diretorio: str = PARQUET_DIR) -> Optional[tuple]:
+    """
+    Executa uma das consultas analíticas sobre a última exportação Parquet.
+    Devolve (colunas, linhas como tuplas) ou None se não houver exportação.
+    """
+    manifesto = _manifesto_parquet(diretorio)
+    if manifesto is None:
+        return None
+    print(f"(calculado sobre os arquivos Parquet exportados em {manifesto['exportado_em']})")
+    tabela = CONSULTAS_VETORIZADAS[nome](diretorio, periodo)
+    return tabela.column_names, list(zip(*(coluna.to_pylist() for coluna in tabela.columns)))
+
+
+def exportar_para_parquet(conn):
+    diretorio = input(f"Diretório de destino (padrão {PARQUET_DIR}): ").strip() or PARQUET_DIR
+    try:
+        linhas = exportar_parquet(conn, diretorio)
+    except psycopg2.Error as e:
+        print("Erro ao exportar as tabelas")
+        print(e.pgcode)
+        print(e.pgerror)
+        return
+    except (OSError, ImportError) as e:
+        print(f"Erro ao gravar os arquivos Parquet: {e}")
+        return
+    print(f"{sum(linhas.values()):,} linhas exportadas para {diretorio}")
+
+
+# Disponibilidade de quartos
+
+# As duas consultas filtram a reserva por sobreposição (&&) com o intervalo
+# pedido, o que usa o índice GiST de periodo: o custo depende das reservas que
+# caem na janela, e não do total de reservas da tabela.
+QUARTOS_LIVRES_SQL = """
+SELECT q.id_quarto, q.no_quarto
+FROM quarto q
+WHERE q.id_hotel = %(hotel)s
+  AND NOT EXISTS (
+      SELECT 1
+      FROM reserva r
+      WHERE r.id_quarto = q.id_quarto
+        AND r.periodo && tsrange(%(inicio)s::timestamp, %(fim)s::timestamp, '[)'))
+ORDER BY q.no_quarto, q.id_quarto
+"""
+
+# Ocupação por noite: a reserva ocupa as noites da data de entrada até a
+# véspera da saída (ou até o fim da temporada, se não houver saída). Como a
+# restrição de exclusão impede duas reservas do mesmo quarto na mesma noite,
+# basta contar as linhas, sem COUNT(DISTINCT), e a agregação fica em hash.
+CALENDARIO_OCUPACAO_SQL = """
+WITH dias AS (
+    SELECT d::date AS dia
+    FROM generate_series(%(inicio)s::date::timestamp, %(fim)s::date::timestamp - interval '1 day',
+                         interval '1 day') AS d
+), noites AS (
+    SELECT r.id_hotel, noite::date AS dia, COUNT(*) AS ocupados
+    FROM reserva r
+    CROSS JOIN LATERAL generate_series(
+        GREATEST(lower(r.periodo)::date, %(inicio)s::date)::timestamp,
+        LEAST(GREATEST(COALESCE(upper(r.periodo)::date - 1, %(fim)s::date - 1), lower(r.periodo)::date),
+              %(fim)s::date - 1)::timestamp,
+        interval '1 day') AS noite
+    WHERE r.periodo && tsrange(%(inicio)s::date, %(fim)s::date, '[)')
+      AND (%(hotel)s::integer IS NULL OR r.id_hotel = %(hotel)s::integer)
+    GROUP BY r.id_hotel, noite::date
+), capacidade AS (
+    SELECT id_hotel, COUNT(*) AS quartos
+    FROM quarto
+    WHERE %(hotel)s::integer IS NULL OR id_hotel = %(hotel)s::integer
+    GROUP BY id_hotel
+)
+SELECT c.id_hotel, d.dia, COALESCE(n.ocupados, 0) AS ocupados, c.quartos,
+       ROUND(100.0 * COALESCE(n.ocupados, 0) / c.quartos, 1) AS taxa_ocupacao
+FROM capacidade c
+CROSS JOIN dias d
+LEFT JOIN noites n ON n.id_hotel = c.id_hotel AND n.dia = d.dia
+ORDER BY c.id_hotel, d.dia
+"""
+
+
+def quartos_livres(conn, id_hotel: int, inicio, fim) -> list:
+    """
+    Devolve (id_quarto, no_quarto) dos quartos do hotel sem nenhuma reserva
+    que se sobreponha ao intervalo [inicio, fim).
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(QUARTOS_LIVRES_SQL, {'hotel': id_hotel, 'inicio': inicio, 'fim': fim})
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def calendario_ocupacao(conn, inicio, fim, id_hotel: Optional[int] = None) -> list:
+    """
+    Ocupação de cada hotel (ou só de `id_hotel`) em cada noite de [inicio, fim),
+    calculada em uma única consulta: (id_hotel, dia, ocupados, quartos,
+    taxa_ocupacao em %).
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(CALENDARIO_OCUPACAO_SQL, {'hotel': id_hotel, 'inicio': inicio, 'fim': fim})
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def disponibilidade(conn):
+    print("Disponibilidade: quartos livres de um hotel ou calendário de ocupação de uma temporada.")
+    try:
+        inicio = input("Data de início (ex.: 2024-01-01): ").strip()
+        fim = input("Data de fim, exclusiva (ex.: 2024-01-08): ").strip()
+        hotel = input("Código do hotel (vazio para o calendário de todos os hotéis): ").strip()
+        id_hotel = int(hotel) if hotel else None
+        if id_hotel is not None and input("Listar só os quartos livres? (s/N) ").strip().lower() == 's':
+            livres = quartos_livres(conn, id_hotel, inicio, fim)
+            print(f"{len(livres)} quartos livres no hotel {id_hotel} de {inicio} a {fim}")
+            for x in livres:
+                print(x)
+            return
+        for x in calendario_ocupacao(conn, inicio, fim, id_hotel):
+            print(x)
+    except psycopg2.Error as e:
+        print("Erro ao consultar a disponibilidade")
+        print(e.pgcode)
+        print(e.pgerror)
+    except ValueError:
+        print("Código do hotel inválido.")
+
+
+# Faturamento: conta na saída, painel de receita e conciliação
+
+# Buscas pela chave nas tabelas de totais: nenhuma das duas lê pedido
+CONTA_DA_RESERVA_SQL = """
+SELECT r.id_reserva, r.id_hotel, r.conta AS conta_estadia,
+       COALESCE(c.total_pedidos, 0)::float AS total_pedidos, COALESCE(c.qtd_pedidos, 0) AS qtd_pedidos,
+       COALESCE(r.conta, 0) + COALESCE(c.total_pedidos, 0) AS total_a_pagar
+FROM reserva r
+LEFT JOIN conta_reserva c ON c.id_reserva = r.id_reserva
+WHERE r.id_reserva = %s
+"""
+
+RECEITA_POR_DIA_SQL = """
+SELECT d.id_hotel, h.nome, d.dia, d.total_pedidos, d.qtd_pedidos
+FROM receita_dia d
+JOIN hotel h ON h.id_hotel = d.id_hotel
+WHERE d.dia >= %(inicio)s::date AND d.dia < %(fim)s::date
+  AND (%(hotel)s::integer IS NULL OR d.id_hotel = %(hotel)s::integer)
+ORDER BY d.id_hotel, d.dia
+"""
+
+RECEITA_POR_HOTEL_SQL = """
+SELECT t.id_hotel, h.nome, t.total_pedidos, t.qtd_pedidos
+FROM receita_hotel t
+JOIN hotel h ON h.id_hotel = t.id_hotel
+WHERE %(hotel)s::integer IS NULL OR t.id_hotel = %(hotel)s::integer
+ORDER BY t.total_pedidos DESC
+"""
+
+
+def conta_da_reserva(conn, id_reserva: int) -> Optional[tuple]:
+    """
+    Conta de saída da reserva: (id_reserva, id_hotel, conta da estadia, total
+    dos pedidos, quantidade de pedidos, total a pagar), ou None se a reserva
+    não existir.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(CONTA_DA_RESERVA_SQL, (id_reserva,))
+        return cur.fetchone()
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def receita(conn, inicio=None, fim=None, id_hotel: Optional[int] = None) -> list:
+    """
+    Receita de pedidos lida das tabelas de totais: por hotel (id_hotel, nome,
+    total, pedidos) ou, com `inicio` e `fim`, por hotel e dia de entrada
+    (id_hotel, nome, dia, total, pedidos).
+    """
+    cur = conn.cursor()
+    try:
+        if inicio or fim:
+            cur.execute(RECEITA_POR_DIA_SQL, {'inicio': inicio or '-infinity', 'fim': fim or 'infinity',
+                                              'hotel': id_hotel})
+        else:
+            cur.execute(RECEITA_POR_HOTEL_SQL, {'hotel': id_hotel})
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def conciliar_faturamento(conn, corrigir: bool = False) -> dict:
+    """
+    Compara cada tabela de totais com o recálculo completo a partir de pedido e
+    devolve {tabela: chaves divergentes}. Totais zerados equivalem a linhas
+    ausentes. Com `corrigir`, as tabelas são reconstruídas com pedido travado
+    contra escrita (as leituras continuam).
+    """
+    divergencias = {}
+    conn.rollback()
+    cur = conn.cursor()
+    try:
+        # Totais e pedido lidos no mesmo retrato do banco
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        for tabela, (chave, colunas, select) in RECALCULO_FATURAMENTO.items():
+            chaves = [c.strip() for c in chave.split(',')]
+            igualdade = " AND ".join(f"a.{c} = b.{c}" for c in chaves)
+            cur.execute(f"""
+SELECT {', '.join(f'COALESCE(a.{c}, b.{c})' for c in chaves)},
+       COALESCE(a.total_pedidos, 0), COALESCE(b.total_pedidos, 0),
+       COALESCE(a.qtd_pedidos, 0), COALESCE(b.qtd_pedidos, 0)
+FROM {tabela} a
+FULL JOIN ({select}) AS b ({colunas})
+  ON {igualdade}
+WHERE COALESCE(a.total_pedidos, 0) <> COALESCE(b.total_pedidos, 0)
+   OR COALESCE(a.qtd_pedidos, 0) <> COALESCE(b.qtd_pedidos, 0)
+ORDER BY 1""")
+            divergencias[tabela] = cur.fetchall()
+        conn.rollback()
+        if corrigir and any(divergencias.values()):
+            cur.execute("LOCK TABLE pedido IN SHARE ROW EXCLUSIVE MODE")
+            cur.execute(f"TRUNCATE {', '.join(RECALCULO_FATURAMENTO)}")
+            for comando in _recalcular_faturamento():
+                cur.execute(comando)
+            conn.commit()
+    finally:
+        cur.close()
+        conn.rollback()
+    return divergencias
+
+
+def faturamento(conn):
+    print("Faturamento: conta de uma reserva, receita dos pedidos e conciliação dos totais.")
+    opcao = input("1 Conta da reserva  2 Receita por hotel  3 Receita por dia  4 Conciliar: ").strip()
+    try:
+        if opcao == '1':
+            linha = conta_da_reserva(conn, int(input("Código da reserva: ")))
+            if linha is None:
+                print("Reserva não encontrada.")
+                return
+            id_reserva, id_hotel, estadia, pedidos, quantidade, total = linha
+            print(f"Reserva {id_reserva} (hotel {id_hotel}): estadia {estadia or 0:,.2f} + "
+                  f"{quantidade} pedidos {pedidos:,.2f} = {total:,.2f}")
+        elif opcao == '2':
+            for x in receita(conn):
+                print(x)
+        elif opcao == '3':
+            inicio = input("Data de início (ex.: 2024-01-01): ").strip()
+            fim = input("Data de fim, exclusiva (ex.: 2024-02-01): ").strip()
+            hotel = input("Código do hotel (vazio para todos): ").strip()
+            for x in receita(conn, inicio or None, fim or None, int(hotel) if hotel else None):
+                print(x)
+        elif opcao == '4':
+            corrigir = input("Reconstruir os totais se houver divergência? (s/N) ").strip().lower() == 's'
+            for tabela, linhas in conciliar_faturamento(conn, corrigir).items():
+                print(f"{tabela}: {len(linhas)} divergências" + (" (corrigidas)" if linhas and corrigir else ""))
+                for x in linhas[:10]:
+                    print(x)
+        else:
+            print("Opção inválida.")
+    except psycopg2.Error as e:
+        print("Erro ao consultar o faturamento")
+        print(e.pgcode)
+        print(e.pgerror)
+    except ValueError:
+        print("Código inválido.")
+
+
+# Shards por hotel
+#
+# SHARDS mapeia faixas de id_hotel para bancos diferentes, por exemplo
+# "1-50=dbname=hotel_a;51-100=host=outro dbname=hotel_b". Os parâmetros de
+# cada faixa (conninfo do libpq) completam os de DB_*. Todas as tabelas com
+# id_hotel ficam no shard do hotel; plano e item não têm hotel e são
+# replicadas em todos. Cada shard tem o próprio pool e as escritas em vários
+# shards são confirmadas shard a shard, sem transação distribuída.
+
+TABELAS_REPLICADAS = ('PLANO', 'ITEM')
+
+
+class Shard:
+    def __init__(self, inicio: int, fim: int, parametros: dict):
+        self.inicio = inicio
+        self.fim = fim
+        self.nome = f"{parametros.get('host') or 'local'}/{parametros.get('dbname')}"
+        self.pool = PoolConexoes(0, DB_POOL_MAX, **parametros)
+
+    def __repr__(self):
+        return f"Shard({self.inicio}-{self.fim} {self.nome})"
+
+
+class RoteadorShards:
+    """
+    Escolhe o shard de cada hotel (busca binária nas faixas) e executa uma
+    função em vários shards em paralelo, cada um com uma conexão do seu pool.
+    """
+
+    def __init__(self, configuracao: str):
+        self.shards = []
+        for trecho in configuracao.split(';'):
+            if not trecho.strip():
+                continue
+            faixa, separador, dsn = trecho.partition('=')
+            inicio, _, fim = faixa.partition('-')
+            try:
+                inicio, fim = int(inicio), int(fim or inicio)
+                parametros = {**_parametros_conexao(), **psycopg2.extensions.parse_dsn(dsn.strip())}
+            except (ValueError, psycopg2.ProgrammingError):
+                raise ValueError(f"Shard inválido em SHARDS: {trecho.strip()!r}") from None
+            if not separador or fim < inicio:
+                raise ValueError(f"Shard inválido em SHARDS: {trecho.strip()!r}")
+            self.shards.append(Shard(inicio, fim, parametros))
+        self.shards.sort(key=lambda shard: shard.inicio)
+        for anterior, seguinte in zip(self.shards, self.shards[1:]):
+            if seguinte.inicio <= anterior.fim:
+                raise ValueError(f"Faixas de hotel sobrepostas em SHARDS: {anterior} e {seguinte}")
+        self._inicios = [shard.inicio for shard in self.shards]
+
+    def shard_do_hotel(self, id_hotel: int) -> Shard:
+        posicao = bisect.bisect_right(self._inicios, id_hotel) - 1
+        if posicao < 0 or id_hotel > self.shards[posicao].fim:
+            raise ValueError(f"Nenhum shard atende o hotel {id_hotel}")
+        return self.shards[posicao]
+
+    def em_paralelo(self, funcao, shards: Optional[list] = None) -> list:
+        """Executa funcao(shard, conn) em cada shard e devolve os resultados na ordem dos shards."""
+        shards = self.shards if shards is None else shards
+
+        def executar(shard):
+            with shard.pool.conexao() as conn:
+                return funcao(shard, conn)
+
+        if len(shards) == 1:
+            return [executar(shards[0])]
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard") as executor:
+            return list(executor.map(executar, shards))
+
+    def fechar(self):
+        for shard in self.shards:
+            shard.pool.fechar()
+
+
+_roteador = None
+
+
+def obter_roteador() -> Optional[RoteadorShards]:
+    """Roteador configurado em SHARDS, ou None se o banco é um só."""
+    global _roteador
+    if not SHARDS:
+        return None
+    with _pool_lock:
+        if _roteador is None:
+            _roteador = RoteadorShards(SHARDS)
+    return _roteador
+
+
+def fechar_roteador():
+    if _roteador is not None:
+        _roteador.fechar()
+
+
+def _indice_id_hotel(name: str) -> int:
+    return _colunas_da_tabela(name).index('id_hotel')
+
+
+def inserir_roteado(roteador: RoteadorShards, name: str, linhas: list) -> int:
+    """Insere cada linha no shard do seu id_hotel; tabelas replicadas vão para todos os shards."""
+    if name in TABELAS_REPLICADAS:
+        return roteador.em_paralelo(lambda shard, conn: inserir_linhas(conn, name, linhas))[0]
+    indice = _indice_id_hotel(name)
+    por_shard = {}
+    for linha in linhas:
+        id_hotel = _converter(name, 'id_hotel', 'integer', linha[indice]) if len(linha) > indice else None
+        if id_hotel is None:
+            raise ValueError(f"Com SHARDS, toda linha de {name} precisa de id_hotel")
+        por_shard.setdefault(roteador.shard_do_hotel(id_hotel), []).append(linha)
+    shards = list(por_shard)
+    return sum(roteador.em_paralelo(lambda shard, conn: inserir_linhas(conn, name, por_shard[shard]), shards))
+
+
+def _shards_da_escrita(roteador: RoteadorShards, name: str, id_hotel) -> list:
+    # Sem o hotel, o UPDATE/DELETE pela chave vai a todos os shards; só um tem a linha
+    if name in TABELAS_REPLICADAS or id_hotel is None:
+        return roteador.shards
+    return [roteador.shard_do_hotel(_converter(name, 'id_hotel', 'integer', id_hotel))]
+
+
+def atualizar_roteado(roteador: RoteadorShards, name: str, atributo: str, pares: list,
+                      chave: Optional[str] = None, id_hotel=None) -> int:
+    if atributo == 'id_hotel' and name not in TABELAS_REPLICADAS:
+        raise ValueError("Com SHARDS, trocar o id_hotel mudaria a linha de shard: remova e insira de novo")
+    linhas = roteador.em_paralelo(lambda shard, conn: atualizar_linhas(conn, name, atributo, pares, chave),
+                                  _shards_da_escrita(roteador, name, id_hotel))
+    return linhas[0] if name in TABELAS_REPLICADAS else sum(linhas)
+
+
+def remover_roteado(roteador: RoteadorShards, name: str, codigos: list, chave: Optional[str] = None,
+                    id_hotel=None) -> int:
+    linhas = roteador.em_paralelo(lambda shard, conn: remover_linhas(conn, name, codigos, chave),
+                                  _shards_da_escrita(roteador, name, id_hotel))
+    return linhas[0] if name in TABELAS_REPLICADAS else sum(linhas)
+
+
+# Consultas analíticas em todos os shards: cada shard devolve agregados
+# parciais que podem ser somados (SUM e COUNT; a média da consulta 03 vai como
+# soma e contagem) e o coordenador junta as linhas de mesma chave.
+CONSULTA03_PARCIAL_SQL = """SELECT
+    h.nome AS nome_hotel,
+    COUNT(r.id_reserva) AS total_reservas,
+    SUM(EXTRACT(DAY FROM (r.data_saida - r.data_entrada))) AS soma_dias,
+    COUNT(EXTRACT(DAY FROM (r.data_saida - r.data_entrada))) AS estadias_com_saida
+FROM
+    hotel h
 JOIN
-    HOTEL h ON r.id_hotel = h.id_hotel
+    quarto q ON h.id_hotel = q.id_hotel
 JOIN
-    PLANO p ON r.id_plano = p.id_plano
+    reserva r ON q.id_quarto = r.id_quarto
 GROUP BY
-    h.nome,
-    p.nome
-ORDER BY
-    h.nome,
-    Receita_Total DESC;"""
+    h.nome"""
+
+
+def _desc(valor) -> tuple:
+    # Com reverse=True reproduz o ORDER BY ... DESC do PostgreSQL (nulos primeiro)
+    return valor is None, valor if valor is not None else 0
+
+
+def _ordenar_consulta01(linhas: list) -> list:
+    return sorted(linhas, key=lambda linha: _desc(linha[2]), reverse=True)
+
+
+def _ordenar_consulta02(linhas: list) -> list:
+    por_receita = sorted(linhas, key=lambda linha: _desc(linha[2]), reverse=True)
+    return sorted(por_receita, key=lambda linha: linha[0])
+
+
+def _media_consulta03(linhas: list) -> list:
+    linhas = [(nome, total, soma / contagem if contagem else None) for nome, total, soma, contagem in linhas]
+    return sorted(linhas, key=lambda linha: _desc(linha[2]), reverse=True)
+
+
+CONSULTAS_PARCIAIS = {
+    # nome: (SQL parcial, colunas da chave, colunas do resultado ou None, acabamento)
+    'CONSULTA01': (CONSULTA01_SQL, 1, None, _ordenar_consulta01),
+    'CONSULTA02': (CONSULTA02_SQL, 2, None, _ordenar_consulta02),
+    'CONSULTA03': (CONSULTA03_PARCIAL_SQL, 1, ['nome_hotel', 'total_reservas', 'media_dias_estadia'],
+                   _media_consulta03),
+}
+
+
+def _somar(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def consulta_em_shards(roteador: RoteadorShards, nome: str) -> tuple:
+    """
+    Executa a consulta analítica em todos os shards ao mesmo tempo e junta os
+    agregados parciais. Devolve (colunas, linhas) como a consulta em um banco só.
+    """
+    select_query, chaves, colunas, acabamento = CONSULTAS_PARCIAIS[nome]
 
-    print("Segunda Consulta: analisa a receita gerada pelas reservas, agrupada por hotel e tipo de plano.")
-    cur.execute(select_query)
-    result = cur.fetchall()
-    for x in result:
-        print(x)
+    def parcial(shard, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute(select_query)
+            return [desc[0] for desc in cur.description], cur.fetchall()
+        finally:
+            cur.close()
+            conn.rollback()
 
-    hoteis_unicos = sorted({row[0] for row in result})
-    planos_unicos = sorted({row[1] for row in result})
+    parciais = roteador.em_paralelo(parcial)
+    juntas = {}
+    for _, linhas in parciais:
+        for linha in linhas:
+            chave, valores = tuple(linha[:chaves]), linha[chaves:]
+            atual = juntas.get(chave)
+            juntas[chave] = valores if atual is None else [_somar(a, b) for a, b in zip(atual, valores)]
+    print(f"(calculado em {len(parciais)} shards)")
+    return colunas or parciais[0][0], acabamento([chave + tuple(valores) for chave, valores in juntas.items()])
 
-    plano_dict = {plano: np.zeros(len(hoteis_unicos)) for plano in planos_unicos}
-    hotel_index = {hotel: idx for idx, hotel in enumerate(hoteis_unicos)}
 
-    for hotel, plano, receita in result:
-        idx = hotel_index[hotel]
-        plano_dict[plano][idx] = float(receita) if receita is not None else 0.0
+def _copiar_entre_bancos(origem, destino, table_name: str, filtro: str = "") -> int:
+    """
+    COPY ... TO STDOUT na origem ligado por um pipe ao COPY ... FROM STDIN no
+    destino: as linhas passam direto de um banco para o outro.
+    """
+    colunas = ', '.join(_colunas_da_tabela(table_name))
+    leitura, escrita = os.pipe()
+    erros = []
 
-    width = 0.5
-    fig, ax = plt.subplots()
-    bottom = np.zeros(len(hoteis_unicos))
+    def exportar():
+        cur = origem.cursor()
+        try:
+            with os.fdopen(escrita, 'wb') as saida:
+                cur.copy_expert(f"COPY (SELECT {colunas} FROM {table_name.lower()} {filtro}) TO STDOUT", saida)
+        except (psycopg2.Error, OSError) as e:
+            erros.append(e)
+        finally:
+            cur.close()
 
-    for plano, valores in plano_dict.items():
-        ax.bar(hoteis_unicos, valores, width, label=plano, bottom=bottom)
-        bottom += valores
+    exportacao = threading.Thread(target=exportar, name=f"copy-{table_name.lower()}", daemon=True)
+    exportacao.start()
+    cur = destino.cursor()
+    try:
+        with os.fdopen(leitura, 'rb') as entrada:
+            cur.copy_expert(f"COPY {table_name.lower()} ({colunas}) FROM STDIN", entrada)
+        copiadas = cur.rowcount
+    finally:
+        cur.close()
+        exportacao.join()
+    if erros:
+        raise erros[0]
+    return copiadas
 
-    ax.set_title("Receita gerada por reservas por hotel e plano")
-    ax.set_ylabel("Receita total")
-    ax.legend(loc="upper left")
-    plt.tight_layout()
-    plt.show()
 
-    cur.close()
+def distribuir_para_shards(roteador: RoteadorShards, pool_origem: PoolConexoes) -> list:
+    """
+    Copia os dados do banco principal (DB_*) para os shards, cada shard com as
+    linhas da sua faixa de hotéis e com as tabelas replicadas inteiras. Os
+    shards são carregados em paralelo, cada um em uma única transação; os
+    shards devem estar com as tabelas criadas e vazios. Devolve, por shard,
+    {tabela: linhas}.
+    """
+    def carregar(shard, conn):
+        contagem = {}
+        with pool_origem.conexao() as origem:
+            origem.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SET CONSTRAINTS ALL DEFERRED")
+                for table_name in ordem_topologica():
+                    filtro = ("" if table_name in TABELAS_REPLICADAS
+                              else f"WHERE id_hotel BETWEEN {shard.inicio} AND {shard.fim}")
+                    contagem[table_name] = _copiar_entre_bancos(origem, conn, table_name, filtro)
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+            finally:
+                origem.rollback()
+                origem.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+        return contagem
 
+    return roteador.em_paralelo(carregar)
 
-def consulta03(conn):
-    cur = conn.cursor()
 
-    select_query = """
-SELECT 
-    h.nome AS nome_hotel,
-    COUNT(r.id_reserva) AS total_reservas,
-    AVG(EXTRACT(DAY FROM (r.data_saida - r.data_entrada))) AS media_dias_estadia
-FROM 
-    hotel h
-JOIN 
-    quarto q ON h.id_hotel = q.id_hotel
-JOIN 
-    reserva r ON q.id_quarto = r.id_quarto
-GROUP BY 
-    h.nome
-ORDER BY 
-    media_dias_estadia DESC;"""
+def _contagem_nos_shards(roteador: RoteadorShards) -> list:
+    def contar(shard, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT (SELECT COUNT(*) FROM hotel), (SELECT COUNT(*) FROM reserva), "
+                        "(SELECT COUNT(*) FROM pedido)")
+            return cur.fetchone()
+        finally:
+            cur.close()
+            conn.rollback()
 
-    print("Terceira Consulta: calcula quantos dias, em média, os hóspedes ficam em cada hotel.")
-    cur.execute(select_query)
-    result = cur.fetchall()
-    for x in result:
-        print(x)
+    return roteador.em_paralelo(contar)
 
-    hoteis = [row[0] for row in result]
-    medias = [float(row[2]) if row[2] is not None else 0.0 for row in result]
 
-    if hoteis:
-        fig, ax = plt.subplots()
-        bar_container = ax.bar(hoteis, medias)
-        ax.set(ylabel='Dias hospedados', title='Média de dias de hospedagem por hotel')
-        ax.bar_label(bar_container, fmt='{:,.1f}')
-        plt.tight_layout()
-        plt.show()
+# Exportação dos gráficos sem janela (servidores sem display)
+
+def _renderizar_grafico(nome: str, result, diretorio: str, formatos: tuple, fig=None) -> list:
+    """
+    Desenha o gráfico em uma Figure do matplotlib criada sem o pyplot, que não
+    abre janela e não fica registrada em nenhum gerenciador global; o PNG é
+    gerado pelo Agg e o SVG pelo backend svg. Se `fig` for informada, ela é
+    limpa e reutilizada.
+    """
+    from matplotlib.figure import Figure
+
+    if fig is None:
+        fig = Figure(figsize=(8, 5))
     else:
-        print("Nenhum dado retornado para gerar o gráfico.")
+        fig.clear()
+    ax = fig.add_subplot()
+    GRAFICOS[nome][1](ax, result)
+    fig.tight_layout()
+    caminhos = []
+    for formato in formatos:
+        caminho = os.path.join(diretorio, f"{nome.lower()}.{formato}")
+        fig.savefig(caminho, format=formato)
+        caminhos.append(caminho)
+    return caminhos
+
+
+def exportar_graficos(conn, diretorio: str = GRAFICOS_DIR, formatos: tuple = tuple(GRAFICOS_FORMATOS.split(',')),
+                      processos: int = GRAFICOS_PROCESSOS) -> list:
+    cur = conn.cursor()
+    resultados = {}
+    try:
+        for nome, (select_query, _) in GRAFICOS.items():
+            resultados[nome] = _resultado_consulta(conn, cur, nome, select_query)
+    finally:
+        conn.rollback()
+        cur.close()
+
+    os.makedirs(diretorio, exist_ok=True)
+    com_dados = {nome: result for nome, result in resultados.items() if result}
+    for nome in resultados.keys() - com_dados.keys():
+        print(f"{nome}: nenhum dado retornado para gerar o gráfico.")
+
+    caminhos = []
+    if processos > 1 and len(com_dados) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processos) as executor:
+            futuros = [executor.submit(_renderizar_grafico, nome, result, diretorio, formatos)
+                       for nome, result in com_dados.items()]
+            for futuro in futuros:
+                caminhos.extend(futuro.result())
+    else:
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=(8, 5))
+        for nome, result in com_dados.items():
+            caminhos.extend(_renderizar_grafico(nome, result, diretorio, formatos, fig))
+    for caminho in caminhos:
+        print(f"Gráfico gravado em {caminho}")
+    return caminhos
+
+
+# Consultor de índices
+
+_historico_text2sql = deque(maxlen=HISTORICO_TEXT2SQL)
+
+CONDICOES_DO_PLANO = ('Hash Cond', 'Merge Cond', 'Join Filter', 'Filter', 'Index Cond', 'Recheck Cond')
+
+
+def _percorrer_plano(plano: dict):
+    yield plano
+    for filho in plano.get('Plans', []):
+        yield from _percorrer_plano(filho)
+
 
+def _colunas_lideres_indexadas(cur) -> set:
+    cur.execute("""
+SELECT t.relname, a.attname
+FROM pg_index i
+JOIN pg_class t ON t.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = t.relnamespace
+JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+WHERE n.nspname = current_schema()""")
+    return set(cur.fetchall())
+
+
+def _candidatos_do_plano(plano: dict) -> list:
+    """
+    Para cada Seq Scan do plano, devolve as colunas dessa tabela que aparecem
+    em condições de junção ou filtro, ou seja, as colunas que um índice
+    poderia usar no lugar da varredura sequencial.
+    """
+    nos = list(_percorrer_plano(plano))
+    condicoes = [no[chave] for no in nos for chave in CONDICOES_DO_PLANO if chave in no]
+    candidatos = []
+    for no in nos:
+        if no.get('Node Type') != 'Seq Scan':
+            continue
+        relacao = no['Relation Name']
+        alias = no.get('Alias', relacao)
+        table_name = relacao.upper()
+        colunas = set(_colunas_da_tabela(table_name)) if table_name in tables else set()
+        usadas = set()
+        for condicao in condicoes:
+            usadas.update(c for a, c in re.findall(r"\b(\w+)\.(\w+)\b", condicao) if a == alias)
+        # O filtro do próprio nó de varredura cita as colunas sem o alias
+        usadas.update(c for c in re.findall(r"\b(\w+)\b", no.get('Filter', '')) if c in colunas)
+        candidatos.extend((relacao, coluna) for coluna in sorted(usadas))
+        if not usadas:
+            candidatos.append((relacao, None))
+    return candidatos
+
+
+def consultor_de_indices(conn, ultimas_text2sql: int = HISTORICO_TEXT2SQL):
+    consultas = {'CONSULTA01': CONSULTA01_SQL, 'CONSULTA02': CONSULTA02_SQL, 'CONSULTA03': CONSULTA03_SQL}
+    historico = []
+    if ultimas_text2sql:
+        cache = obter_cache_text2sql(tables)
+        anteriores = cache.ultimas_sqls(ultimas_text2sql) if cache else []
+        for sql in anteriores + list(_historico_text2sql):
+            if sql not in historico:
+                historico.append(sql)
+        historico = historico[-ultimas_text2sql:]
+    for i, sql in enumerate(historico, start=1):
+        consultas[f'TEXT2SQL #{i}'] = sql
+
+    cur = conn.cursor()
+    try:
+        indexadas = _colunas_lideres_indexadas(cur)
+    except psycopg2.Error as e:
+        conn.rollback()
+        print("Erro ao consultar os índices existentes")
+        print(e.pgcode)
+        print(e.pgerror)
+        cur.close()
+        return
+
+    sugestoes = {}
+    for nome, sql in consultas.items():
+        try:
+            cur.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+            plano = cur.fetchone()[0][0]['Plan']
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"{nome}: não foi possível gerar o plano ({e.pgerror.strip() if e.pgerror else e})")
+            continue
+
+        candidatos = _candidatos_do_plano(plano)
+        if not candidatos:
+            print(f"{nome}: nenhuma varredura sequencial no plano.")
+            continue
+        print(f"{nome}:")
+        for relacao, coluna in candidatos:
+            if coluna is None:
+                print(f"  Seq Scan em {relacao} sem condição indexável (a tabela é lida por inteiro).")
+            elif (relacao, coluna) in indexadas:
+                print(f"  Seq Scan em {relacao}: já existe índice em {coluna}; o planejador preferiu "
+                      f"a varredura (tabela pequena ou pouco seletiva).")
+            else:
+                print(f"  Seq Scan em {relacao}: falta índice em {coluna}.")
+                sugestoes.setdefault((relacao, coluna), []).append(nome)
+    conn.rollback()
     cur.close()
 
+    if not sugestoes:
+        print("\nNenhum índice faltando para as consultas analisadas.")
+        return
+    print("\nÍndices sugeridos:")
+    for (relacao, coluna), origens in sugestoes.items():
+        print(f"CREATE INDEX IF NOT EXISTS idx_{relacao}_{coluna} ON {relacao} ({coluna});  -- {', '.join(origens)}")
+
 
 # Suporte para extração de SQL
 
+_CERCA_DE_CODIGO = re.compile(r"```[ \t]*([\w+-]*)[^\n]*\n(.*?)(?:```|\Z)", re.DOTALL)
+_INICIO_DE_SQL = re.compile(r"\b(?:select|with)\b", re.IGNORECASE)
+
+
+def _comando_sql_valido(trecho: str) -> Optional[str]:
+    """
+    Devolve o primeiro comando do trecho se ele for um SELECT (ou WITH ...
+    SELECT) que o tokenizador aceita, com parênteses e aspas fechados.
+    """
+    trecho = trecho.strip()
+    try:
+        tokens = _tokens_sql(trecho)
+    except ValueError:
+        # Pode ser texto depois do SQL: tenta cortar no primeiro ';'
+        corte = trecho.find(';')
+        if corte == -1:
+            return None
+        try:
+            tokens = _tokens_sql(trecho[:corte])
+        except ValueError:
+            return None
+    fim = next((j for j, token in enumerate(tokens) if token[1] == ';'), len(tokens))
+    tokens = tokens[:fim]
+    if len(tokens) < 2 or tokens[0][1] not in ('select', 'with') or tokens[0][0] != 'nome':
+        return None
+    if tokens[0][1] == 'with' and not any(token[1] == 'select' for token in tokens):
+        return None
+    return trecho[:tokens[-1][3]].strip()
+
+
+def _sql_em_json(texto: str) -> Optional[str]:
+    texto = texto.strip()
+    if not texto.startswith('{'):
+        return None
+    try:
+        resposta = json.loads(texto)
+    except json.JSONDecodeError:
+        return None
+    sql = resposta.get('sql') if isinstance(resposta, dict) else None
+    return _comando_sql_valido(sql) if isinstance(sql, str) else None
+
+
+def _sql_sem_cerca(texto: str) -> list:
+    """
+    Procura SQL fora de blocos de código: começa em SELECT/WITH no início de
+    uma linha (ou depois de "...:") e segue pelas linhas seguintes até uma
+    linha vazia, um ';' ou uma linha que comece como frase (palavra com
+    inicial maiúscula que não é palavra do SQL).
+    """
+    candidatos = []
+    linhas = texto.splitlines()
+    proxima_livre = 0   # linhas já incluídas em um candidato (subconsultas) não iniciam outro
+    for indice, linha in enumerate(linhas):
+        if indice < proxima_livre:
+            continue
+        for m in _INICIO_DE_SQL.finditer(linha):
+            antes = linha[:m.start()].strip()
+            if antes and not antes.endswith(':'):
+                continue
+            trecho = [linha[m.start():]]
+            for seguinte in linhas[indice + 1:]:
+                palavra = re.match(r"\s*([^\W\d_][\w]*)", seguinte)
+                if not seguinte.strip() or ';' in trecho[-1]:
+                    break
+                if palavra and palavra.group(1)[0].isupper() and not palavra.group(1).isupper() \
+                        and palavra.group(1).lower() not in PALAVRAS_SQL | {'select'}:
+                    break
+                trecho.append(seguinte)
+            # Se o fim do trecho não fecha (aspas ou parênteses), descarta linhas do fim
+            while trecho:
+                sql = _comando_sql_valido("\n".join(trecho))
+                if sql:
+                    candidatos.append(sql)
+                    proxima_livre = indice + len(trecho)
+                    break
+                trecho.pop()
+            break
+    return candidatos
+
+
 def _extrair_sql_da_resposta(full_text: str) -> Optional[str]:
     """
-    Tenta extrair a linha com a query SQL a partir do texto completo do modelo.
-    Remove cercas de código e pega a última linha que comece com SELECT ou WITH
-    ou contenha esses termos.
+    Extrai o SQL da resposta do modelo, nesta ordem de preferência: o campo
+    "sql" da resposta em JSON, o último bloco de código com um SELECT válido
+    e o último SELECT fora de blocos de código (podendo ocupar várias linhas).
+    """
+    sql = _sql_em_json(full_text)
+    if sql:
+        return sql
+    blocos = _CERCA_DE_CODIGO.findall(full_text)
+    for linguagem, conteudo in reversed(blocos):
+        sql = _sql_em_json(conteudo) if linguagem.lower() == 'json' else _comando_sql_valido(conteudo)
+        if sql:
+            return sql
+    # Sem bloco válido: procura no texto sem as cercas
+    candidatos = _sql_sem_cerca(_CERCA_DE_CODIGO.sub(lambda m: m.group(2), full_text))
+    return candidatos[-1] if candidatos else None
+
+
+# Validação do SQL gerado
+
+_TOKEN_SQL = re.compile(r"""
+    (?P<espaco>\s+|--[^\n]*|/\*.*?\*/)
+  | (?P<texto>[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*')
+  | (?P<dolar>\$(?:\w*)\$)
+  | (?P<aspas>"(?:[^"]|"")+")
+  | (?P<numero>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<nome>[A-Za-z_][\w$]*)
+  | (?P<simbolo>::|<=|>=|<>|!=|\|\||[(),.;*=<>+\-/%:\[\]^~!|&#@?])
+""", re.VERBOSE | re.DOTALL)
+
+# Palavras que não são nomes de tabela ou coluna
+PALAVRAS_SQL = frozenset("""
+    all and any array as asc between both by case cast collate cross current_date current_time
+    current_timestamp day default desc distinct do else end epoch escape except exists extract false
+    fetch filter first following for from full group having hour ilike in inner intersect interval
+    is isnull join last lateral leading left like limit localtime localtimestamp minute month natural
+    next not notnull null nulls offset on only or order outer over partition preceding range
+    recursive right row rows second select similar some symmetric then ties to trailing true
+    unbounded union unknown using values week when where window with within year zone at time
+    timestamp date dow doy quarter isodow
+""".split())
+
+# Comandos e funções que um SELECT gerado pelo modelo nunca deve usar
+PALAVRAS_PROIBIDAS = frozenset("""
+    insert update delete merge drop alter create truncate grant revoke copy call do execute
+    prepare deallocate listen notify vacuum analyze cluster reindex lock set reset into
+    refresh comment security discard checkpoint load import
+""".split())
+FUNCOES_PROIBIDAS = re.compile(r"^(pg_|lo_|dblink|set_config|current_setting|query_to_xml|"
+                               r"table_to_xml|database_to_xml|txid_|nextval|setval)")
+
+# Funções em que FROM faz parte dos argumentos, e não da lista de tabelas
+_FUNCOES_COM_FROM = frozenset(('extract', 'substring', 'trim', 'overlay', 'position'))
+
+
+def _tokens_sql(sql: str) -> list:
+    """
+    Quebra o SQL em (tipo, valor, profundidade de parênteses, posição do fim),
+    sem espaços e comentários. Nomes ficam em minúsculas.
+    """
+    tokens = []
+    profundidade = 0
+    posicao = 0
+    while posicao < len(sql):
+        m = _TOKEN_SQL.match(sql, posicao)
+        if m is None:
+            raise ValueError(f"SQL recusado: caractere inesperado {sql[posicao]!r}")
+        posicao = m.end()
+        tipo = m.lastgroup
+        if tipo == 'espaco':
+            continue
+        if tipo == 'dolar':
+            raise ValueError("SQL recusado: strings com $$ não são aceitas")
+        valor = m.group()
+        if tipo == 'nome':
+            valor = valor.lower()
+        elif tipo == 'aspas':
+            tipo, valor = 'nome', valor[1:-1].replace('""', '"')
+        if valor == ')':
+            profundidade -= 1
+            if profundidade < 0:
+                raise ValueError("SQL recusado: parênteses desbalanceados")
+        tokens.append((tipo, valor, profundidade, posicao))
+        if valor == '(':
+            profundidade += 1
+    if profundidade:
+        raise ValueError("SQL recusado: parênteses desbalanceados")
+    return tokens
+
+
+@lru_cache(maxsize=8)
+def _esquema_para_validacao(tables_items: tuple) -> dict:
+    return {_nome_da_tabela(ddl): {coluna.lower() for coluna, *_ in _estrutura_ddl(ddl)}
+            for _, ddl in tables_items}
+
+
+def _fechamento(tokens: list, abertura: int) -> int:
+    """Índice do parêntese que fecha o aberto em `abertura`."""
+    nivel = tokens[abertura][2]
+    return next(j for j in range(abertura + 1, len(tokens)) if tokens[j][1] == ')' and tokens[j][2] == nivel)
+
+
+def validar_sql_gerado(sql: str, tables_dict: dict = tables) -> dict:
+    """
+    Confere, sem ir ao banco, o SQL devolvido pelo modelo: um único SELECT
+    (ou WITH ... SELECT), sem comandos de escrita nem funções administrativas,
+    lendo só tabelas do esquema e citando só colunas que existem nelas.
+    Devolve {'sql', 'tabelas', 'tem_limite'} ou levanta ValueError com o motivo.
+    """
+    tokens = _tokens_sql(sql)
+    while tokens and tokens[-1][1] == ';':
+        tokens.pop()
+    if not tokens:
+        raise ValueError("SQL recusado: consulta vazia")
+    if any(token[1] == ';' for token in tokens):
+        raise ValueError("SQL recusado: mais de um comando")
+    if tokens[0][1] not in ('select', 'with'):
+        raise ValueError("SQL recusado: só SELECT é permitido")
+
+    esquema = _esquema_para_validacao(tuple(tables_dict.items()))
+    nomes = [token[1] if token[0] == 'nome' else None for token in tokens]
+
+    def valor_em(j):
+        return tokens[j][1] if 0 <= j < len(tokens) else None
+
+    for i, nome in enumerate(nomes):
+        if nome in PALAVRAS_PROIBIDAS:
+            raise ValueError(f"SQL recusado: {nome.upper()} não é permitido")
+        if nome is not None and valor_em(i + 1) == '(' and FUNCOES_PROIBIDAS.match(nome):
+            raise ValueError(f"SQL recusado: a função {nome} não é permitida")
+
+    ctes = set()
+    apelidos = set()      # apelidos de colunas e nomes de colunas de CTEs
+    origens = {}          # apelido ou nome -> tabela do esquema (None: CTE, subconsulta ou função)
+    tabelas_lidas = set()
+
+    # CTEs: "nome AS (" ou "nome (colunas) AS ("
+    for i, nome in enumerate(nomes):
+        if nome is None or nome in PALAVRAS_SQL or valor_em(i - 1) not in ('with', 'recursive', ','):
+            continue
+        if valor_em(i + 1) == 'as' and valor_em(i + 2) == '(':
+            ctes.add(nome)
+        elif valor_em(i + 1) == '(':
+            fim = _fechamento(tokens, i + 1)
+            if valor_em(fim + 1) == 'as' and valor_em(fim + 2) == '(':
+                ctes.add(nome)
+                apelidos.update(n for n in nomes[i + 2:fim] if n)
+
+    # Janelas nomeadas: "WINDOW w AS (...) [, w2 AS (...)]", citadas depois em OVER w
+    for i, token in enumerate(tokens):
+        j = i + 1
+        while token[1] == 'window' and j < len(tokens) and nomes[j] is not None and \
+                valor_em(j + 1) == 'as' and valor_em(j + 2) == '(':
+            apelidos.add(nomes[j])
+            fim = _fechamento(tokens, j + 2)
+            if valor_em(fim + 1) != ',':
+                break
+            j = fim + 2
+
+    def ler_apelido(j: int, alvo) -> int:
+        # [AS] apelido [(colunas)] depois de uma origem que termina em j
+        if valor_em(j + 1) == 'as':
+            j += 1
+        if j + 1 < len(tokens) and nomes[j + 1] is not None and nomes[j + 1] not in PALAVRAS_SQL:
+            j += 1
+            origens[nomes[j]] = alvo
+            if valor_em(j + 1) == '(':
+                fim = _fechamento(tokens, j + 1)
+                apelidos.update(n for n in nomes[j + 2:fim] if n)
+                j = fim
+        return j
+
+    subconsultas = {}     # índice do ')' de uma subconsulta no FROM -> a lista de origens continua?
+    funcoes_abertas = []  # para reconhecer o FROM de EXTRACT(... FROM ...)
+
+    def ler_origens(j: int, em_lista: bool) -> int:
+        # Lê "origem [AS] apelido [, ...]" a partir de j; devolve o último índice consumido
+        while j < len(tokens):
+            if valor_em(j) in ('lateral', 'only'):
+                j += 1
+            if valor_em(j) == '(':
+                # Subconsulta: o laço principal valida o conteúdo; o apelido é lido no ')'
+                subconsultas[_fechamento(tokens, j)] = em_lista
+                return j - 1
+            nome = nomes[j] if j < len(tokens) else None
+            if nome is None or nome in PALAVRAS_SQL:
+                return j - 1
+            if valor_em(j + 1) == '.':
+                if nome != 'public' or nomes[j + 2] is None:
+                    raise ValueError(f"SQL recusado: esquema {nome} não é permitido")
+                j += 2
+                nome = nomes[j]
+            if valor_em(j + 1) == '(':
+                j = _fechamento(tokens, j + 1)
+                alvo = None
+            elif nome in ctes:
+                alvo = None
+                origens[nome] = None
+            elif nome in esquema:
+                alvo = nome
+                origens[nome] = nome
+                tabelas_lidas.add(nome)
+            else:
+                raise ValueError(f"SQL recusado: tabela desconhecida {nome}")
+            j = ler_apelido(j, alvo)
+            if not em_lista or valor_em(j + 1) != ',':
+                return j
+            j += 2
+        return j
+
+    i = 0
+    while i < len(tokens):
+        valor = tokens[i][1]
+        if valor == '(':
+            funcoes_abertas.append(nomes[i - 1] if i > 0 else None)
+        elif valor == ')':
+            funcoes_abertas.pop()
+            if i in subconsultas:
+                em_lista = subconsultas.pop(i)
+                i = ler_apelido(i, None)
+                if em_lista and valor_em(i + 1) == ',':
+                    i = ler_origens(i + 2, True)
+        elif valor == 'join':
+            i = ler_origens(i + 1, False)
+        elif valor == 'from' and not (funcoes_abertas and funcoes_abertas[-1] in _FUNCOES_COM_FROM):
+            i = ler_origens(i + 1, True)
+        i += 1
+
+    # Apelidos de colunas: "expr AS nome" e "expr nome" antes de vírgula, FROM ou fim
+    for i, nome in enumerate(nomes):
+        if nome is None or nome in PALAVRAS_SQL or valor_em(i + 1) in ('(', '.') or valor_em(i - 1) in ('.', '::'):
+            continue
+        if valor_em(i - 1) == 'as':
+            apelidos.add(nome)
+        elif i > 0 and valor_em(i + 1) in (',', 'from', ')', None) and \
+                (tokens[i - 1][0] in ('numero', 'texto') or valor_em(i - 1) in (')', '*') or
+                 (nomes[i - 1] is not None and nomes[i - 1] not in PALAVRAS_SQL)):
+            apelidos.add(nome)
+
+    colunas_conhecidas = set().union(*(esquema[t] for t in tabelas_lidas))
+    for i, nome in enumerate(nomes):
+        if nome is None or nome in PALAVRAS_SQL or valor_em(i + 1) == '(' or valor_em(i - 1) == '::':
+            continue
+        if valor_em(i - 1) == '.':
+            qualificador = nomes[i - 2] if i >= 2 else None
+            tabela = origens.get(qualificador)
+            if tabela is not None and nome not in esquema[tabela]:
+                raise ValueError(f"SQL recusado: coluna desconhecida {qualificador}.{nome}")
+            continue
+        if valor_em(i + 1) == '.':
+            if nome not in origens and nome != 'public':
+                raise ValueError(f"SQL recusado: tabela ou apelido desconhecido {nome}")
+            continue
+        if nome in colunas_conhecidas or nome in apelidos or nome in origens or nome in ctes:
+            continue
+        raise ValueError(f"SQL recusado: coluna desconhecida {nome}")
+
+    tem_limite = any(token[1] in ('limit', 'fetch') and token[2] == 0 for token in tokens)
+    # Até o fim do último token: sem ';' nem comentários no final, para o LIMIT poder ser acrescentado
+    return {'sql': sql[:tokens[-1][3]].strip(), 'tabelas': tabelas_lidas, 'tem_limite': tem_limite}
+
+
+def _estimativa_do_plano(plano_json) -> tuple:
+    plano = plano_json if isinstance(plano_json, list) else json.loads(plano_json)
+    raiz = plano[0]['Plan']
+    return raiz['Total Cost'], raiz['Plan Rows']
+
+
+def _sql_dentro_do_orcamento(sql: str, tem_limite: bool, custo: float, linhas: float) -> Optional[str]:
+    """
+    Decide o que fazer com o plano estimado: None se ele cabe no orçamento, o
+    SQL com LIMIT a ser estimado de novo se ainda não há LIMIT, ou ValueError.
+    """
+    if custo <= TEXT2SQL_CUSTO_MAX and linhas <= TEXT2SQL_MAX_LINHAS:
+        return None
+    if not tem_limite:
+        return f"{sql}\nLIMIT {TEXT2SQL_MAX_LINHAS}"
+    if linhas > TEXT2SQL_MAX_LINHAS:
+        # O LIMIT do próprio SQL é maior que o permitido: limita o resultado por fora
+        return f"SELECT * FROM (\n{sql}\n) AS limitada LIMIT {TEXT2SQL_MAX_LINHAS}"
+    raise ValueError(f"SQL recusado: custo estimado {custo:,.0f} acima do limite de {TEXT2SQL_CUSTO_MAX:,.0f}")
+
+
+def proteger_sql(cur, sql: str, tables_dict: dict = tables) -> str:
+    """
+    Etapa anterior à execução do SQL gerado: valida o texto contra o esquema,
+    deixa a transação só de leitura e limitada por statement_timeout e usa o
+    EXPLAIN para recusar planos acima de TEXT2SQL_CUSTO_MAX ou acrescentar
+    LIMIT quando a consulta devolveria mais de TEXT2SQL_MAX_LINHAS linhas.
+    Devolve o SQL a executar.
+    """
+    validado = validar_sql_gerado(sql, tables_dict)
+    sql = validado['sql']
+    # Como a transação do asyncpg com readonly=True: nada escrito sobrevive ao SQL gerado
+    cur.execute("SET TRANSACTION READ ONLY")
+    cur.execute(f"SET LOCAL statement_timeout = {int(TEXT2SQL_TIMEOUT_MS)}")
+    cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+    custo, linhas = _estimativa_do_plano(cur.fetchone()[0])
+    com_limite = _sql_dentro_do_orcamento(sql, validado['tem_limite'], custo, linhas)
+    if com_limite is None:
+        return sql
+    cur.execute("EXPLAIN (FORMAT JSON) " + com_limite)
+    custo_limitado, _ = _estimativa_do_plano(cur.fetchone()[0])
+    if custo_limitado > TEXT2SQL_CUSTO_MAX:
+        raise ValueError(f"SQL recusado: custo estimado {custo_limitado:,.0f} acima do limite de "
+                         f"{TEXT2SQL_CUSTO_MAX:,.0f}, mesmo com LIMIT {TEXT2SQL_MAX_LINHAS}")
+    print(f"\nLIMIT {TEXT2SQL_MAX_LINHAS} acrescentado: estimativa de {linhas:,.0f} linhas e custo {custo:,.0f} "
+          f"(orçamento: {TEXT2SQL_MAX_LINHAS} linhas, custo {TEXT2SQL_CUSTO_MAX:,.0f}).")
+    return com_limite
+
+
+async def _proteger_sql_async(conn, sql: str, tables_dict: dict) -> str:
+    """Mesma etapa de proteger_sql, em uma conexão do asyncpg (dentro de uma transação)."""
+    validado = validar_sql_gerado(sql, tables_dict)
+    sql = validado['sql']
+    await conn.execute(f"SET LOCAL statement_timeout = {int(TEXT2SQL_TIMEOUT_MS)}")
+    custo, linhas = _estimativa_do_plano(await conn.fetchval("EXPLAIN (FORMAT JSON) " + sql))
+    com_limite = _sql_dentro_do_orcamento(sql, validado['tem_limite'], custo, linhas)
+    if com_limite is None:
+        return sql
+    custo, _ = _estimativa_do_plano(await conn.fetchval("EXPLAIN (FORMAT JSON) " + com_limite))
+    if custo > TEXT2SQL_CUSTO_MAX:
+        raise ValueError(f"SQL recusado: custo estimado {custo:,.0f} acima do limite de "
+                         f"{TEXT2SQL_CUSTO_MAX:,.0f}, mesmo com LIMIT {TEXT2SQL_MAX_LINHAS}")
+    return com_limite
+
+
+# Cache do Text2SQL
+
+def normalizar_pergunta(pergunta: str) -> str:
+    sem_acentos = unicodedata.normalize('NFKD', pergunta).encode('ascii', 'ignore').decode('ascii')
+    return " ".join(re.sub(r"[^\w\s]", " ", sem_acentos.lower()).split())
+
+
+def impressao_digital_esquema(tables_dict: dict) -> str:
+    return hashlib.sha256(json.dumps(tables_dict, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _hash_resultado(colnames: list, result: list) -> str:
+    return hashlib.sha256(repr((colnames, result)).encode('utf-8')).hexdigest()
+
+
+class CacheText2SQL:
+    """
+    Cache em disco (SQLite) do Text2SQL. Guarda o SQL gerado para cada pergunta
+    normalizada e o resumo gerado para cada par (SQL, hash do resultado).
+    Entradas expiram após `ttl` segundos, as menos usadas recentemente são
+    descartadas acima de `maximo`, e tudo que foi gerado para outra versão do
+    esquema é apagado ao abrir o cache.
+    """
+
+    def __init__(self, caminho: str, esquema: str, maximo: int = TEXT2SQL_CACHE_MAX,
+                 ttl: float = TEXT2SQL_CACHE_TTL):
+        self.esquema = esquema
+        self.maximo = maximo
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(caminho, check_same_thread=False)
+        self._db.executescript("""
+CREATE TABLE IF NOT EXISTS consultas (
+    chave text PRIMARY KEY,
+    esquema text,
+    pergunta text,
+    sql text,
+    resposta text,
+    criado_em real,
+    acessado_em real);
+CREATE TABLE IF NOT EXISTS resumos (
+    chave text PRIMARY KEY,
+    esquema text,
+    resumo text,
+    criado_em real,
+    acessado_em real);""")
+        with self._db:
+            self._db.execute("DELETE FROM consultas WHERE esquema != ?", (esquema,))
+            self._db.execute("DELETE FROM resumos WHERE esquema != ?", (esquema,))
+
+    def _chave(self, *partes: str) -> str:
+        return hashlib.sha256("\x00".join((self.esquema,) + partes).encode('utf-8')).hexdigest()
+
+    def _buscar(self, tabela: str, colunas: str, chave: str):
+        agora = time.time()
+        with self._lock, self._db:
+            linha = self._db.execute(f"SELECT {colunas}, criado_em FROM {tabela} WHERE chave = ?",
+                                     (chave,)).fetchone()
+            if linha is None:
+                return None
+            if self.ttl and agora - linha[-1] > self.ttl:
+                self._db.execute(f"DELETE FROM {tabela} WHERE chave = ?", (chave,))
+                return None
+            self._db.execute(f"UPDATE {tabela} SET acessado_em = ? WHERE chave = ?", (agora, chave))
+            return linha[:-1]
+
+    def _guardar(self, tabela: str, valores: dict):
+        agora = time.time()
+        valores = dict(valores, esquema=self.esquema, criado_em=agora, acessado_em=agora)
+        colunas = ", ".join(valores)
+        marcadores = ", ".join("?" for _ in valores)
+        with self._lock, self._db:
+            self._db.execute(f"INSERT OR REPLACE INTO {tabela} ({colunas}) VALUES ({marcadores})",
+                             tuple(valores.values()))
+            self._db.execute(f"""
+DELETE FROM {tabela} WHERE chave NOT IN (
+    SELECT chave FROM {tabela} ORDER BY acessado_em DESC LIMIT ?)""", (self.maximo,))
+
+    def buscar_sql(self, pergunta: str):
+        return self._buscar('consultas', 'sql, resposta', self._chave('sql', normalizar_pergunta(pergunta)))
+
+    def guardar_sql(self, pergunta: str, sql: str, resposta: str):
+        self._guardar('consultas', {'chave': self._chave('sql', normalizar_pergunta(pergunta)),
+                                    'pergunta': pergunta, 'sql': sql, 'resposta': resposta})
+
+    def buscar_resumo(self, sql: str, hash_resultado: str) -> Optional[str]:
+        linha = self._buscar('resumos', 'resumo', self._chave('resumo', sql, hash_resultado))
+        return linha[0] if linha else None
+
+    def guardar_resumo(self, sql: str, hash_resultado: str, resumo: str):
+        self._guardar('resumos', {'chave': self._chave('resumo', sql, hash_resultado), 'resumo': resumo})
+
+    def ultimas_sqls(self, quantidade: int) -> list:
+        with self._lock:
+            linhas = self._db.execute("SELECT sql FROM consultas ORDER BY acessado_em DESC LIMIT ?",
+                                      (quantidade,)).fetchall()
+        return [linha[0] for linha in reversed(linhas)]
+
+
+_caches_text2sql = {}
+
+
+def obter_cache_text2sql(tables_dict: dict) -> Optional[CacheText2SQL]:
+    if not TEXT2SQL_CACHE:
+        return None
+    esquema = impressao_digital_esquema(tables_dict)
+    if esquema not in _caches_text2sql:
+        _caches_text2sql[esquema] = CacheText2SQL(TEXT2SQL_CACHE, esquema)
+    return _caches_text2sql[esquema]
+
+
+# Exemplos validados para o prompt (few-shot)
+#
+# Todo par (pergunta, SQL) que executou sem erro vai para um índice TF-IDF
+# local: SQLite guarda os pares e o índice invertido fica em memória, sem
+# rede nem dependências. As perguntas guardadas mais parecidas com a nova
+# entram no prompt como exemplos.
+
+PALAVRAS_VAZIAS = frozenset("""
+a o as os ao aos um uma uns umas e ou de da do das dos em no na nos nas num numa por pelo pela pelos pelas
+para pra com sem que se me mim meu minha todos todas todo toda foi sao ser esta estao ha
+""".split())
+
+# Peso por tipo de termo (pelo primeiro caractere): tabela citada e trigrama de letras
+PESOS_TERMOS = {'@': 1.5, '~': 0.3}
+
+# Plurais e femininos mais comuns: "hoteis" ~ "hotel", "reservas" ~ "reserva"
+SUFIXOS_RADICAL = (('oes', 'ao'), ('aes', 'ao'), ('eis', 'el'), ('ais', 'al'), ('ns', 'm'), ('s', ''))
+
+
+def _radical(palavra: str) -> str:
+    for sufixo, troca in SUFIXOS_RADICAL:
+        if len(palavra) > len(sufixo) + 2 and palavra.endswith(sufixo):
+            palavra = palavra[:-len(sufixo)] + troca
+            break
+    return palavra[:6]
+
+
+@lru_cache(maxsize=1)
+def _tabelas_por_radical() -> dict:
+    # "carros" e "veiculos" citam a mesma tabela: os dois contam como o termo @VEICULO
+    tabelas = {}
+    for table_name in tables:
+        for palavra in table_name.lower().split('_') + list(SINONIMOS_TABELAS.get(table_name, ())):
+            tabelas.setdefault(_radical(palavra), table_name)
+    return tabelas
+
+
+def termos_da_pergunta(pergunta: str) -> dict:
+    """
+    Termos da pergunta com suas contagens: o radical de cada palavra, a tabela
+    que ela cita (pelo nome ou por sinônimo) e os trigramas de letras das
+    palavras maiores, que aproximam variações como "gastaram" e "gasto".
+    """
+    termos = {}
+    for palavra in normalizar_pergunta(pergunta).split():
+        if palavra in PALAVRAS_VAZIAS:
+            continue
+        radical = _radical(palavra)
+        termos[radical] = termos.get(radical, 0) + 1
+        tabela = _tabelas_por_radical().get(radical)
+        if tabela:
+            termos["@" + tabela] = termos.get("@" + tabela, 0) + 1
+        if len(palavra) >= 5:
+            marcada = f"#{palavra}#"
+            for i in range(len(marcada) - 2):
+                trigrama = "~" + marcada[i:i + 3]
+                termos[trigrama] = termos.get(trigrama, 0) + 1
+    return termos
+
+
+class ExemplosText2SQL:
+    """
+    Pares (pergunta, SQL) que o Text2SQL executou com sucesso, um por pergunta
+    normalizada. `semelhantes` devolve os k de maior similaridade de cosseno
+    (TF-IDF) com uma pergunta nova. Acima de `maximo` os exemplos usados há
+    mais tempo saem, e exemplos de outra versão do esquema são apagados ao
+    abrir o arquivo.
+    """
+
+    def __init__(self, caminho: str, esquema: str, maximo: int = TEXT2SQL_EXEMPLOS_MAX):
+        self.esquema = esquema
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(caminho, check_same_thread=False)
+        self._db.executescript("""
+CREATE TABLE IF NOT EXISTS exemplos (
+    chave text PRIMARY KEY,
+    esquema text,
+    pergunta text,
+    sql text,
+    criado_em real,
+    usado_em real);""")
+        with self._db:
+            self._db.execute("DELETE FROM exemplos WHERE esquema != ?", (esquema,))
+        # chave -> (pergunta, sql, termos); termo -> chaves que o contêm
+        self._exemplos = {}
+        self._indice = {}
+        self._normas = {}
+        for chave, pergunta, sql in self._db.execute("SELECT chave, pergunta, sql FROM exemplos"):
+            self._indexar(chave, pergunta, sql)
+
+    def __len__(self):
+        return len(self._exemplos)
+
+    def _chave(self, pergunta: str) -> str:
+        return hashlib.sha256(f"{self.esquema}\x00{normalizar_pergunta(pergunta)}".encode('utf-8')).hexdigest()
+
+    def _indexar(self, chave: str, pergunta: str, sql: str):
+        termos = termos_da_pergunta(pergunta)
+        self._exemplos[chave] = (pergunta, sql, termos)
+        for termo in termos:
+            self._indice.setdefault(termo, set()).add(chave)
+        self._normas.clear()
+
+    def _desindexar(self, chave: str):
+        _, _, termos = self._exemplos.pop(chave)
+        for termo in termos:
+            chaves = self._indice[termo]
+            chaves.discard(chave)
+            if not chaves:
+                del self._indice[termo]
+        self._normas.clear()
+
+    def _peso(self, termo: str, contagem: int) -> float:
+        # tf sublinear vezes idf suavizado; os trigramas são muitos por palavra e valem menos
+        idf = math.log((1 + len(self._exemplos)) / (1 + len(self._indice.get(termo, ())))) + 1
+        return (1 + math.log(contagem)) * idf * PESOS_TERMOS.get(termo[0], 1.0)
+
+    def _norma(self, chave: str) -> float:
+        norma = self._normas.get(chave)
+        if norma is None:
+            termos = self._exemplos[chave][2]
+            norma = math.sqrt(sum(self._peso(t, c) ** 2 for t, c in termos.items())) or 1.0
+            self._normas[chave] = norma
+        return norma
+
+    def guardar(self, pergunta: str, sql: str):
+        chave = self._chave(pergunta)
+        agora = time.time()
+        with self._lock:
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO exemplos (chave, esquema, pergunta, sql, criado_em, usado_em) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)", (chave, self.esquema, pergunta, sql, agora, agora))
+                excedentes = [linha[0] for linha in self._db.execute(
+                    "SELECT chave FROM exemplos ORDER BY usado_em DESC LIMIT -1 OFFSET ?", (self.maximo,))]
+                self._db.executemany("DELETE FROM exemplos WHERE chave = ?", [(c,) for c in excedentes])
+            if chave in self._exemplos:
+                self._desindexar(chave)
+            self._indexar(chave, pergunta, sql)
+            for excedente in excedentes:
+                if excedente in self._exemplos:
+                    self._desindexar(excedente)
+
+    def semelhantes(self, pergunta: str, k: int = TEXT2SQL_EXEMPLOS_K,
+                    minimo: float = TEXT2SQL_EXEMPLOS_SIMILARIDADE) -> list:
+        """Até k tuplas (pergunta, sql, similaridade), da mais parecida para a menos."""
+        termos = termos_da_pergunta(pergunta)
+        with self._lock:
+            consulta = {t: self._peso(t, c) for t, c in termos.items() if t in self._indice}
+            norma_consulta = math.sqrt(sum(self._peso(t, c) ** 2 for t, c in termos.items())) or 1.0
+            produtos = {}
+            for termo, peso in consulta.items():
+                for chave in self._indice[termo]:
+                    contagem = self._exemplos[chave][2][termo]
+                    produtos[chave] = produtos.get(chave, 0.0) + peso * self._peso(termo, contagem)
+            notas = sorted(((produto / (norma_consulta * self._norma(chave)), chave)
+                            for chave, produto in produtos.items()), reverse=True)
+            escolhidos = [(chave, nota) for nota, chave in notas[:k] if nota >= minimo]
+            if escolhidos:
+                with self._db:
+                    self._db.executemany("UPDATE exemplos SET usado_em = ? WHERE chave = ?",
+                                         [(time.time(), chave) for chave, _ in escolhidos])
+            return [self._exemplos[chave][:2] + (round(nota, 3),) for chave, nota in escolhidos]
+
+
+_exemplos_text2sql = {}
+
+
+def obter_exemplos_text2sql(tables_dict: dict) -> Optional[ExemplosText2SQL]:
+    if not TEXT2SQL_EXEMPLOS:
+        return None
+    esquema = impressao_digital_esquema(tables_dict)
+    if esquema not in _exemplos_text2sql:
+        _exemplos_text2sql[esquema] = ExemplosText2SQL(TEXT2SQL_EXEMPLOS, esquema)
+    return _exemplos_text2sql[esquema]
+
+
+def _exemplos_do_prompt(exemplos: Optional[ExemplosText2SQL], consulta: str) -> list:
+    if exemplos is None or TEXT2SQL_EXEMPLOS_K <= 0:
+        return []
+    return exemplos.semelhantes(consulta, TEXT2SQL_EXEMPLOS_K)
+
+
+def _novo_cliente_gemini(api_key: str):
+    from google import genai
+    from google.genai import types
+
+    # GEMINI_BASE_URL permite apontar para um proxy ou para um servidor de testes local
+    if GEMINI_BASE_URL:
+        return genai.Client(api_key=api_key, http_options=types.HttpOptions(base_url=GEMINI_BASE_URL))
+    return genai.Client(api_key=api_key)
+
+
+@lru_cache(maxsize=4)
+def _cliente_gemini(api_key: str):
+    return _novo_cliente_gemini(api_key)
+
+
+# Esquema compacto para os prompts do Text2SQL
+
+TIPOS_COMPACTOS = {'integer': 'int', 'varchar': 'str', 'text': 'str', 'float': 'float', 'timestamp': 'ts'}
+
+# Termos de perguntas que não aparecem nos nomes de tabelas e colunas
+SINONIMOS_TABELAS = {
+    'HOSPEDE': ('cliente', 'clientes', 'pessoa', 'pessoas'),
+    'RESERVA': ('estadia', 'estadias', 'hospedagem', 'dias', 'noites', 'conta', 'receita', 'faturamento'),
+    'PEDIDO': ('gasto', 'gastos', 'consumo', 'consumiu', 'gastou', 'extra', 'extras'),
+    'ITEM': ('itens', 'produto', 'produtos', 'servico', 'servicos'),
+    'VEICULO': ('carro', 'carros', 'automovel', 'automoveis'),
+    'ANIMAL_ESTIMACAO': ('animal', 'animais', 'pet', 'pets', 'cachorro', 'cachorros', 'gato', 'gatos'),
+    'FUNCIONARIO': ('empregado', 'empregados', 'cozinheiro', 'faxineiro', 'manobrista', 'recepcionista'),
+    'VAGA': ('estacionamento', 'garagem'),
+}
+
+
+def _nome_da_tabela(table_description: str) -> str:
+    return re.search(r"CREATE TABLE(?: IF NOT EXISTS)?\s+(\w+)", table_description, re.IGNORECASE).group(1).lower()
+
+
+def _mesmo_radical(termo: str, palavra: str) -> bool:
+    # "hoteis" ~ "hotel", "reservas" ~ "reserva": só a última letra da palavra pode variar
+    if len(palavra) < 4:
+        return termo == palavra
+    comum = len(os.path.commonprefix([termo, palavra]))
+    return comum >= len(palavra) - 1 and len(termo) <= len(palavra) + 3
+
+
+def tabelas_relevantes(tables_dict: dict, pergunta: str) -> list:
+    """
+    Escolhe as tabelas citadas na pergunta (pelo nome, por sinônimos ou por uma
+    coluna exclusiva da tabela) e acrescenta as tabelas que elas referenciam
+    por chave estrangeira, que são as necessárias para os JOINs. Sem nenhuma
+    correspondência, devolve todas as tabelas.
+    """
+    termos = normalizar_pergunta(pergunta).split()
+    estruturas = {t: _estrutura_ddl(ddl) for t, ddl in tables_dict.items()}
+    por_nome = {_nome_da_tabela(ddl): t for t, ddl in tables_dict.items()}
+
+    palavras_colunas = {}
+    for table_name, estrutura in estruturas.items():
+        for coluna, *_ in estrutura:
+            for palavra in coluna.split('_'):
+                if palavra != 'id':
+                    palavras_colunas.setdefault(palavra, set()).add(table_name)
+
+    escolhidas = set()
+    for table_name in tables_dict:
+        palavras = table_name.lower().split('_') + list(SINONIMOS_TABELAS.get(table_name, ()))
+        palavras += [p for p, donas in palavras_colunas.items() if donas == {table_name}]
+        if any(_mesmo_radical(termo, palavra) for termo in termos for palavra in palavras):
+            escolhidas.add(table_name)
+    if not escolhidas:
+        return list(tables_dict)
+
+    referenciadas = {por_nome[referencia.lower()]
+                     for table_name in escolhidas
+                     for _, _, _, referencia, _ in estruturas[table_name]
+                     if referencia and referencia.lower() in por_nome}
+    return [t for t in tables_dict if t in escolhidas | referenciadas]
+
+
+def esquema_compacto(tables_dict: dict, pergunta: Optional[str] = None) -> str:
+    """
+    Representa o esquema em uma linha por tabela, no formato
+    tabela(coluna:tipo, ...), com "pk" na chave primária, "->tabela" nas
+    chaves estrangeiras e os valores permitidos pelos CHECKs entre chaves.
+    """
+    selecionadas = tabelas_relevantes(tables_dict, pergunta) if pergunta else list(tables_dict)
+    linhas = []
+    for table_name in selecionadas:
+        colunas = []
+        for coluna, tipo, chave_primaria, referencia, valores in _estrutura_ddl(tables_dict[table_name]):
+            descricao = f"{coluna}:{TIPOS_COMPACTOS.get(tipo.lower(), tipo.lower())}"
+            if chave_primaria:
+                descricao += " pk"
+            if referencia:
+                descricao += f"->{referencia.lower()}"
+            if valores:
+                descricao += "{" + "|".join(valores) + "}"
+            colunas.append(descricao)
+        linhas.append(f"{_nome_da_tabela(tables_dict[table_name])}({', '.join(colunas)})")
+    return "\n".join(linhas)
+
+
+def _tokens_estimados(texto: str) -> int:
+    # Aproximação usual de ~4 caracteres por token
+    return max(1, len(texto) // 4)
+
+
+def _relatorio_tokens(etapa: str, prompt: str, prompt_sem_compactar_tamanho: int):
+    usados = _tokens_estimados(prompt)
+    sem_compactar = max(1, prompt_sem_compactar_tamanho // 4)
+    print(f"(tokens de entrada da etapa {etapa}: ~{usados} em vez de ~{sem_compactar}, "
+          f"economia de {100 * (1 - usados / sem_compactar):.0f}%)")
+
+
+def _linhas_para_resumo(result: list, maximo: int = TEXT2SQL_MAX_LINHAS_RESUMO) -> str:
+    """
+    Formata no máximo `maximo` linhas, uma por linha de texto e com os valores
+    separados por " | ", avisando quantas ficaram de fora.
     """
-    linhas_brutas = full_text.splitlines()
-    linhas_limpa = []
+    linhas = [" | ".join("NULL" if v is None else str(v) for v in row) for row in result[:maximo]]
+    if len(result) > maximo:
+        linhas.append(f"(mostrando {maximo} de {len(result)} linhas)")
+    return "\n".join(linhas)
+
+
+# Text2SQL com explicação em linguagem natural dos resultados
+
+def _esquema_do_prompt(consulta: str, tables_dict: dict) -> str:
+    return esquema_compacto(tables_dict, consulta if TEXT2SQL_PODAR_ESQUEMA else None)
+
+
+# Filtros diretos na coluna de partição permitem ao planejador descartar partições
+REGRA_PARTICOES = """7. The tables reserva and pedido are partitioned by data_entrada. When the description restricts a
+   period, filter directly on data_entrada of those tables with literal bounds (for example
+   r.data_entrada >= '2024-01-01' AND r.data_entrada < '2024-02-01'), never wrap data_entrada in functions
+   such as EXTRACT or date_trunc in the WHERE clause, and join pedido to reserva on both id_reserva and
+   data_entrada.
+"""
 
-    for line in linhas_brutas:
-        line = line.strip()
-        if not line:
-            continue
-        if line.startswith("```"):
-            continue
-        linhas_limpa.append(line)
 
-    sql_line = None
-    for line in reversed(linhas_limpa):
-        lower = line.lower()
-        if lower.startswith("select") or lower.startswith("with"):
-            sql_line = line
-            break
-        if "select" in lower or "with" in lower:
-            idx = lower.find("select")
-            if idx == -1:
-                idx = lower.find("with")
-            sql_line = line[idx:]
-            break
+REGRA_RESPOSTA_TEXTO = """6. The answer must contain two parts in this exact order:
+   a) A short explanation in natural language (in Portuguese) describing the reasoning and how the tables are related.
+   b) After the explanation, write ONLY the final SQL query, starting with SELECT or WITH and without a semicolon
+      at the end. It may span several lines."""
 
-    return sql_line
+REGRA_RESPOSTA_JSON = """6. Answer with a JSON object with exactly two fields:
+   "explicacao": a short explanation in natural language (in Portuguese) describing the reasoning and how the
+   tables are related;
+   "sql": ONLY the final SQL query, starting with SELECT or WITH and without a semicolon at the end."""
 
+ESQUEMA_RESPOSTA_SQL = {
+    'type': 'OBJECT',
+    'properties': {'explicacao': {'type': 'STRING'}, 'sql': {'type': 'STRING'}},
+    'required': ['explicacao', 'sql'],
+    'property_ordering': ['explicacao', 'sql'],
+}
 
-# Text2SQL com explicação em linguagem natural dos resultados
 
-def text2sql(conn, GEMINI_API_KEY, GEMINI_MODEL, tables_dict):
-    if not GEMINI_API_KEY:
-        print("GEMINI_API_KEY não definida. Verifique o arquivo .env.")
-        return
-    if not GEMINI_MODEL:
-        print("GEMINI_MODEL não definido. Verifique o arquivo .env.")
-        return
+def _bloco_exemplos(exemplos: list) -> str:
+    if not exemplos:
+        return ""
+    blocos = "\n\n".join(f"Question: {pergunta}\nSQL:\n{sql}" for pergunta, sql, *_ in exemplos)
+    return f"""
+Questions about this database that were already answered with SQL that ran correctly, most similar first.
+Reuse their joins and filters when they fit the new description:
 
-    cur = conn.cursor()
-    consulta = input("Utilizando linguagem natural, descreva a consulta desejada: ")
+{blocos}
+"""
 
-    genai_client = genai.Client(api_key=GEMINI_API_KEY)
 
-    prompt = f"""
+def _prompt_sql(consulta: str, esquema: str, exemplos: Optional[list] = None) -> str:
+    return f"""
 You received the following query description in natural language: "{consulta}".
 
-Consider only the tables and columns defined in this database structure: {tables_dict}.
-
+Consider only the tables and columns defined in this database structure
+(one table per line as table(column:type); "pk" marks the primary key, "->table" a foreign key
+and {{a|b}} the only allowed values):
+{esquema}
+{_bloco_exemplos(exemplos)}
 Your task is to convert the description into a valid PostgreSQL SQL query.
 
 Mandatory rules:
 1. The query must be a fully working SELECT statement.
 2. Use explicit table aliases and column aliases when needed.
 3. Do not use formatting characters such as backslashes, code fences or a semicolon at the end of the query.
-4. Do not invent tables, columns, or relationships that do not exist in the provided dictionary.
+4. Do not invent tables, columns, or relationships that do not exist in the provided structure.
 5. If the query requires joins, briefly explain each join before showing the final SQL query.
-6. The answer must contain two parts in this exact order:
-   a) A short explanation in natural language (in Portuguese) describing the reasoning and how the tables are related.
-   b) On the last line, write ONLY the final SQL query, starting with SELECT and without a semicolon at the end.
-"""
-
-    try:
-        response = genai_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[prompt],
-            config=types.GenerateContentConfig(
-                temperature=0.0
-            )
-        )
-    except Exception as e:
-        print(f"Erro ao chamar o modelo Gemini: {e}")
-        cur.close()
-        return
-
-    full_text = response.text.strip() if hasattr(response, "text") else str(response)
-    print("\nResposta completa do modelo (explicação + SQL):")
-    print(full_text)
+{REGRA_RESPOSTA_JSON if TEXT2SQL_RESPOSTA_JSON else REGRA_RESPOSTA_TEXTO}
+{REGRA_PARTICOES if PARTICIONAR_RESERVAS else ""}"""
 
-    sql_line = _extrair_sql_da_resposta(full_text)
 
-    if not sql_line:
-        print("\nNão foi possível identificar a consulta SQL na resposta do modelo.")
-        cur.close()
-        return
+def _config_sql(types):
+    """Configuração da geração do SQL: com TEXT2SQL_RESPOSTA_JSON o modelo devolve JSON com o campo sql separado."""
+    if not TEXT2SQL_RESPOSTA_JSON:
+        return types.GenerateContentConfig(temperature=0.0)
+    return types.GenerateContentConfig(temperature=0.0, response_mime_type="application/json",
+                                       response_schema=ESQUEMA_RESPOSTA_SQL)
 
-    print("\nSQL que será executado:")
-    print(sql_line)
 
+def _texto_para_exibir(full_text: str) -> str:
+    # Resposta em JSON: mostra a explicação e o SQL em vez do objeto cru
     try:
-        cur.execute(sql_line)
-        result = cur.fetchall()
-        colnames = [desc[0] for desc in cur.description]
+        resposta = json.loads(full_text)
+    except json.JSONDecodeError:
+        return full_text
+    if not isinstance(resposta, dict):
+        return full_text
+    return f"{resposta.get('explicacao', '')}\n{resposta.get('sql', '')}".strip()
 
-        print("\nResultados da consulta (tuplas cruas):")
-        for row in result:
-            print(row)
 
-        if result:
-            resumo_prompt = f"""
+def _prompt_resumo(consulta: str, sql_line: str, colnames: list, result: list) -> str:
+    return f"""
 Você é um assistente que explica resultados de consultas SQL para um usuário leigo.
 
 Requisição original em linguagem natural:
@@ -694,8 +4354,8 @@ Consulta SQL executada:
 Nomes das colunas no resultado:
 {colnames}
 
-Linhas retornadas:
-{result}
+Linhas retornadas (valores separados por " | "):
+{_linhas_para_resumo(result)}
 
 Tarefa:
 1. Escreva um parágrafo curto, em português, explicando de forma geral o que esses resultados mostram.
@@ -708,28 +4368,378 @@ Tarefa:
 Se nenhuma linha tiver sido retornada, diga claramente que a consulta não encontrou resultados.
 """
 
-            try:
-                resumo_response = genai_client.models.generate_content(
+
+def _texto_da_resposta(response) -> str:
+    return response.text.strip() if hasattr(response, "text") else str(response)
+
+
+# Respostas em streaming: a explicação aparece enquanto o modelo escreve
+
+_ESCAPE_INCOMPLETO = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}$')
+
+
+def _campo_json_parcial(texto: str, campo: str) -> tuple:
+    """Valor (possivelmente parcial) de um campo string de um JSON que ainda está chegando, e se já fechou."""
+    inicio = re.search(r'"%s"\s*:\s*"' % campo, texto)
+    if not inicio:
+        return None, False
+    i = j = inicio.end()
+    while j < len(texto):
+        c = texto[j]
+        if c == '"':
+            return json.loads('"' + texto[i:j] + '"'), True
+        if c == '\\':
+            passo = 6 if texto[j + 1:j + 2] == 'u' else 2
+            if j + passo > len(texto):
+                break  # escape cortado no meio: espera o próximo pedaço
+            j += passo
+        else:
+            j += 1
+    parcial = texto[i:j]
+    # Metade de um par surrogate não pode ser impressa; fica para o próximo pedaço
+    parcial = _ESCAPE_INCOMPLETO.sub('', parcial)
+    return json.loads('"' + parcial + '"'), False
+
+
+def _gerar_sql_em_streaming(genai_client, modelo: str, prompt: str, types) -> tuple:
+    """
+    Gera o SQL com generate_content_stream, imprimindo a explicação conforme chega.
+    Em modo JSON o campo sql vem por último: assim que a string fecha, o stream é
+    abandonado e o SQL vai para execução sem esperar o fim da resposta.
+    Retorna (texto completo para o cache, SQL extraído).
+    """
+    print("\nResposta do modelo (explicação + SQL):")
+    recebido = ""
+    exibido = 0
+    sql = None
+    stream = genai_client.models.generate_content_stream(
+        model=modelo,
+        contents=[prompt],
+        config=_config_sql(types)
+    )
+    try:
+        for parte in stream:
+            pedaco = parte.text or ""
+            recebido += pedaco
+            if not TEXT2SQL_RESPOSTA_JSON:
+                print(pedaco, end="", flush=True)
+                continue
+            explicacao, _ = _campo_json_parcial(recebido, "explicacao")
+            if explicacao and len(explicacao) > exibido:
+                print(explicacao[exibido:], end="", flush=True)
+                exibido = len(explicacao)
+            sql, completo = _campo_json_parcial(recebido, "sql")
+            if completo:
+                break
+            sql = None
+    finally:
+        if hasattr(stream, "close"):
+            stream.close()
+    print()
+
+    if sql is None:
+        # Modo texto, ou o modelo fugiu do JSON: extrai da resposta inteira
+        if TEXT2SQL_RESPOSTA_JSON:
+            print(_texto_para_exibir(recebido.strip()))
+        return recebido.strip(), _extrair_sql_da_resposta(recebido)
+
+    explicacao, _ = _campo_json_parcial(recebido, "explicacao")
+    print(sql)
+    full_text = json.dumps({"explicacao": explicacao or "", "sql": sql}, ensure_ascii=False)
+    return full_text, _comando_sql_valido(sql)
+
+
+def _gerar_resumo(genai_client, modelo: str, resumo_prompt: str, types) -> str:
+    """Descrição dos resultados; em streaming o texto é impresso conforme chega."""
+    config = types.GenerateContentConfig(temperature=0.2)
+    if not TEXT2SQL_STREAMING:
+        resumo_response = genai_client.models.generate_content(
+            model=modelo,
+            contents=[resumo_prompt],
+            config=config
+        )
+        resumo_texto = _texto_da_resposta(resumo_response)
+        print("\nDescrição em linguagem natural dos resultados:")
+        print(resumo_texto)
+        return resumo_texto
+
+    print("\nDescrição em linguagem natural dos resultados:")
+    partes = []
+    for parte in genai_client.models.generate_content_stream(
+            model=modelo,
+            contents=[resumo_prompt],
+            config=config):
+        pedaco = parte.text or ""
+        print(pedaco, end="", flush=True)
+        partes.append(pedaco)
+    print()
+    return "".join(partes).strip()
+
+
+def text2sql(conn, GEMINI_API_KEY, GEMINI_MODEL, tables_dict, consulta: Optional[str] = None):
+    if not GEMINI_API_KEY:
+        print("GEMINI_API_KEY não definida. Verifique o arquivo .env.")
+        return
+    if not GEMINI_MODEL:
+        print("GEMINI_MODEL não definido. Verifique o arquivo .env.")
+        return
+
+    from google.genai import types
+
+    cur = conn.cursor()
+    if consulta is None:
+        consulta = input("Utilizando linguagem natural, descreva a consulta desejada: ")
+
+    genai_client = _cliente_gemini(GEMINI_API_KEY)
+    cache = obter_cache_text2sql(tables_dict)
+    exemplos = obter_exemplos_text2sql(tables_dict)
+
+    em_cache = cache.buscar_sql(consulta) if cache else None
+    if em_cache:
+        sql_line, full_text = em_cache
+        print("\nResposta recuperada do cache (explicação + SQL):")
+        print(_texto_para_exibir(full_text))
+    else:
+        esquema = _esquema_do_prompt(consulta, tables_dict)
+        semelhantes = _exemplos_do_prompt(exemplos, consulta)
+        if semelhantes:
+            print(f"(exemplos validados no prompt: {len(semelhantes)}, similaridade "
+                  f"{', '.join(str(nota) for *_, nota in semelhantes)})")
+        prompt = _prompt_sql(consulta, esquema, semelhantes)
+        _relatorio_tokens("SQL", prompt, len(prompt) - len(esquema) + len(str(tables_dict)))
+        try:
+            if TEXT2SQL_STREAMING:
+                full_text, sql_line = _gerar_sql_em_streaming(genai_client, GEMINI_MODEL, prompt, types)
+            else:
+                response = genai_client.models.generate_content(
                     model=GEMINI_MODEL,
-                    contents=[resumo_prompt],
-                    config=types.GenerateContentConfig(
-                        temperature=0.2
-                    )
+                    contents=[prompt],
+                    config=_config_sql(types)
                 )
-                resumo_texto = resumo_response.text.strip() if hasattr(resumo_response, "text") else str(resumo_response)
-                print("\nDescrição em linguagem natural dos resultados:")
+                full_text = _texto_da_resposta(response)
+                print("\nResposta completa do modelo (explicação + SQL):")
+                print(_texto_para_exibir(full_text))
+                sql_line = _extrair_sql_da_resposta(full_text)
+        except Exception as e:
+            print(f"Erro ao chamar o modelo Gemini: {e}")
+            cur.close()
+            return
+
+    if not sql_line:
+        print("\nNão foi possível identificar a consulta SQL na resposta do modelo.")
+        cur.close()
+        return
+
+    try:
+        # Validação, orçamento de custo e statement_timeout antes de executar
+        sql_executado = proteger_sql(cur, sql_line, tables_dict)
+        print("\nSQL que será executado:")
+        print(sql_executado)
+
+        cur.execute(sql_executado)
+        result = cur.fetchall()
+        colnames = [desc[0] for desc in cur.description]
+        _historico_text2sql.append(sql_executado)
+        if cache and not em_cache:
+            # Só entra no cache o SQL que executou sem erro
+            cache.guardar_sql(consulta, sql_line, full_text)
+        if exemplos is not None:
+            exemplos.guardar(consulta, sql_line)
+
+        print("\nResultados da consulta (tuplas cruas):")
+        for row in result:
+            print(row)
+
+        if result:
+            hash_resultado = _hash_resultado(colnames, result)
+            resumo_texto = cache.buscar_resumo(sql_line, hash_resultado) if cache else None
+            if resumo_texto:
+                print("\nDescrição em linguagem natural dos resultados (cache):")
                 print(resumo_texto)
-            except Exception as e:
-                print(f"\nErro ao gerar descrição em linguagem natural: {e}")
+            else:
+                resumo_prompt = _prompt_resumo(consulta, sql_line, colnames, result)
+                _relatorio_tokens("resumo", resumo_prompt,
+                                  len(resumo_prompt) - len(_linhas_para_resumo(result)) + len(str(result)))
+                try:
+                    resumo_texto = _gerar_resumo(genai_client, GEMINI_MODEL, resumo_prompt, types)
+                    if cache:
+                        cache.guardar_resumo(sql_line, hash_resultado, resumo_texto)
+                except Exception as e:
+                    print(f"\nErro ao gerar descrição em linguagem natural: {e}")
         else:
             print("\nA consulta não retornou nenhuma linha.")
 
+    except ValueError as e:
+        print("\nO SQL gerado não foi executado:")
+        print(sql_line)
+        print(e)
     except psycopg2.Error as e:
         print("\nErro ao executar a consulta SQL gerada:")
         print(e.pgcode)
         print(e.pgerror)
     finally:
         cur.close()
+        # Só leitura: desfaz a transação, o que também encerra o SET LOCAL statement_timeout
+        conn.rollback()
+
+
+# Text2SQL em lote (asyncio)
+
+async def _text2sql_async(genai_client, pool_async, consulta: str, tables_dict: dict, cache, exemplos,
+                          limite_modelo: 'asyncio.Semaphore', limite_banco: 'asyncio.Semaphore') -> dict:
+    """
+    Processa uma pergunta do lote: gera o SQL (ou busca no cache), executa no
+    banco e gera o resumo. Os semáforos limitam quantas chamadas ao modelo e
+    quantas consultas ao banco ficam em andamento ao mesmo tempo, e enquanto
+    uma pergunta espera o banco outra já pode estar gerando SQL.
+    """
+    from google.genai import types
+
+    resultado = {'pergunta': consulta, 'sql': None, 'colunas': None, 'linhas': None,
+                 'resumo': None, 'erro': None, 'cache': False, 'exemplos': 0}
+    inicio = time.perf_counter()
+    try:
+        em_cache = cache.buscar_sql(consulta) if cache else None
+        if em_cache:
+            sql_line, full_text = em_cache
+            resultado['cache'] = True
+        else:
+            semelhantes = _exemplos_do_prompt(exemplos, consulta)
+            resultado['exemplos'] = len(semelhantes)
+            async with limite_modelo:
+                response = await genai_client.aio.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=[_prompt_sql(consulta, _esquema_do_prompt(consulta, tables_dict), semelhantes)],
+                    config=_config_sql(types)
+                )
+            full_text = _texto_da_resposta(response)
+            sql_line = _extrair_sql_da_resposta(full_text)
+        if not sql_line:
+            resultado['erro'] = "Não foi possível identificar a consulta SQL na resposta do modelo."
+            return resultado
+        resultado['sql'] = sql_line
+
+        async with limite_banco:
+            async with pool_async.acquire() as conn, conn.transaction(readonly=True):
+                sql_executado = await _proteger_sql_async(conn, sql_line, tables_dict)
+                resultado['sql'] = sql_executado
+                inicio_banco = time.perf_counter()
+                try:
+                    registros = await conn.fetch(sql_executado)
+                except Exception:
+                    metricas.registrar(sql_executado, time.perf_counter() - inicio_banco, erro=True)
+                    raise
+                decorrido = time.perf_counter() - inicio_banco
+                impressao = metricas.registrar(sql_executado, decorrido)
+                metricas.adicionar_leitura(impressao, len(registros), _tamanho_linhas(registros))
+                if CONSULTA_LENTA_MS > 0 and decorrido * 1000 >= CONSULTA_LENTA_MS:
+                    plano = None
+                    if metricas.precisa_de_plano(impressao, sql_executado, decorrido):
+                        try:
+                            async with conn.transaction():  # savepoint: uma falha não aborta a transação
+                                plano = "\n".join(linha[0] for linha in
+                                                  await conn.fetch("EXPLAIN (ANALYZE, BUFFERS) " + sql_executado))
+                        except Exception as e:
+                            plano = f"EXPLAIN falhou: {e}"
+                    metricas.registrar_lenta(impressao, sql_executado, decorrido, len(registros), plano)
+        result = [tuple(registro) for registro in registros]
+        colnames = list(registros[0].keys()) if registros else []
+        resultado['colunas'] = colnames
+        resultado['linhas'] = result
+        _historico_text2sql.append(sql_executado)
+        if cache and not em_cache:
+            cache.guardar_sql(consulta, sql_line, full_text)
+        if exemplos is not None:
+            exemplos.guardar(consulta, sql_line)
+
+        if result:
+            hash_resultado = _hash_resultado(colnames, result)
+            resumo_texto = cache.buscar_resumo(sql_line, hash_resultado) if cache else None
+            if not resumo_texto:
+                async with limite_modelo:
+                    resumo_response = await genai_client.aio.models.generate_content(
+                        model=GEMINI_MODEL,
+                        contents=[_prompt_resumo(consulta, sql_line, colnames, result)],
+                        config=types.GenerateContentConfig(temperature=0.2)
+                    )
+                resumo_texto = _texto_da_resposta(resumo_response)
+                if cache:
+                    cache.guardar_resumo(sql_line, hash_resultado, resumo_texto)
+            resultado['resumo'] = resumo_texto
+    except Exception as e:
+        resultado['erro'] = str(e)
+    finally:
+        resultado['segundos'] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+
+async def text2sql_lote_async(perguntas: list, tables_dict: dict = tables,
+                              concorrencia: int = TEXT2SQL_CONCORRENCIA, ao_concluir=None) -> list:
+    import asyncio
+    import asyncpg
+
+    # Cliente próprio do lote: o cliente assíncrono fica preso ao event loop em que foi usado
+    genai_client = _novo_cliente_gemini(GEMINI_API_KEY)
+    cache = obter_cache_text2sql(tables_dict)
+    exemplos = obter_exemplos_text2sql(tables_dict)
+    limite_modelo = asyncio.Semaphore(concorrencia)
+    limite_banco = asyncio.Semaphore(concorrencia)
+    parametros = parametros_de_leitura()
+    pool_async = await asyncpg.create_pool(**_parametros_asyncpg(parametros), min_size=1, max_size=concorrencia)
+    try:
+        tarefas = [asyncio.create_task(_text2sql_async(genai_client, pool_async, consulta, tables_dict,
+                                                       cache, exemplos, limite_modelo, limite_banco))
+                   for consulta in perguntas]
+        resultados = []
+        for tarefa in asyncio.as_completed(tarefas):
+            resultado = await tarefa
+            resultados.append(resultado)
+            if ao_concluir is not None:
+                ao_concluir(resultado)
+        return resultados
+    finally:
+        await pool_async.close()
+
+
+def text2sql_lote(caminho_perguntas: str, caminho_saida: Optional[str] = None,
+                  concorrencia: int = TEXT2SQL_CONCORRENCIA):
+    """
+    Lê uma pergunta por linha (linhas vazias e iniciadas com # são ignoradas)
+    e grava um objeto JSON por pergunta, na ordem em que forem concluídas.
+    """
+    if not GEMINI_API_KEY or not GEMINI_MODEL:
+        print("GEMINI_API_KEY e GEMINI_MODEL precisam estar definidos no arquivo .env.")
+        return
+    with open(caminho_perguntas, encoding='utf-8') as arquivo:
+        perguntas = [linha.strip() for linha in arquivo if linha.strip() and not linha.startswith('#')]
+    if not perguntas:
+        print("Nenhuma pergunta encontrada no arquivo.")
+        return
+
+    saida = open(caminho_saida, 'w', encoding='utf-8') if caminho_saida else None
+
+    def escrever(resultado):
+        linha = json.dumps(resultado, ensure_ascii=False, default=str)
+        if saida is not None:
+            saida.write(linha + "\n")
+            saida.flush()
+            estado = "erro" if resultado['erro'] else f"{len(resultado['linhas'])} linhas"
+            print(f"[{resultado['segundos']:.1f}s] {resultado['pergunta']} -> {estado}")
+        else:
+            print(linha)
+
+    import asyncio
+
+    inicio = time.perf_counter()
+    try:
+        resultados = asyncio.run(text2sql_lote_async(perguntas, tables, concorrencia, escrever))
+    finally:
+        if saida is not None:
+            saida.close()
+    decorrido = time.perf_counter() - inicio
+    erros = sum(1 for resultado in resultados if resultado['erro'])
+    print(f"{len(resultados)} perguntas em {decorrido:.1f}s "
+          f"({60 * len(resultados) / max(decorrido, 1e-9):.1f} perguntas/min, {erros} com erro)")
 
 
 def listar_tabelas_definidas():
@@ -752,13 +4762,679 @@ Gerenciador do Banco de Dados
 10 Consulta Text2SQL
 11 Remover todas as tabelas
 12 Listar tabelas definidas
+13 Gerar dados sintéticos (fator de escala)
+14 Consultor de índices (EXPLAIN das consultas)
+15 Criar/atualizar views materializadas das consultas
+16 Text2SQL em lote (arquivo com uma pergunta por linha)
+17 Exportar gráficos das consultas para arquivos (sem janela)
+18 Disponibilidade de quartos e calendário de ocupação
+19 Exportar as tabelas para Parquet (consultas fora do banco)
+20 Faturamento: conta da reserva, receita e conciliação dos totais
 0  Sair do Programa
 > """
 
 
-def main():
+# Opções e subcomandos que só leem: com DB_REPLICAS vão para uma réplica em dia
+OPCOES_DE_LEITURA = {'6', '7', '8', '9', '10', '14', '17', '18', '19'}
+COMANDOS_DE_LEITURA = {'query', 'text2sql', 'livres', 'ocupacao', 'receita', 'parquet'}
+
+
+def executar_opcao(conn, escolha):
+    if escolha == '1':
+        criar_todas_as_tabelas(conn)
+    elif escolha == '2':
+        inserir_valores(conn)
+    elif escolha == '3':
+        insert(conn)
+    elif escolha == '4':
+        update(conn)
+    elif escolha == '5':
+        delete(conn)
+    elif escolha == '6':
+        consulta01(conn)
+    elif escolha == '7':
+        consulta02(conn)
+    elif escolha == '8':
+        periodo = input("Período de entrada (ex.: 2024-01-01 2024-07-01; vazio para todo o histórico): ").split()
+        consulta03(conn, *periodo[:2])
+    elif escolha == '9':
+        consulta_individual(conn)
+    elif escolha == '10':
+        text2sql(conn, GEMINI_API_KEY, GEMINI_MODEL, tables)
+    elif escolha == '11':
+        remover_todas_as_tabelas(conn)
+    elif escolha == '12':
+        listar_tabelas_definidas()
+    elif escolha == '13':
+        escala = input(f"Digite o fator de escala (padrão {ESCALA_DADOS}): ").strip()
+        try:
+            gerar_dados_sinteticos(conn, float(escala) if escala else ESCALA_DADOS)
+        except ValueError:
+            print("Fator de escala inválido.")
+    elif escolha == '14':
+        consultor_de_indices(conn)
+    elif escolha == '15':
+        criar_views_materializadas(conn)
+    elif escolha == '16':
+        caminho = input("Arquivo com as perguntas: ").strip()
+        saida = input("Arquivo de saída JSON lines (vazio para a tela): ").strip()
+        try:
+            text2sql_lote(caminho, saida or None)
+        except OSError as e:
+            print(f"Erro ao ler ou gravar arquivo: {e}")
+    elif escolha == '17':
+        exportar_graficos(conn)
+    elif escolha == '18':
+        disponibilidade(conn)
+    elif escolha == '19':
+        exportar_para_parquet(conn)
+    elif escolha == '20':
+        faturamento(conn)
+
+
+# Linha de comando e modo em lote
+
+class EscritorResultados:
+    """
+    Grava linhas de resultado em CSV (com cabeçalho) ou em JSON lines (um objeto
+    por linha, com as colunas como chaves). Tem o mesmo writerow do csv.writer,
+    então pode ser passado como `saida` para transmitir_sql e transmitir_tabela.
+    """
+
+    def __init__(self, arquivo, formato: str = 'csv'):
+        self.formato = formato
+        self.colunas = None
+        self._arquivo = arquivo
+        self._csv = csv.writer(arquivo) if formato == 'csv' else None
+
+    def cabecalho(self, colunas: list):
+        self.colunas = list(colunas)
+        if self._csv is not None:
+            self._csv.writerow(self.colunas)
+
+    def writerow(self, row):
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._arquivo.write(json.dumps(dict(zip(self.colunas, row)), ensure_ascii=False, default=str) + "\n")
+
+
+class _ColetorResultados:
+    def __init__(self):
+        self.colunas = None
+        self.linhas = []
+
+    def cabecalho(self, colunas: list):
+        self.colunas = list(colunas)
+
+    def writerow(self, row):
+        self.linhas.append(dict(zip(self.colunas, row)))
+
+
+def consultar(conn, escritor, alvo: Optional[str] = None, sql: Optional[str] = None,
+              limite: Optional[int] = None, deslocamento: int = 0, desfazer: bool = True,
+              periodo: Optional[tuple] = None) -> int:
+    """
+    Envia para `escritor` o resultado de um SELECT livre, de uma das consultas
+    analíticas (CONSULTA01 a CONSULTA03) ou de uma tabela inteira. Devolve o
+    número de linhas escritas. `periodo` (início, fim) restringe a CONSULTA03
+    pela data de entrada das reservas.
+    """
+    if sql is not None:
+        return transmitir_sql(conn, sql, saida=escritor, cabecalho=escritor.cabecalho, desfazer=desfazer)
+
+    nome = alvo.upper()
+    if nome in GRAFICOS:
+        periodo = periodo if nome == 'CONSULTA03' and periodo and any(periodo) else None
+        roteador = obter_roteador() if not periodo else None
+        if roteador is not None:
+            calculado = consulta_em_shards(roteador, nome)
+        else:
+            calculado = consulta_em_parquet(nome, periodo) if CONSULTAS_EM_PARQUET else None
+        if calculado is not None:
+            colunas, result = calculado
+            escritor.cabecalho(colunas)
+            for row in result:
+                escritor.writerow(row)
+            return len(result)
+
+        cur = conn.cursor()
+        try:
+            if periodo:
+                result = _periodo_consulta03(cur, *periodo)
+            else:
+                result = _resultado_consulta(conn, cur, nome, GRAFICOS[nome][0])
+            escritor.cabecalho([desc[0] for desc in cur.description])
+        finally:
+            cur.close()
+            if desfazer:
+                conn.rollback()
+        for row in result:
+            escritor.writerow(row)
+        return len(result)
+
+    if nome not in tables:
+        raise ValueError(f"Tabela ou consulta desconhecida: {alvo}")
+    escritor.cabecalho(_colunas_da_tabela(nome))
+    return transmitir_tabela(conn, nome, saida=escritor, limite=limite, deslocamento=deslocamento,
+                             desfazer=desfazer)
+
+
+CAMPOS_LOTE = ['linha', 'op', 'tabela', 'status', 'linhas', 'segundos', 'erro', 'resultado']
+
+
+def _tabela_da_operacao(operacao: dict) -> str:
+    name = str(operacao.get('tabela', '')).upper()
+    if name not in tables:
+        raise ValueError(f"Tabela desconhecida: {operacao.get('tabela')}")
+    return name
+
+
+def _escrita_do_lote(conn, operacao: dict) -> int:
+    """
+    Executa um insert/update/delete do lote sem confirmar a transação. Os
+    valores vêm como valores JSON; em `valores` também é aceita a tupla em
+    texto, como no menu.
+    """
+    op = operacao['op']
+    name = _tabela_da_operacao(operacao)
+    if op == 'insert':
+        return inserir_registro(conn, name, operacao['valores'], confirmar=False)
+    if op == 'update':
+        return atualizar_registro(conn, name, operacao['atributo'], operacao['valor'], operacao['chave'],
+                                  operacao['codigo'], confirmar=False)
+    return remover_registro(conn, name, operacao['chave'], operacao['codigo'], confirmar=False)
+
+
+def _barreira_do_lote(conn, operacao: dict):
+    """
+    Operações que confirmam por conta própria (DDL, cargas, Text2SQL e as
+    consultas analíticas) rodam fora do grupo de escritas. Devolve
+    (sucesso, linhas, resultado).
+    """
+    op = operacao['op']
+    if op == 'create':
+        return criar_todas_as_tabelas(conn), None, None
+    if op == 'drop':
+        return remover_todas_as_tabelas(conn), None, None
+    if op == 'load':
+        if operacao.get('escala') is not None:
+            return gerar_dados_sinteticos(conn, float(operacao['escala'])), None, None
+        return inserir_valores(conn), None, None
+    if op == 'text2sql':
+        if not GEMINI_API_KEY or not GEMINI_MODEL:
+            raise ValueError("GEMINI_API_KEY e GEMINI_MODEL precisam estar definidos no arquivo .env.")
+        import asyncio
+
+        resultado = asyncio.run(text2sql_lote_async([operacao['pergunta']], tables, 1))[0]
+        if resultado['erro']:
+            raise ValueError(resultado['erro'])
+        linhas = [dict(zip(resultado['colunas'], row)) for row in resultado['linhas']]
+        return True, len(linhas), {'sql': resultado['sql'], 'linhas': linhas, 'resumo': resultado['resumo']}
+    raise ValueError(f"Operação desconhecida: {op}")
+
+
+def _consulta_do_lote(conn, operacao: dict):
+    if operacao.get('saida'):
+        formato = operacao.get('formato') or ('jsonl' if operacao['saida'].endswith('.jsonl') else 'csv')
+        with open(operacao['saida'], 'w', newline='', encoding='utf-8') as arquivo:
+            total = consultar(conn, EscritorResultados(arquivo, formato), operacao.get('tabela'),
+                              operacao.get('sql'), operacao.get('limite'), operacao.get('deslocamento', 0),
+                              desfazer=False, periodo=(operacao.get('inicio'), operacao.get('fim')))
+        return total, {'saida': operacao['saida']}
+    coletor = _ColetorResultados()
+    total = consultar(conn, coletor, operacao.get('tabela'), operacao.get('sql'), operacao.get('limite'),
+                      operacao.get('deslocamento', 0), desfazer=False,
+                      periodo=(operacao.get('inicio'), operacao.get('fim')))
+    return total, coletor.linhas
+
+
+def executar_lote(conn, operacoes, escritor: EscritorResultados, por_transacao: int = 1000,
+                  parar_no_erro: bool = False) -> int:
+    """
+    Executa as operações (dicionários com a chave 'op') em uma única conexão.
+    Escritas e SELECTs consecutivos formam grupos de até `por_transacao`
+    operações (0 = sem limite) confirmados com um único COMMIT; se alguma
+    falhar, o grupo inteiro é desfeito. Cada operação gera um registro em
+    `escritor`, na ordem do arquivo. Devolve o número de operações com erro.
+    """
+    escritor.cabecalho(CAMPOS_LOTE)
+    pendentes = []
+    erros = 0
+
+    def emitir(registro):
+        registro['segundos'] = round(registro['segundos'], 6)
+        if escritor.formato == 'csv' and registro['resultado'] is not None:
+            registro['resultado'] = json.dumps(registro['resultado'], ensure_ascii=False, default=str)
+        escritor.writerow([registro[campo] for campo in CAMPOS_LOTE])
+
+    def desfazer_grupo(mensagem):
+        conn.rollback()
+        for registro in pendentes:
+            registro['status'] = 'desfeita'
+            registro['erro'] = mensagem
+            emitir(registro)
+        pendentes.clear()
+
+    def confirmar_grupo():
+        nonlocal erros
+        if not pendentes:
+            return
+        try:
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            for registro in pendentes:
+                registro['status'] = 'erro'
+                registro['erro'] = f"{e.pgcode}: {(e.pgerror or str(e)).strip()}"
+                emitir(registro)
+            erros += len(pendentes)
+            pendentes.clear()
+            return
+        for registro in pendentes:
+            emitir(registro)
+        pendentes.clear()
+
+    for numero, operacao in operacoes:
+        op = operacao.get('op')
+        registro = {'linha': numero, 'op': op, 'tabela': operacao.get('tabela'), 'status': 'ok',
+                    'linhas': None, 'segundos': 0.0, 'erro': None, 'resultado': None}
+        em_grupo = op in ('insert', 'update', 'delete') or (
+            op == 'query' and str(operacao.get('tabela', '')).upper() not in GRAFICOS)
+        if not em_grupo:
+            confirmar_grupo()
+
+        inicio = time.perf_counter()
+        try:
+            if 'erro_de_leitura' in operacao:
+                raise ValueError(operacao['erro_de_leitura'])
+            if op in ('insert', 'update', 'delete'):
+                registro['linhas'] = _escrita_do_lote(conn, operacao)
+            elif em_grupo:
+                registro['linhas'], registro['resultado'] = _consulta_do_lote(conn, operacao)
+            elif op == 'query':
+                registro['linhas'], registro['resultado'] = _consulta_do_lote(conn, operacao)
+                conn.rollback()
+            else:
+                sucesso, registro['linhas'], registro['resultado'] = _barreira_do_lote(conn, operacao)
+                if not sucesso:
+                    raise ValueError(f"Operação {op} falhou; detalhes na saída de erro")
+        except (psycopg2.Error, ValueError, KeyError, TypeError, OSError) as e:
+            registro['segundos'] = time.perf_counter() - inicio
+            registro['status'] = 'erro'
+            if isinstance(e, psycopg2.Error):
+                registro['erro'] = f"{e.pgcode}: {(e.pgerror or str(e)).strip()}"
+            elif isinstance(e, KeyError):
+                registro['erro'] = f"Campo obrigatório ausente: {e}"
+            else:
+                registro['erro'] = str(e)
+            erros += 1
+            desfazer_grupo(f"desfeita pelo erro na linha {numero}")
+            emitir(registro)
+            if parar_no_erro:
+                break
+            continue
+        registro['segundos'] = time.perf_counter() - inicio
+
+        if em_grupo:
+            pendentes.append(registro)
+            if por_transacao and len(pendentes) >= por_transacao:
+                confirmar_grupo()
+        else:
+            emitir(registro)
+
+    confirmar_grupo()
+    return erros
+
+
+def ler_operacoes(arquivo):
+    """Lê operações em JSON lines; linhas vazias e iniciadas com # são ignoradas."""
+    for numero, linha in enumerate(arquivo, start=1):
+        linha = linha.strip()
+        if not linha or linha.startswith('#'):
+            continue
+        try:
+            operacao = json.loads(linha)
+        except json.JSONDecodeError as e:
+            operacao = {'op': None, 'erro_de_leitura': str(e)}
+        if not isinstance(operacao, dict):
+            operacao = {'op': None, 'erro_de_leitura': "cada linha deve ser um objeto JSON"}
+        yield numero, operacao
+
+
+def criar_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="TrabalhoFinal.py",
+        description="Gerenciador do banco de dados hoteleiro. Sem argumentos abre o menu interativo.")
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    comandos.add_parser('create', help="cria todas as tabelas e índices")
+    comandos.add_parser('drop', help="remove todas as tabelas")
+
+    load = comandos.add_parser('load', help="insere os valores de exemplo ou gera dados sintéticos")
+    load.add_argument('--escala', type=float, help="gera dados sintéticos com este fator de escala")
+
+    insert_ = comandos.add_parser('insert', help="insere um registro")
+    insert_.add_argument('tabela')
+    insert_.add_argument('valores', help="tupla como no SQL, ex.: \"(101, 'ABC', 123)\"")
+
+    update_ = comandos.add_parser('update', help="atualiza um atributo pelo valor da chave")
+    update_.add_argument('tabela')
+    update_.add_argument('atributo')
+    update_.add_argument('valor', help="valor como escrito no SQL, ex.: 9.5 ou \"'Maria'\"")
+    update_.add_argument('chave', help="coluna da chave primária")
+    update_.add_argument('codigo', help="valor da chave primária")
+    update_.add_argument('--hotel', type=int, help="com SHARDS, envia só ao shard deste hotel")
+
+    delete_ = comandos.add_parser('delete', help="remove um registro pelo valor da chave")
+    delete_.add_argument('tabela')
+    delete_.add_argument('chave', help="coluna da chave primária")
+    delete_.add_argument('codigo', help="valor da chave primária")
+    delete_.add_argument('--hotel', type=int, help="com SHARDS, envia só ao shard deste hotel")
+
+    query = comandos.add_parser('query', help="exporta uma tabela, uma consulta analítica ou um SELECT")
+    query.add_argument('alvo', nargs='?', help="nome da tabela ou CONSULTA01 a CONSULTA03")
+    query.add_argument('--sql', help="SELECT a executar no lugar do alvo")
+    query.add_argument('--limite', type=int)
+    query.add_argument('--deslocamento', type=int, default=0)
+    query.add_argument('--inicio', help="CONSULTA03: primeira data de entrada (AAAA-MM-DD)")
+    query.add_argument('--fim', help="CONSULTA03: data de entrada limite, exclusiva (AAAA-MM-DD)")
+    query.add_argument('--formato', choices=('csv', 'jsonl'), default='csv')
+    query.add_argument('--saida', help="arquivo de saída (padrão: saída padrão)")
+
+    livres = comandos.add_parser('livres', help="quartos de um hotel sem reserva no intervalo")
+    livres.add_argument('hotel', type=int, help="código do hotel")
+    livres.add_argument('inicio', help="início do intervalo (AAAA-MM-DD ou AAAA-MM-DD HH:MM)")
+    livres.add_argument('fim', help="fim do intervalo, exclusivo")
+    livres.add_argument('--formato', choices=('csv', 'jsonl'), default='csv')
+    livres.add_argument('--saida', help="arquivo de saída (padrão: saída padrão)")
+
+    ocupacao = comandos.add_parser('ocupacao', help="calendário de ocupação por hotel e dia")
+    ocupacao.add_argument('inicio', help="primeiro dia da temporada (AAAA-MM-DD)")
+    ocupacao.add_argument('fim', help="dia seguinte ao último da temporada (AAAA-MM-DD)")
+    ocupacao.add_argument('--hotel', type=int, help="restringe a um hotel")
+    ocupacao.add_argument('--formato', choices=('csv', 'jsonl'), default='csv')
+    ocupacao.add_argument('--saida', help="arquivo de saída (padrão: saída padrão)")
+
+    conta = comandos.add_parser('conta', help="conta de saída de uma reserva (estadia + pedidos)")
+    conta.add_argument('reserva', type=int, help="código da reserva")
+
+    receita_ = comandos.add_parser('receita', help="receita dos pedidos por hotel, ou por dia com --inicio/--fim")
+    receita_.add_argument('--inicio', help="primeiro dia de entrada (AAAA-MM-DD)")
+    receita_.add_argument('--fim', help="dia de entrada limite, exclusivo (AAAA-MM-DD)")
+    receita_.add_argument('--hotel', type=int, help="restringe a um hotel")
+    receita_.add_argument('--formato', choices=('csv', 'jsonl'), default='csv')
+    receita_.add_argument('--saida', help="arquivo de saída (padrão: saída padrão)")
+
+    conciliar = comandos.add_parser('conciliar', help="confere os totais de faturamento com o recálculo completo")
+    conciliar.add_argument('--corrigir', action='store_true', help="reconstrói os totais se houver divergência")
+
+    shards = comandos.add_parser('shards', help="bancos por faixa de hotéis configurados em SHARDS")
+    shards.add_argument('acao', choices=('status', 'criar', 'distribuir'),
+                        help="status: linhas por shard; criar: cria as tabelas em cada shard; "
+                             "distribuir: copia os dados do banco principal para os shards")
+
+    parquet = comandos.add_parser('parquet', help="exporta as tabelas para arquivos Parquet")
+    parquet.add_argument('--dir', default=PARQUET_DIR, help=f"diretório de destino (padrão {PARQUET_DIR})")
+
+    text2sql_ = comandos.add_parser('text2sql', help="consulta em linguagem natural")
+    text2sql_.add_argument('pergunta', nargs='?')
+    text2sql_.add_argument('--arquivo', help="arquivo com uma pergunta por linha (modo em lote)")
+    text2sql_.add_argument('--saida', help="arquivo JSON lines do modo em lote")
+    text2sql_.add_argument('--concorrencia', type=int, default=TEXT2SQL_CONCORRENCIA)
+
+    batch = comandos.add_parser('batch', help="executa um arquivo JSON lines de operações")
+    batch.add_argument('arquivo', help="arquivo de operações ('-' para a entrada padrão)")
+    batch.add_argument('--saida', help="arquivo com um registro por operação (padrão: saída padrão)")
+    batch.add_argument('--formato', choices=('jsonl', 'csv'), default='jsonl')
+    batch.add_argument('--por-transacao', type=int, default=1000,
+                       help="operações por COMMIT (0 = uma única transação)")
+    batch.add_argument('--parar-no-erro', action='store_true')
+    return parser
+
+
+@contextmanager
+def _arquivo_de_saida(caminho: Optional[str]):
+    if not caminho or caminho == '-':
+        yield sys.stdout
+    else:
+        with open(caminho, 'w', newline='', encoding='utf-8') as arquivo:
+            yield arquivo
+
+
+def _executar_comando(conn, args) -> int:
+    comando = args.comando
+    if comando == 'create':
+        return 0 if criar_todas_as_tabelas(conn) else 1
+    if comando == 'drop':
+        return 0 if remover_todas_as_tabelas(conn) else 1
+    if comando == 'load':
+        if args.escala is not None:
+            return 0 if gerar_dados_sinteticos(conn, args.escala) else 1
+        return 0 if inserir_valores(conn) else 1
+
+    if comando in ('insert', 'update', 'delete'):
+        name = args.tabela.upper()
+        if name not in tables:
+            print(f"Tabela não encontrada: {args.tabela}", file=sys.stderr)
+            return 1
+        try:
+            if comando == 'insert':
+                linhas = inserir_registro(conn, name, args.valores)
+            elif comando == 'update':
+                linhas = atualizar_registro(conn, name, args.atributo, args.valor, args.chave, args.codigo,
+                                            id_hotel=args.hotel)
+            else:
+                linhas = remover_registro(conn, name, args.chave, args.codigo, id_hotel=args.hotel)
+        except psycopg2.Error as e:
+            print(f"Erro ao executar o {comando.upper()}", file=sys.stderr)
+            print(e.pgcode, file=sys.stderr)
+            print(e.pgerror, file=sys.stderr)
+            return 1
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f"{comando.upper()} {linhas}")
+        return 0
+
+    if comando == 'query':
+        if not args.alvo and not args.sql:
+            print("Informe a tabela/consulta ou --sql.", file=sys.stderr)
+            return 1
+        try:
+            with _arquivo_de_saida(args.saida) as arquivo:
+                # Mensagens dos auxiliares vão para stderr; stdout fica só com os dados
+                with redirect_stdout(sys.stderr):
+                    total = consultar(conn, EscritorResultados(arquivo, args.formato), args.alvo, args.sql,
+                                      args.limite, args.deslocamento, periodo=(args.inicio, args.fim))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        except psycopg2.Error as e:
+            print("Erro ao consultar", file=sys.stderr)
+            print(e.pgcode, file=sys.stderr)
+            print(e.pgerror, file=sys.stderr)
+            return 1
+        print(f"{total:,} linhas", file=sys.stderr)
+        return 0
+
+    if comando in ('livres', 'ocupacao'):
+        try:
+            if comando == 'livres':
+                colunas = ['id_quarto', 'no_quarto']
+                linhas = quartos_livres(conn, args.hotel, args.inicio, args.fim)
+            else:
+                colunas = ['id_hotel', 'dia', 'ocupados', 'quartos', 'taxa_ocupacao']
+                linhas = calendario_ocupacao(conn, args.inicio, args.fim, args.hotel)
+        except psycopg2.Error as e:
+            print("Erro ao consultar a disponibilidade", file=sys.stderr)
+            print(e.pgcode, file=sys.stderr)
+            print(e.pgerror, file=sys.stderr)
+            return 1
+        with _arquivo_de_saida(args.saida) as arquivo:
+            escritor = EscritorResultados(arquivo, args.formato)
+            escritor.cabecalho(colunas)
+            for linha in linhas:
+                escritor.writerow(linha)
+        print(f"{len(linhas):,} linhas", file=sys.stderr)
+        return 0
+
+    if comando in ('conta', 'receita', 'conciliar'):
+        try:
+            if comando == 'conta':
+                linha = conta_da_reserva(conn, args.reserva)
+                if linha is None:
+                    print(f"Reserva não encontrada: {args.reserva}", file=sys.stderr)
+                    return 1
+                print(json.dumps(dict(zip(['id_reserva', 'id_hotel', 'conta_estadia', 'total_pedidos',
+                                           'qtd_pedidos', 'total_a_pagar'], linha)), default=str))
+                return 0
+            if comando == 'conciliar':
+                divergencias = conciliar_faturamento(conn, args.corrigir)
+                for tabela, linhas in divergencias.items():
+                    print(f"{tabela}: {len(linhas)} divergências", file=sys.stderr)
+                    for linha in linhas[:10]:
+                        print(linha, file=sys.stderr)
+                # Código 1 avisa o agendador mesmo quando a correção foi feita
+                return 1 if any(divergencias.values()) else 0
+            linhas = receita(conn, args.inicio, args.fim, args.hotel)
+        except psycopg2.Error as e:
+            print("Erro ao consultar o faturamento", file=sys.stderr)
+            print(e.pgcode, file=sys.stderr)
+            print(e.pgerror, file=sys.stderr)
+            return 1
+        colunas = (['id_hotel', 'nome', 'dia', 'total_pedidos', 'qtd_pedidos'] if args.inicio or args.fim
+                   else ['id_hotel', 'nome', 'total_pedidos', 'qtd_pedidos'])
+        with _arquivo_de_saida(args.saida) as arquivo:
+            escritor = EscritorResultados(arquivo, args.formato)
+            escritor.cabecalho(colunas)
+            for linha in linhas:
+                escritor.writerow(linha)
+        print(f"{len(linhas):,} linhas", file=sys.stderr)
+        return 0
+
+    if comando == 'shards':
+        try:
+            roteador = obter_roteador()
+            if roteador is None:
+                print("Defina SHARDS com as faixas de hotéis, ex.: 1-50=dbname=hotel_a;51-100=dbname=hotel_b",
+                      file=sys.stderr)
+                return 1
+            if args.acao == 'criar':
+                criados = True
+                with redirect_stdout(sys.stderr):
+                    for shard in roteador.shards:
+                        print(f"Shard {shard.nome} (hotéis {shard.inicio} a {shard.fim}):")
+                        with shard.pool.conexao() as conn_shard:
+                            criados = criar_todas_as_tabelas(conn_shard) and criados
+                return 0 if criados else 1
+            if args.acao == 'distribuir':
+                inicio = time.perf_counter()
+                contagens = distribuir_para_shards(roteador, obter_pool())
+                for shard, contagem in zip(roteador.shards, contagens):
+                    print(f"{shard.nome}: {sum(contagem.values()):,} linhas (hotéis {shard.inicio} a {shard.fim})",
+                          file=sys.stderr)
+                print(f"Distribuição concluída em {time.perf_counter() - inicio:.1f}s", file=sys.stderr)
+                return 0
+            print("shard\thoteis\treservas\tpedidos")
+            for shard, (hoteis, reservas, pedidos) in zip(roteador.shards, _contagem_nos_shards(roteador)):
+                print(f"{shard.nome} [{shard.inicio}-{shard.fim}]\t{hoteis}\t{reservas}\t{pedidos}")
+            return 0
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        except psycopg2.Error as e:
+            print("Erro nos shards", file=sys.stderr)
+            print(e.pgcode, file=sys.stderr)
+            print(e.pgerror, file=sys.stderr)
+            return 1
+
+    if comando == 'parquet':
+        try:
+            with redirect_stdout(sys.stderr):
+                linhas = exportar_parquet(conn, args.dir)
+        except psycopg2.Error as e:
+            print("Erro ao exportar as tabelas", file=sys.stderr)
+            print(e.pgcode, file=sys.stderr)
+            print(e.pgerror, file=sys.stderr)
+            return 1
+        except OSError as e:
+            print(f"Erro ao gravar os arquivos Parquet: {e}", file=sys.stderr)
+            return 1
+        print(f"{sum(linhas.values()):,} linhas exportadas para {args.dir}", file=sys.stderr)
+        return 0
+
+    if comando == 'text2sql':
+        if args.arquivo:
+            text2sql_lote(args.arquivo, args.saida, args.concorrencia)
+        elif args.pergunta:
+            text2sql(conn, GEMINI_API_KEY, GEMINI_MODEL, tables, consulta=args.pergunta)
+        else:
+            print("Informe a pergunta ou --arquivo.", file=sys.stderr)
+            return 1
+        return 0
+
+    if comando == 'batch':
+        entrada = sys.stdin if args.arquivo == '-' else open(args.arquivo, encoding='utf-8')
+        try:
+            with _arquivo_de_saida(args.saida) as arquivo, redirect_stdout(sys.stderr):
+                inicio = time.perf_counter()
+                erros = executar_lote(conn, ler_operacoes(entrada), EscritorResultados(arquivo, args.formato),
+                                      args.por_transacao, args.parar_no_erro)
+                print(f"Lote concluído em {time.perf_counter() - inicio:.2f}s, {erros} operações com erro")
+        finally:
+            if entrada is not sys.stdin:
+                entrada.close()
+        return 1 if erros else 0
+    return 1
+
+
+def encerrar_sessao(arquivo=None):
+    """Imprime o resumo das métricas da sessão e atualiza o arquivo do Prometheus."""
+    if not INSTRUMENTAR_CONSULTAS:
+        return
+    print(metricas.resumo(), file=arquivo or sys.stdout)
+    metricas.exportar_prometheus()
+
+
+def executar_linha_de_comando(argv: list) -> int:
+    args = criar_parser().parse_args(argv)
+    try:
+        pool = obter_pool()
+    except psycopg2.Error as e:
+        print("Erro encontrado no banco de dados", file=sys.stderr)
+        print(e.pgcode, file=sys.stderr)
+        print(e.pgerror, file=sys.stderr)
+        return 2
+    try:
+        with pool.conexao() as conn:
+            if args.comando not in ('create', 'drop'):
+                with redirect_stdout(sys.stderr):
+                    garantir_particoes_futuras(conn)
+            if args.comando in COMANDOS_DE_LEITURA:
+                with conexao_de_leitura(conn) as conn_leitura:
+                    return _executar_comando(conn_leitura, args)
+            return _executar_comando(conn, args)
+    finally:
+        pool.fechar()
+        fechar_roteador()
+        fechar_replicas()
+        encerrar_sessao(sys.stderr)
+
+
+def main(argv: Optional[list] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        sys.exit(executar_linha_de_comando(argv))
+
     try:
-        conn = conectar_banco()
+        pool = obter_pool()
+        with pool.conexao() as conn:
+            print("Conexão com o banco bem sucedida!")
+            print(f"PostgreSQL versão: {_versao_servidor(conn)}")
+            garantir_particoes_futuras(conn)
     except psycopg2.Error as e:
         print("Erro encontrado no banco de dados")
         print(e.pgcode)
@@ -768,7 +5444,12 @@ def main():
         print(f"Erro inesperado ao conectar: {e}")
         return
 
-    opcoes_validas = {str(i) for i in range(13)}  # '0' a '12'
+    opcoes_validas = {str(i) for i in range(21)}  # '0' a '20'
+
+    agendador = None
+    if USAR_VIEWS_MATERIALIZADAS and INTERVALO_REFRESH_MV > 0:
+        agendador = AgendadorRefresh(pool)
+        agendador.start()
 
     try:
         while True:
@@ -778,38 +5459,27 @@ def main():
                 continue
 
             if escolha == '0':
+                if agendador is not None:
+                    agendador.parar()
                 print("Conexão com o banco de dados encerrada")
                 break
 
-            if escolha == '1':
-                criar_todas_as_tabelas(conn)
-            elif escolha == '2':
-                inserir_valores(conn)
-            elif escolha == '3':
-                insert(conn)
-            elif escolha == '4':
-                update(conn)
-            elif escolha == '5':
-                delete(conn)
-            elif escolha == '6':
-                consulta01(conn)
-            elif escolha == '7':
-                consulta02(conn)
-            elif escolha == '8':
-                consulta03(conn)
-            elif escolha == '9':
-                consulta_individual(conn)
-            elif escolha == '10':
-                text2sql(conn, GEMINI_API_KEY, GEMINI_MODEL, tables)
-            elif escolha == '11':
-                remover_todas_as_tabelas(conn)
-            elif escolha == '12':
-                listar_tabelas_definidas()
-
-        conn.close()
+            with pool.conexao() as conn:
+                if escolha in OPCOES_DE_LEITURA:
+                    with conexao_de_leitura(conn) as conn_leitura:
+                        executar_opcao(conn_leitura, escolha)
+                else:
+                    executar_opcao(conn, escolha)
+            if INSTRUMENTAR_CONSULTAS:
+                metricas.exportar_prometheus()
+
+        pool.fechar()
     except Exception as e:
         print(f"Erro inesperado em tempo de execução: {e}")
-        conn.close()
+        pool.fechar()
+    fechar_roteador()
+    fechar_replicas()
+    encerrar_sessao()
 
 
 if __name__ == "__main__":
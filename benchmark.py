@@ -0,0 +1,723 @@
+"""
+Benchmark reprodutível do TrabalhoFinal.py.
+
+Para cada fator de escala o script recria as tabelas em um banco PostgreSQL
+local dedicado, carrega os dados sintéticos e mede:
+
+* criação do esquema e carga em massa;
+* vazão e latência de insert/update/delete, uma linha por chamada e em lote;
+* latência (p50/p95/p99) das consultas analíticas 01 a 03;
+* leitura em streaming de tabelas grandes (consulta individual);
+* Text2SQL completo contra um servidor local que imita a API do Gemini;
+* recuperação dos exemplos validados do Text2SQL (o par certo entre os k
+  mais parecidos) e, como verificação do encadeamento, as respostas com e sem
+  exemplos no prompt;
+* acerto e velocidade da extração do SQL sobre um corpus de respostas do modelo;
+* decisões da validação do SQL gerado sobre um corpus de consultas aceitas e recusadas;
+* leitura das tuplas digitadas como no SQL (aspas dobradas, NULL, barras);
+* tempo de inicialização (import do módulo, medido com -X importtime).
+
+O resultado é gravado em JSON. Com --comparar, cada métrica é comparada com
+um JSON anterior e as regressões acima da tolerância são apontadas.
+
+Uso:
+    python benchmark.py --escalas 0.01,0.1 --saida benchmark.json
+    python benchmark.py --escalas 0.1 --comparar benchmark_anterior.json
+"""
+import os
+import io
+import re
+import csv
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from datetime import datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+
+import TrabalhoFinal as T
+
+
+# Servidor local que imita o endpoint generateContent do Gemini
+
+PERGUNTAS_STUB = {
+    "Quais hóspedes gastaram mais com pedidos extras?":
+        "SELECT h.nome AS hospede, SUM(p.valor) AS total FROM hospede h JOIN pedido p ON p.id_reserva = h.id_reserva "
+        "GROUP BY h.nome ORDER BY total DESC LIMIT 10",
+    "Qual a receita de cada hotel?":
+        "SELECT ho.nome AS hotel, SUM(r.conta) AS receita FROM reserva r JOIN hotel ho ON ho.id_hotel = r.id_hotel "
+        "GROUP BY ho.nome ORDER BY receita DESC",
+    "Quantos veículos estão estacionados em cada hotel?":
+        "SELECT v.id_hotel AS hotel, COUNT(*) AS veiculos FROM veiculo v GROUP BY v.id_hotel ORDER BY v.id_hotel",
+}
+
+
+class _ModeloStub(BaseHTTPRequestHandler):
+    """
+    Responde as PERGUNTAS_STUB com o SQL certo. Para as demais imita o que um
+    modelo faz com exemplos no prompt: reaproveita o SQL do primeiro (o mais
+    parecido); sem exemplos, responde um SELECT que executa mas não responde
+    a pergunta.
+    """
+    latencia = 0.0
+
+    def do_POST(self):
+        corpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        prompt = corpo['contents'][0]['parts'][0]['text']
+        if 'Linhas retornadas' in prompt:
+            texto = "Os resultados mostram os valores agregados pedidos na consulta."
+        else:
+            pergunta = re.search(r'natural language: "(.*)"\.', prompt).group(1)
+            exemplo = re.search(r"\nSQL:\n(.*?)\n\n(?:Question: |Your task)", prompt, re.S)
+            sql = PERGUNTAS_STUB.get(pergunta) or (exemplo.group(1) if exemplo else "SELECT 1 AS resultado")
+            explicacao = "A consulta usa as tabelas citadas na pergunta."
+            if corpo.get('generationConfig', {}).get('responseMimeType') == 'application/json':
+                texto = json.dumps({'explicacao': explicacao, 'sql': sql}, ensure_ascii=False)
+            else:
+                texto = f"{explicacao}\n{sql}"
+        if ':streamGenerateContent' in self.path:
+            self._responder_em_streaming(texto)
+            return
+        time.sleep(self.latencia)
+        resposta = json.dumps(self._candidato(texto)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(resposta)))
+        self.end_headers()
+        self.wfile.write(resposta)
+
+    @staticmethod
+    def _candidato(texto, fim='STOP'):
+        candidato = {'content': {'role': 'model', 'parts': [{'text': texto}]}, 'index': 0}
+        if fim:
+            candidato['finishReason'] = fim
+        return {'candidates': [candidato]}
+
+    def _responder_em_streaming(self, texto):
+        # Server-sent events: a latência total é distribuída entre os pedaços, como num modelo real
+        pedacos = [texto[i:i + 16] for i in range(0, len(texto), 16)] or ['']
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        try:
+            for i, pedaco in enumerate(pedacos):
+                time.sleep(self.latencia / len(pedacos))
+                evento = self._candidato(pedaco, 'STOP' if i == len(pedacos) - 1 else None)
+                self.wfile.write(f"data: {json.dumps(evento)}\r\n\r\n".encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # o cliente abandonou o stream assim que recebeu o SQL
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_modelo_stub(latencia: float) -> ThreadingHTTPServer:
+    handler = type('ModeloStub', (_ModeloStub,), {'latencia': latencia})
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+# Medição
+
+def percentis(amostras: list) -> dict:
+    ordenadas = sorted(amostras)
+    if len(ordenadas) == 1:
+        p50 = p95 = p99 = ordenadas[0]
+    else:
+        cortes = statistics.quantiles(ordenadas, n=100, method='inclusive')
+        p50, p95, p99 = cortes[49], cortes[94], cortes[98]
+    return {'n': len(ordenadas), 'p50_ms': round(p50 * 1000, 3), 'p95_ms': round(p95 * 1000, 3),
+            'p99_ms': round(p99 * 1000, 3), 'media_ms': round(statistics.fmean(ordenadas) * 1000, 3)}
+
+
+def cronometrar(funcao) -> float:
+    inicio = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        funcao()
+    return time.perf_counter() - inicio
+
+
+def amostrar(funcao, repeticoes: int) -> list:
+    return [cronometrar(funcao) for _ in range(repeticoes)]
+
+
+def provisionar_banco(nome: str):
+    params = T._parametros_conexao()
+    params['dbname'] = 'postgres'
+    conn = psycopg2.connect(**params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (nome,))
+    if cur.fetchone() is None:
+        cur.execute(f'CREATE DATABASE "{nome}" ENCODING \'UTF8\' TEMPLATE template0')
+    conn.close()
+
+
+def _analisar(conn):
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE")
+    conn.autocommit = False
+
+
+def _pedido(id_pedido: int) -> tuple:
+    linha = (id_pedido, 8.0, 1, 1, 1, 1)
+    # No esquema particionado (PARTICIONAR_RESERVAS=1) o pedido leva a data_entrada da reserva 1
+    if 'data_entrada' in T._colunas_da_tabela('PEDIDO'):
+        return linha + (T.GeradorDados().reserva(1)[1],)
+    return linha
+
+
+def medir_crud(conn, operacoes: int) -> dict:
+    base = 2_000_000_000 - operacoes
+    resultados = {}
+    etapas = {
+        'insert': lambda i: T.inserir_registro(conn, 'PEDIDO', _pedido(base + i)),
+        'update': lambda i: T.atualizar_registro(conn, 'PEDIDO', 'valor', 9.5, 'id_pedido', base + i),
+        'delete': lambda i: T.remover_registro(conn, 'PEDIDO', 'id_pedido', base + i),
+    }
+    for etapa, funcao in etapas.items():
+        amostras = []
+        inicio = time.perf_counter()
+        for i in range(operacoes):
+            t0 = time.perf_counter()
+            funcao(i)
+            amostras.append(time.perf_counter() - t0)
+        decorrido = time.perf_counter() - inicio
+        resultados[etapa] = dict(percentis(amostras), operacoes_por_s=round(operacoes / decorrido, 1))
+    return resultados
+
+
+def medir_crud_em_lote(conn, linhas: int) -> dict:
+    """Mesmas escritas de medir_crud, mas todas as linhas em uma chamada (execute_values paginado)."""
+    base = 2_000_000_000 - linhas
+    etapas = {
+        'insert': lambda: T.inserir_linhas(conn, 'PEDIDO', [_pedido(base + i) for i in range(linhas)]),
+        'update': lambda: T.atualizar_linhas(conn, 'PEDIDO', 'valor', [(9.5, base + i) for i in range(linhas)]),
+        'delete': lambda: T.remover_linhas(conn, 'PEDIDO', [base + i for i in range(linhas)]),
+    }
+    resultados = {}
+    for etapa, funcao in etapas.items():
+        decorrido = cronometrar(funcao)
+        resultados[etapa] = {'linhas': linhas, 'segundos': round(decorrido, 3),
+                             'linhas_por_s': round(linhas / decorrido, 1)}
+    return resultados
+
+
+def medir_consultas(conn, repeticoes: int) -> dict:
+    resultados = {}
+    for nome, sql in (('consulta01', T.CONSULTA01_SQL), ('consulta02', T.CONSULTA02_SQL),
+                      ('consulta03', T.CONSULTA03_SQL)):
+        def executar(sql=sql):
+            with conn.cursor() as cur:
+                cur.execute(sql)
+                cur.fetchall()
+            conn.rollback()
+        executar()  # aquecimento do cache do servidor
+        resultados[nome] = percentis(amostrar(executar, repeticoes))
+    return resultados
+
+
+def medir_consultas_parquet(conn, repeticoes: int) -> dict:
+    """Mesmas consultas de medir_consultas, vetorizadas sobre uma exportação Parquet feita agora."""
+    with tempfile.TemporaryDirectory() as temporario:
+        diretorio = os.path.join(temporario, 'parquet')
+        inicio = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            linhas = T.exportar_parquet(conn, diretorio)
+        segundos = time.perf_counter() - inicio
+        resultados = {'exportacao': {'linhas': sum(linhas.values()), 'segundos': round(segundos, 3),
+                                     'linhas_por_s': round(sum(linhas.values()) / segundos, 1)}}
+        for nome in T.CONSULTAS_VETORIZADAS:
+            def executar(nome=nome):
+                T.consulta_em_parquet(nome, diretorio=diretorio)
+            cronometrar(executar)  # aquecimento do cache de arquivos e dos imports
+            resultados[nome.lower()] = percentis(amostrar(executar, repeticoes))
+    return resultados
+
+
+def medir_faturamento(conn, repeticoes: int) -> dict:
+    # Leituras pelas tabelas de totais contra a receita recalculada a partir de pedido
+    with conn.cursor() as cur:
+        cur.execute("SELECT id_reserva FROM conta_reserva ORDER BY id_reserva LIMIT 1")
+        linha = cur.fetchone()
+    conn.rollback()
+    if linha is None:
+        return {}
+
+    def recalcular():
+        with conn.cursor() as cur:
+            cur.execute("SELECT id_hotel, SUM(valor), COUNT(*) FROM pedido GROUP BY id_hotel")
+            cur.fetchall()
+        conn.rollback()
+
+    return {'conta_da_reserva': percentis(amostrar(lambda: T.conta_da_reserva(conn, linha[0]), repeticoes)),
+            'receita_por_hotel': percentis(amostrar(lambda: T.receita(conn), repeticoes)),
+            'receita_recalculada': percentis(amostrar(recalcular, repeticoes)),
+            'conciliacao_s': round(cronometrar(lambda: T.conciliar_faturamento(conn)), 3)}
+
+
+def medir_consulta_individual(conn, tabelas: list) -> dict:
+    resultados = {}
+    with open(os.devnull, 'w', newline='') as nulo:
+        writer = csv.writer(nulo)
+        for table_name in tabelas:
+            inicio = time.perf_counter()
+            total = T.transmitir_tabela(conn, table_name, saida=writer)
+            decorrido = time.perf_counter() - inicio
+            resultados[table_name.lower()] = {'linhas': total, 'segundos': round(decorrido, 3),
+                                              'linhas_por_s': round(total / max(decorrido, 1e-9), 1)}
+    return resultados
+
+
+class _SaidaCronometrada(io.StringIO):
+    """Marca o instante do primeiro texto do modelo impresso depois do cabeçalho da resposta."""
+
+    def __init__(self):
+        super().__init__()
+        self.cabecalho = False
+        self.primeira_saida = None
+
+    def write(self, texto):
+        if self.cabecalho and self.primeira_saida is None and texto.strip():
+            self.primeira_saida = time.perf_counter()
+        if 'Resposta' in texto and 'do modelo' in texto:
+            self.cabecalho = True
+        return super().write(texto)
+
+
+def cronometrar_primeira_saida(funcao) -> tuple:
+    saida = _SaidaCronometrada()
+    inicio = time.perf_counter()
+    with redirect_stdout(saida):
+        funcao()
+    fim = time.perf_counter()
+    return (saida.primeira_saida or fim) - inicio, fim - inicio
+
+
+def medir_text2sql(conn, repeticoes: int) -> dict:
+    resultados = {}
+    for pergunta in PERGUNTAS_STUB:
+        resultados[pergunta] = percentis(amostrar(
+            lambda: T.text2sql(conn, 'stub', 'stub-model', T.tables, consulta=pergunta), repeticoes))
+        primeira = [cronometrar_primeira_saida(
+            lambda: T.text2sql(conn, 'stub', 'stub-model', T.tables, consulta=pergunta))[0]
+            for _ in range(repeticoes)]
+        resultados[pergunta]['primeira_saida'] = percentis(primeira)
+    return resultados
+
+
+# Intenções do benchmark de exemplos: o SQL de referência, a pergunta já
+# respondida antes (guardada como exemplo validado) e as reformulações que o
+# usuário tenta, em ordem, até receber a resposta certa
+INTENCOES_EXEMPLOS = [
+    ("SELECT ho.nome AS hotel, SUM(r.conta) AS receita FROM reserva r JOIN hotel ho ON ho.id_hotel = r.id_hotel "
+     "GROUP BY ho.nome",
+     "Qual a receita de cada hotel?",
+     ["Receita total por hotel", "Quanto cada hotel faturou com as reservas?"]),
+    ("SELECT v.id_hotel AS hotel, COUNT(*) AS veiculos FROM veiculo v GROUP BY v.id_hotel",
+     "Quantos veículos estão estacionados em cada hotel?",
+     ["Número de carros por hotel", "Quantos automóveis cada hotel tem no estacionamento?"]),
+    ("SELECT f.id_hotel AS hotel, f.tipo, COUNT(*) AS funcionarios FROM funcionario f GROUP BY f.id_hotel, f.tipo",
+     "Quantos funcionários de cada tipo trabalham em cada hotel?",
+     ["Quantos funcionarios cada hotel tem por tipo?", "Distribuição dos empregados por função em cada hotel"]),
+    ("SELECT i.nome AS item, COUNT(*) AS pedidos FROM pedido p JOIN item i ON i.id_item = p.id_item GROUP BY i.nome",
+     "Qual o item mais pedido?",
+     ["Qual item foi mais vendido?", "Quais produtos aparecem em mais pedidos?"]),
+    ("SELECT r.id_hotel AS hotel, AVG(EXTRACT(DAY FROM r.data_saida - r.data_entrada)) AS media_dias "
+     "FROM reserva r GROUP BY r.id_hotel",
+     "Qual a média de dias de estadia por hotel?",
+     ["Duração média das estadias em cada hotel", "Quantos dias em média os hóspedes ficam em cada hotel?"]),
+    ("SELECT a.especie, COUNT(*) AS animais FROM animal_estimacao a GROUP BY a.especie",
+     "Quantos animais de estimação há de cada espécie?",
+     ["Número de pets por espécie", "Quais espécies de animais os hóspedes trazem e quantos de cada?"]),
+]
+
+
+def _linhas_comparaveis(linhas) -> list:
+    return sorted((tuple(round(float(v), 6) if isinstance(v, (int, float, Decimal)) else v for v in linha)
+                   for linha in linhas), key=repr)
+
+
+def medir_text2sql_exemplos(conn) -> dict:
+    """
+    Mede a recuperação dos exemplos: com as perguntas já validadas guardadas,
+    cada reformulação busca os k exemplos mais parecidos e conta se o par da
+    sua intenção veio em primeiro lugar (acerto_top1) ou entre os k
+    (acerto_top_k).
+
+    Em seguida, uma verificação do encadeamento com o servidor local: o
+    usuário pergunta as reformulações em ordem até a resposta bater com a do
+    SQL de referência, sem exemplos no prompt e com os k mais parecidos. O stub
+    copia o SQL do primeiro exemplo, então esses números só confirmam que os
+    exemplos chegam ao prompt e que o SQL deles executa; a qualidade está na
+    recuperação.
+    """
+    import asyncio
+
+    esperados = []
+    with conn.cursor() as cur:
+        for sql, _, _ in INTENCOES_EXEMPLOS:
+            cur.execute(sql)
+            esperados.append(_linhas_comparaveis(cur.fetchall()))
+    conn.rollback()
+
+    resultados = {}
+    k_configurado = T.TEXT2SQL_EXEMPLOS_K
+    with tempfile.TemporaryDirectory() as diretorio:
+        exemplos = T.ExemplosText2SQL(os.path.join(diretorio, 'exemplos.sqlite3'),
+                                      T.impressao_digital_esquema(T.tables))
+        for sql, semente, _ in INTENCOES_EXEMPLOS:
+            exemplos.guardar(semente, sql)
+        consultas, top1, top_k = 0, 0, 0
+        for sql, _, reformulacoes in INTENCOES_EXEMPLOS:
+            for pergunta in reformulacoes:
+                recuperados = [sql_exemplo for _, sql_exemplo, _ in exemplos.semelhantes(pergunta, k_configurado)]
+                consultas += 1
+                top1 += recuperados[:1] == [sql]
+                top_k += sql in recuperados
+    resultados['recuperacao'] = {
+        'k': k_configurado, 'consultas': consultas,
+        'acerto_top1': round(top1 / consultas, 3), 'acerto_top_k': round(top_k / consultas, 3),
+    }
+    for modo, k in (('sem_exemplos', 0), ('com_exemplos', k_configurado)):
+        with tempfile.TemporaryDirectory() as diretorio:
+            T.TEXT2SQL_EXEMPLOS = os.path.join(diretorio, 'exemplos.sqlite3')
+            T.TEXT2SQL_EXEMPLOS_K = k
+            T._exemplos_text2sql.clear()
+            exemplos = T.obter_exemplos_text2sql(T.tables)
+            for sql, semente, _ in INTENCOES_EXEMPLOS:
+                exemplos.guardar(semente, sql)
+            primeira, respondidas, chamadas = 0, 0, 0
+            for (_, _, reformulacoes), esperado in zip(INTENCOES_EXEMPLOS, esperados):
+                for tentativa, pergunta in enumerate(reformulacoes, start=1):
+                    with redirect_stdout(io.StringIO()):
+                        resultado = asyncio.run(T.text2sql_lote_async([pergunta], T.tables, 1))[0]
+                    chamadas += 1
+                    if resultado['erro'] is None and _linhas_comparaveis(resultado['linhas']) == esperado:
+                        respondidas += 1
+                        primeira += tentativa == 1
+                        break
+        resultados[modo] = {
+            'k': k, 'intencoes': len(INTENCOES_EXEMPLOS), 'respondidas': respondidas,
+            'acerto_primeira_tentativa': round(primeira / len(INTENCOES_EXEMPLOS), 3),
+            'chamadas_modelo': chamadas,
+            'chamadas_por_resposta': round(chamadas / respondidas, 2) if respondidas else None,
+        }
+    T.TEXT2SQL_EXEMPLOS, T.TEXT2SQL_EXEMPLOS_K = '', k_configurado
+    T._exemplos_text2sql.clear()
+    return resultados
+
+
+# Respostas do modelo e o SQL que deve ser extraído de cada uma (None: nenhum)
+CORPUS_EXTRACAO = [
+    ("Explicação: a tabela hotel tem os nomes.\nSELECT h.nome FROM hotel h",
+     "SELECT h.nome FROM hotel h"),
+    ("Juntamos hotel e quarto pela chave id_hotel.\nSELECT h.nome,\n       COUNT(q.id_quarto) AS quartos\n"
+     "FROM hotel h\nJOIN quarto q ON q.id_hotel = h.id_hotel\nGROUP BY h.nome",
+     "SELECT h.nome,\n       COUNT(q.id_quarto) AS quartos\nFROM hotel h\nJOIN quarto q ON q.id_hotel = h.id_hotel\n"
+     "GROUP BY h.nome"),
+    ("A consulta agrupa sem filtros, without where.\nSELECT id_hotel, COUNT(*) AS reservas FROM reserva GROUP BY id_hotel",
+     "SELECT id_hotel, COUNT(*) AS reservas FROM reserva GROUP BY id_hotel"),
+    ("```sql\nSELECT nome\nFROM plano\nORDER BY nome;\n```", "SELECT nome\nFROM plano\nORDER BY nome"),
+    ("Segue a consulta:\n```\nWITH gastos AS (\n  SELECT id_reserva, SUM(valor) AS total FROM pedido GROUP BY id_reserva\n)\n"
+     "SELECT AVG(total) AS media FROM gastos\n```\nEla calcula a média.",
+     "WITH gastos AS (\n  SELECT id_reserva, SUM(valor) AS total FROM pedido GROUP BY id_reserva\n)\n"
+     "SELECT AVG(total) AS media FROM gastos"),
+    ('{"explicacao": "Soma das contas por hotel.", "sql": "SELECT id_hotel, SUM(conta) AS receita FROM reserva '
+     'GROUP BY id_hotel"}', "SELECT id_hotel, SUM(conta) AS receita FROM reserva GROUP BY id_hotel"),
+    ('```json\n{"explicacao": "Lista de itens.", "sql": "SELECT nome, valor FROM item ORDER BY valor DESC"}\n```',
+     "SELECT nome, valor FROM item ORDER BY valor DESC"),
+    ("A consulta final é: SELECT nome FROM hotel WHERE nome = 'D''Ávila'",
+     "SELECT nome FROM hotel WHERE nome = 'D''Ávila'"),
+    ("SELECT nome FROM hospede\nEssa consulta lista todos os hóspedes.", "SELECT nome FROM hospede"),
+    ("Primeiro pensei em SELECT * FROM hotel, mas a correta é:\nSELECT nome FROM hotel ORDER BY nome",
+     "SELECT nome FROM hotel ORDER BY nome"),
+    ("Rascunho:\nSELECT COUNT(*) FROM veiculo\n\nVersão final:\nSELECT id_hotel, COUNT(*) AS veiculos FROM veiculo "
+     "GROUP BY id_hotel", "SELECT id_hotel, COUNT(*) AS veiculos FROM veiculo GROUP BY id_hotel"),
+    ("SELECT r.id_reserva, -- reserva\n       r.conta /* valor */\nFROM reserva r\nWHERE r.conta > 100;",
+     "SELECT r.id_reserva, -- reserva\n       r.conta /* valor */\nFROM reserva r\nWHERE r.conta > 100"),
+    ("Selecionamos a tabela hotel with cuidado, mas não há dados suficientes.", None),
+    ("Não é possível responder com as tabelas disponíveis.", None),
+    ("select nome from funcionario where cargo = 'Cozinheiro'", "select nome from funcionario where cargo = 'Cozinheiro'"),
+    ("Consulta:\n  SELECT h.nome\n  FROM hotel h\n  WHERE h.id_hotel IN (\n    SELECT id_hotel FROM quarto\n  )\n"
+     "Ela devolve hotéis com quartos.",
+     "SELECT h.nome\n  FROM hotel h\n  WHERE h.id_hotel IN (\n    SELECT id_hotel FROM quarto\n  )"),
+    ("Usamos a função EXTRACT.\nSELECT EXTRACT(DAY FROM (data_saida - data_entrada)) AS dias FROM reserva",
+     "SELECT EXTRACT(DAY FROM (data_saida - data_entrada)) AS dias FROM reserva"),
+    ("A resposta:\n```sql\nSELECT nome FROM hotel\n", "SELECT nome FROM hotel"),
+]
+
+
+def _normalizar_espacos(sql):
+    return " ".join(sql.split()) if sql else sql
+
+
+def medir_extracao_sql(repeticoes: int) -> dict:
+    falhas = [indice for indice, (resposta, esperado) in enumerate(CORPUS_EXTRACAO)
+              if _normalizar_espacos(T._extrair_sql_da_resposta(resposta)) != _normalizar_espacos(esperado)]
+    voltas = max(repeticoes, 1) * 10
+    inicio = time.perf_counter()
+    for _ in range(voltas):
+        for resposta, _ in CORPUS_EXTRACAO:
+            T._extrair_sql_da_resposta(resposta)
+    decorrido = time.perf_counter() - inicio
+    extracoes = voltas * len(CORPUS_EXTRACAO)
+    return {'casos': len(CORPUS_EXTRACAO), 'acertos': len(CORPUS_EXTRACAO) - len(falhas), 'falhas': falhas,
+            'extracao_media_ms': round(1000 * decorrido / extracoes, 4),
+            'extracoes_por_s': round(extracoes / decorrido, 1)}
+
+
+# SQL que o modelo poderia gerar e se a validação deve aceitá-lo
+CORPUS_VALIDACAO = [
+    ("SELECT h.nome FROM hotel h", True),
+    ("SELECT nome FROM hotel WHERE nome = 'D''Ávila'", True),
+    ("SELECT E'D\\'Ávila' AS nome FROM hotel", True),
+    ("WITH gastos AS (SELECT id_reserva, SUM(valor) AS total FROM pedido GROUP BY id_reserva) "
+     "SELECT AVG(total) FROM gastos", True),
+    ("SELECT id_hotel, SUM(conta) OVER w AS acumulado FROM reserva "
+     "WINDOW w AS (PARTITION BY id_hotel ORDER BY data_entrada)", True),
+    ("SELECT id_hotel, SUM(conta) OVER w AS acumulado FROM reserva", False),
+    ("SELECT nome FROM tabela_inexistente", False),
+    ("DELETE FROM pedido", False),
+    ("SELECT nome FROM hotel; DELETE FROM pedido", False),
+    # Em E'...' a barra escapa a aspa: a string não fecha antes do COMMIT
+    ("SELECT E'\\''; COMMIT; DELETE FROM pedido; --'", False),
+    ("SELECT $$; DELETE FROM pedido; $$ AS x FROM hotel", False),
+    ("SELECT pg_sleep(10)", False),
+]
+
+
+def medir_validacao_sql() -> dict:
+    falhas = []
+    for indice, (sql, aceito) in enumerate(CORPUS_VALIDACAO):
+        try:
+            T.validar_sql_gerado(sql)
+            passou = True
+        except ValueError:
+            passou = False
+        if passou != aceito:
+            falhas.append(indice)
+    return {'casos': len(CORPUS_VALIDACAO), 'acertos': len(CORPUS_VALIDACAO) - len(falhas), 'falhas': falhas}
+
+
+# Tuplas digitadas como no SQL e os valores que devem chegar a colunas de texto
+CORPUS_TUPLAS = [
+    ("(101, 'ABC', 123)", ('101', 'ABC', '123')),
+    ("(1, 'D''Ávila', NULL)", ('1', "D'Ávila", None)),
+    ("(2, 'Hotel Null Point', 'NULL')", ('2', 'Hotel Null Point', 'NULL')),
+    ("(3, 'C:\\new', 'a, b')", ('3', 'C:\\new', 'a, b')),
+    ("(4, '''citado''', '')", ('4', "'citado'", '')),
+]
+
+
+def medir_leitura_tuplas() -> dict:
+    falhas = []
+    for indice, (texto, esperado) in enumerate(CORPUS_TUPLAS):
+        try:
+            lido = tuple(T._converter('HOTEL', 'nome', 'varchar', valor) for valor in T.ler_tupla(texto))
+        except ValueError:
+            lido = None
+        if lido != esperado:
+            falhas.append(indice)
+    return {'casos': len(CORPUS_TUPLAS), 'acertos': len(CORPUS_TUPLAS) - len(falhas), 'falhas': falhas}
+
+
+def executar_escala(escala: float, args) -> dict:
+    resultado = {}
+    T.metricas.limpar()
+    with T.obter_pool().conexao() as conn:
+        cronometrar(lambda: T.remover_todas_as_tabelas(conn))
+        resultado['criar_todas_as_tabelas_s'] = round(cronometrar(lambda: T.criar_todas_as_tabelas(conn)), 3)
+        gerador = T.GeradorDados(escala)
+        carga = cronometrar(lambda: T.gerar_dados_sinteticos(conn, escala))
+        resultado['carga'] = {'linhas': gerador.total_linhas(), 'segundos': round(carga, 3),
+                              'linhas_por_s': round(gerador.total_linhas() / carga, 1)}
+        _analisar(conn)
+        resultado['crud'] = medir_crud(conn, args.operacoes)
+        resultado['crud_em_lote'] = medir_crud_em_lote(conn, args.operacoes * 20)
+        resultado['consultas'] = medir_consultas(conn, args.repeticoes)
+        resultado['consultas_parquet'] = medir_consultas_parquet(conn, args.repeticoes)
+        resultado['faturamento'] = medir_faturamento(conn, args.repeticoes)
+        resultado['consulta_individual'] = medir_consulta_individual(conn, ['RESERVA', 'PEDIDO'])
+        resultado['text2sql'] = medir_text2sql(conn, args.repeticoes)
+        resultado['text2sql_exemplos'] = medir_text2sql_exemplos(conn)
+    resultado['comandos_mais_custosos'] = _comandos_mais_custosos(10)
+    return resultado
+
+
+def _comandos_mais_custosos(limite: int) -> list:
+    # Registrado pelo cursor instrumentado: onde o tempo no banco foi gasto nesta escala
+    estatisticas = sorted(T.metricas.instantaneo().items(), key=lambda item: item[1]['segundos'], reverse=True)
+    return [{'impressao': impressao, 'sql': e['sql'][:200], 'chamadas': e['chamadas'],
+             'segundos': round(e['segundos'], 4), 'linhas': e['linhas'], 'bytes': e['bytes']}
+            for impressao, e in estatisticas[:limite]]
+
+
+MODULOS_PESADOS = ('google.genai', 'matplotlib', 'numpy', 'asyncio', 'asyncpg')
+
+_SCRIPT_INICIALIZACAO = (
+    "import sys, json, time; inicio = time.perf_counter(); import TrabalhoFinal; "
+    "print(json.dumps({'import_s': time.perf_counter() - inicio, "
+    "'carregados': [m for m in %r if m in sys.modules]}))" % (MODULOS_PESADOS,)
+)
+
+
+def medir_inicializacao(repeticoes: int) -> dict:
+    """
+    Mede o import do TrabalhoFinal em processos novos, como numa sessão de CRUD
+    que não chega a usar o Text2SQL nem os gráficos. Também informa as maiores
+    parcelas do relatório -X importtime e quais módulos pesados foram
+    carregados no caminho.
+    """
+    diretorio = os.path.dirname(os.path.abspath(__file__))
+    amostras, processo = [], None
+    for _ in range(repeticoes):
+        processo = subprocess.run([sys.executable, '-X', 'importtime', '-c', _SCRIPT_INICIALIZACAO],
+                                  capture_output=True, text=True, cwd=diretorio, check=True)
+        amostras.append(json.loads(processo.stdout.strip().splitlines()[-1])['import_s'])
+
+    # Linhas "import time: self | cumulative | pacote"; os imports diretos do
+    # TrabalhoFinal aparecem um nível abaixo dele e logo antes da sua linha
+    parcelas, diretos = [], []
+    for linha in processo.stderr.splitlines():
+        partes = linha.split('|')
+        if len(partes) != 3 or not partes[1].strip().isdigit():
+            continue
+        nivel = (len(partes[2]) - len(partes[2].lstrip()) - 1) // 2
+        if nivel == 1:
+            diretos.append((partes[2].strip(), int(partes[1])))
+        elif nivel == 0:
+            if partes[2].strip() == 'TrabalhoFinal':
+                parcelas = diretos
+            diretos = []
+    parcelas.sort(key=lambda p: p[1], reverse=True)
+    return {
+        'import': percentis(amostras),
+        'carregados': json.loads(processo.stdout.strip().splitlines()[-1])['carregados'],
+        'maiores_imports_ms': {nome: round(us / 1000, 3) for nome, us in parcelas[:5]},
+    }
+
+
+# Comparação com uma execução anterior
+
+def _metricas(no, caminho=()):
+    if isinstance(no, dict):
+        for chave, valor in no.items():
+            yield from _metricas(valor, caminho + (str(chave),))
+    elif isinstance(no, (int, float)) and caminho[-1].endswith(('_ms', '_s', 'segundos', '_por_s')):
+        yield "/".join(caminho), no
+
+
+def comparar(atual: dict, anterior: dict, tolerancia: float) -> list:
+    def secoes(relatorio):
+        return {chave: relatorio[chave] for chave in ('inicializacao', 'extracao_sql', 'escalas') if chave in relatorio}
+
+    antigas = dict(_metricas(secoes(anterior)))
+    regressoes = []
+    for caminho, valor in _metricas(secoes(atual)):
+        antigo = antigas.get(caminho)
+        if not antigo:
+            continue
+        # Nas métricas de vazão maior é melhor; nas de tempo, menor é melhor
+        razao = antigo / valor if caminho.endswith('_por_s') else valor / antigo
+        if razao > 1 + tolerancia:
+            regressoes.append((caminho, antigo, valor, razao))
+    # Acerto dos corpora (extração, validação, tuplas): qualquer caso a menos é regressão
+    for secao in ('extracao_sql', 'validacao_sql', 'leitura_tuplas'):
+        antes = anterior.get(secao, {}).get('acertos')
+        agora = atual.get(secao, {}).get('acertos')
+        if antes and agora is not None and agora < antes:
+            regressoes.append((f'{secao}/acertos', antes, agora, antes / max(agora, 1)))
+    # Acerto da recuperação de exemplos: qualquer queda é regressão
+    for escala, medicao in atual.get('escalas', {}).items():
+        for metrica in ('acerto_top1', 'acerto_top_k'):
+            antes = anterior.get('escalas', {}).get(escala, {}).get('text2sql_exemplos', {}) \
+                .get('recuperacao', {}).get(metrica)
+            agora = medicao.get('text2sql_exemplos', {}).get('recuperacao', {}).get(metrica)
+            if antes and agora is not None and agora < antes:
+                regressoes.append((f"escalas/{escala}/text2sql_exemplos/recuperacao/{metrica}",
+                                   antes, agora, antes / max(agora, 1e-9)))
+    return regressoes
+
+
+def _commit_atual() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do sistema de gestão hoteleira")
+    parser.add_argument('--escalas', default='0.01,0.1', help="fatores de escala separados por vírgula")
+    parser.add_argument('--repeticoes', type=int, default=20, help="repetições por consulta")
+    parser.add_argument('--operacoes', type=int, default=500, help="operações de insert/update/delete")
+    parser.add_argument('--banco', default=f"{T.DB_NAME}_benchmark", help="banco criado para o benchmark")
+    parser.add_argument('--latencia-modelo', type=float, default=0.05, help="latência simulada do modelo (s)")
+    parser.add_argument('--saida', default='benchmark.json')
+    parser.add_argument('--comparar', help="JSON de uma execução anterior")
+    parser.add_argument('--tolerancia', type=float, default=0.10, help="piora aceita antes de acusar regressão")
+    args = parser.parse_args()
+
+    provisionar_banco(args.banco)
+    T.DB_NAME = args.banco
+    T.TEXT2SQL_CACHE = ''
+    T.TEXT2SQL_EXEMPLOS = ''
+    T.GEMINI_API_KEY, T.GEMINI_MODEL = 'stub', 'stub-model'
+    servidor = iniciar_modelo_stub(args.latencia_modelo)
+    T.GEMINI_BASE_URL = f"http://127.0.0.1:{servidor.server_address[1]}"
+    T._cliente_gemini.cache_clear()
+
+    with T.obter_pool().conexao() as conn:
+        versao = T._versao_servidor(conn)
+
+    relatorio = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_atual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'postgres': versao,
+        'parametros': {'repeticoes': args.repeticoes, 'operacoes': args.operacoes,
+                       'latencia_modelo_s': args.latencia_modelo},
+        'inicializacao': medir_inicializacao(args.repeticoes),
+        'extracao_sql': medir_extracao_sql(args.repeticoes),
+        'validacao_sql': medir_validacao_sql(),
+        'leitura_tuplas': medir_leitura_tuplas(),
+        'escalas': {},
+    }
+    for escala in (float(e) for e in args.escalas.split(',')):
+        print(f"Escala {escala}...", flush=True)
+        relatorio['escalas'][str(escala)] = executar_escala(escala, args)
+
+    servidor.shutdown()
+    T.obter_pool().fechar()
+
+    with open(args.saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+    print(f"Resultados gravados em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            regressoes = comparar(relatorio, json.load(arquivo), args.tolerancia)
+        for caminho, antigo, novo, razao in regressoes:
+            print(f"REGRESSÃO {caminho}: {antigo} -> {novo} ({razao:.2f}x)")
+        if regressoes:
+            sys.exit(1)
+        print("Nenhuma regressão acima da tolerância.")
+
+
+if __name__ == "__main__":
+    main()